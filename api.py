@@ -0,0 +1,311 @@
+'''These functions are built for embedding the scanner in another program rather
+than running it from the command line. Scan takes the targets and ports written
+the same way as port_scanner.py's hosts argument and -p, and everything else as
+keyword options, and returns an iterator which yields a Result for every target
+as its connect finishes, while the scan carries on in the background. Scan async
+returns the same thing as an async iterator for programs which already have an
+event loop running. Either can be stopped early, by breaking out and calling
+cancel or leaving the with block, or by asking for first_open, which stops
+scanning a host once an open port is found on it, as a liveness check would.
+Only the standard library pieces this module needs are imported with it, the
+scanner itself is loaded the first time a scan is run and asyncio only for async
+scans or the async engine.
+
+    from api import scan
+    with scan('10.0.0.0/24', '22,80,443', states={'open'}) as results:
+        for result in results:
+            print(result.host, result.port, result.latency)'''
+import queue
+import threading
+from collections import namedtuple
+from types import SimpleNamespace
+
+# One finished target. State is one of open, closed, filtered, resource or error,
+# and latency how long the connect took in seconds.
+Result = namedtuple('Result', ['host', 'port', 'state', 'latency'])
+
+# The options scan takes, and their defaults, named after the command line options
+DEFAULT_OPTIONS = {'engine': 'thread', 'timeout': 1, 'num_threads': None, 'per_host': None,
+                   'randomize': False, 'rate': None, 'host_rate': None, 'congestion': False,
+                   'adaptive_timeout': False, 'min_timeout': 0.05, 'max_timeout': None,
+                   'dns_ttl': 300, 'verbosity': 0, 'states': None, 'first_open': False}
+
+# The most results held for a consumer which has fallen behind before the scan
+# waits for it to catch up
+QUEUE_SIZE = 1024
+
+# Seconds between checks for a cancel while waiting on the consumer
+WAIT_INTERVAL = 0.1
+
+# Put on the queue after the last result
+FINISHED = object()
+
+class Scan:
+    '''The iterator scan returns. The scan starts on a background thread the first
+    time a result is asked for, and hands each result over through a bounded queue,
+    so a slow consumer holds the scan back rather than the results piling up.
+    Cancel stops the scan, waiting for the connects already in flight to finish,
+    and is called when leaving a with block.'''
+    def __init__(self, targets, ports, options):
+        self.targets = targets
+        self.ports = ports
+        self.options = options
+        self.results = queue.Queue(QUEUE_SIZE)
+        self.filter = ResultFilter(options)
+        self.scanner = None
+        self.thread = None
+        self.error = None
+        self.done = False
+
+    def start(self):
+        '''Builds the scan engine and starts it on a background thread'''
+        self.scanner = build_scanner(self.targets, self.ports, self.options, self.put)
+        self.filter.scanner = self.scanner
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        '''Runs the scan to the end, keeping any error to raise to the consumer'''
+        try:
+            self.scanner.scan(None, self.options.timeout)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.put_result(FINISHED)
+
+    def put(self, host, port, result, latency):
+        '''Called by the engine as every target finishes'''
+        record = self.filter.result(host, port, result, latency)
+        if record:
+            self.put_result(record)
+
+    def put_result(self, record):
+        '''Waits for room on the queue, giving up once the scan's been cancelled'''
+        while not self.done:
+            try:
+                self.results.put(record, timeout=WAIT_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def cancel(self):
+        '''Stops the scan and waits for the engine to wind down'''
+        if self.scanner:
+            self.scanner.stop()
+        self.done = True
+        if self.thread:
+            self.thread.join()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.thread is None and not self.done:
+            self.start()
+        if self.done:
+            raise StopIteration
+        record = self.results.get()
+        if record is FINISHED:
+            self.done = True
+            self.thread.join()
+            if self.error:
+                raise self.error
+            raise StopIteration
+        return record
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cancel()
+
+class AsyncScan:
+    '''The async iterator scan async returns, started on the running event loop the
+    first time a result is awaited. Either way no more than QUEUE_SIZE results wait
+    for the consumer. With the asyncio engine the scan runs as a task on the same
+    loop as the consumer, and each worker coroutine waits for room on the queue
+    before moving on. With the threaded engine it runs on the loop's executor, and
+    the scan threads wait on a semaphore of the room left. Cancel is a coroutine
+    here, and is awaited when leaving an async with block.'''
+    def __init__(self, targets, ports, options):
+        self.targets = targets
+        self.ports = ports
+        self.options = options
+        self.filter = ResultFilter(options)
+        self.results = None
+        self.room = None
+        self.loop = None
+        self.scanner = None
+        self.task = None
+        self.done = False
+
+    def start(self):
+        '''Builds the scan engine and starts the scan on the running loop'''
+        import asyncio
+        self.loop = asyncio.get_running_loop()
+        if self.options.engine == 'async':
+            self.results = asyncio.Queue(QUEUE_SIZE)
+        else:
+            self.results = asyncio.Queue()
+            self.room = threading.BoundedSemaphore(QUEUE_SIZE)
+        self.scanner = build_scanner(self.targets, self.ports, self.options, self.put)
+        self.filter.scanner = self.scanner
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        '''Runs the scan to the end, then marks the end of the results'''
+        try:
+            if self.options.engine == 'async':
+                await self.scanner.scan_async(None, self.options.timeout)
+            else:
+                await self.loop.run_in_executor(None, self.scanner.scan, None,
+                                                self.options.timeout)
+        finally:
+            if not self.done:
+                await self.results.put(FINISHED)
+
+    def put(self, host, port, result, latency):
+        '''Called by the engine as every target finishes. For the asyncio engine it
+        returns the put for the worker to wait on, for the threaded one it's called
+        from a scan thread, which blocks until there's room.'''
+        record = self.filter.result(host, port, result, latency)
+        if not record or self.done:
+            return None
+        if not self.room:
+            return self.results.put(record)
+        while not self.room.acquire(timeout=WAIT_INTERVAL):
+            if self.done:
+                return None
+        self.loop.call_soon_threadsafe(self.results.put_nowait, record)
+
+    async def cancel(self):
+        '''Stops the scan and waits for the engine to wind down, emptying the queue
+        as it goes so no worker is left waiting for room on it'''
+        import asyncio
+        if self.scanner:
+            self.scanner.stop()
+        self.done = True
+        if not self.task:
+            return
+        while not self.task.done():
+            while not self.results.empty():
+                self.results.get_nowait()
+            await asyncio.wait([self.task], timeout=WAIT_INTERVAL)
+        try:
+            self.task.result()
+        except Exception:
+            pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.task is None and not self.done:
+            self.start()
+        if self.done:
+            raise StopAsyncIteration
+        record = await self.results.get()
+        if self.room and record is not FINISHED:
+            self.room.release()
+        if record is FINISHED:
+            self.done = True
+            await self.task
+            raise StopAsyncIteration
+        return record
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.cancel()
+
+class ResultFilter:
+    '''Turns what the engine reports into Results, leaving out the states that
+    weren't asked for. With first_open the host of the first open port found on it
+    is added to the engine's skip hosts, so none of its remaining ports are
+    connected to, and anything else still finishing on it is dropped. The lock is
+    for the threaded engine, where two threads could find a host open at once.'''
+    def __init__(self, options):
+        from scan_threader import probe_state
+        self.probe_state = probe_state
+        self.states = set(options.states) if options.states else None
+        self.first_open = options.first_open
+        self.scanner = None
+        self.lock = threading.Lock()
+
+    def result(self, host, port, result, latency):
+        '''Returns the Result for a finished target, or None if it's left out'''
+        state = self.probe_state(result)
+        if self.first_open:
+            with self.lock:
+                if host in self.scanner.skip_hosts:
+                    return None
+                if state == 'open':
+                    self.scanner.skip_hosts.add(host)
+        if self.states and state not in self.states:
+            return None
+        return Result(host, port, state, latency)
+
+def scan(targets, ports, **options):
+    '''Scans the ports on the targets and returns a Scan iterator of every Result.
+    Targets and ports can be strings written like port_scanner.py's hosts argument
+    and -p option, or lists of them, and ports a single port number or a list of
+    them. The options are those in DEFAULT_OPTIONS, named after the command line
+    options they match, plus states, a set of the states to yield with everything else left out, and
+    first_open, to stop scanning each host at its first open port.'''
+    return Scan(targets, ports, scan_options(options))
+
+def scan_async(targets, ports, **options):
+    '''Takes the same arguments as scan, and returns an AsyncScan to iterate over
+    with async for'''
+    return AsyncScan(targets, ports, scan_options(options))
+
+def scan_options(options):
+    '''Fills in the defaults for the options not given, as a namespace like the
+    parsed command line arguments'''
+    unknown = set(options) - set(DEFAULT_OPTIONS)
+    if unknown:
+        raise TypeError(f'Unknown scan option(s): {", ".join(sorted(unknown))}')
+    if options.get('engine', 'thread') not in ('thread', 'async'):
+        raise ValueError(f'Unknown engine {options["engine"]!r}, use thread or async')
+    return SimpleNamespace(**{**DEFAULT_OPTIONS, **options})
+
+def build_scanner(targets, ports, options, on_result):
+    '''Parses the targets and ports, resolving any hostnames, and returns the scan
+    engine for every (host, port) pair between them'''
+    from scan_threader import get_scanner
+    from targets import TargetSpace, clean_up_ports
+    from throttle import build_throttle
+
+    hosts = resolve_targets(targets, options)
+    if isinstance(ports, int):
+        ports = str(ports)
+    elif not isinstance(ports, str):
+        ports = [str(port) for port in ports]
+    timing = None
+    if options.adaptive_timeout:
+        from timing import RttEstimator, RttTable
+        timing = RttTable(lambda host: RttEstimator(options.timeout, options.min_timeout,
+                                                    options.max_timeout or options.timeout))
+    scanner = get_scanner(options.engine)
+    return scanner('Port Scan', TargetSpace(hosts, clean_up_ports(ports), options.randomize),
+                   options.num_threads, options.verbosity, per_host=options.per_host,
+                   timing=timing, throttle=build_throttle(options), on_result=on_result)
+
+def resolve_targets(targets, options):
+    '''Returns the AddressSet of the targets, with any hostnames swapped for the
+    addresses they resolve to. The resolver is only loaded if there are names.'''
+    from targets import AddressSet, clean_up_ips
+
+    hosts = clean_up_ips(targets if isinstance(targets, str)
+                         else [str(target) for target in targets])
+    if not hosts.names:
+        return hosts
+    from resolver import DnsCache
+    resolved = AddressSet()
+    resolved.addresses.update(hosts.addresses)
+    dns = DnsCache(options.dns_ttl, options.num_threads, options.verbosity)
+    for addresses in dns.resolve(list(hosts.names)).values():
+        for address in addresses:
+            resolved.add(address)
+    return resolved
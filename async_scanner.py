@@ -0,0 +1,244 @@
+'''This class is an alternative to the ScanThreader that uses asyncio instead of
+OS threads. Each connect is a non-blocking socket awaited on the event loop, so
+ten thousand concurrent connects cost ten thousand coroutines rather than ten
+thousand thread stacks. It keeps the same interface as ScanThreader so Host and
+Network can swap between the two engines with the --engine option.'''
+import asyncio
+import errno
+import heapq
+import inspect
+import itertools
+import math
+import platform
+import socket
+import time
+from contextlib import nullcontext
+
+import metrics
+from resources import RESOURCE_ERRORS, cap_concurrency, reset_on_close
+from scan_threader import describe_result, probe_state, report_resource_errors
+
+# Used when the user doesn't provide -n, large enough to keep the event loop
+# busy while staying well under the default file descriptor limit on most systems
+DEFAULT_CONCURRENCY = 1000
+
+# The connect timeouts are checked together on ticks this many seconds apart, so
+# a connect can run over its timeout by at most this much
+SWEEP_INTERVAL = 0.005
+
+class AsyncScanner:
+    '''The class recognizes the same two scan types as ScanThreader, Ping Sweep
+    or Port Scan, and takes the same arguments. The number of threads is reused
+    as the concurrency limit, which is the number of worker coroutines pulling
+    targets off of a shared iterator. If it isn't provided it takes half of the
+    targets like ScanThreader does, but capped at DEFAULT_CONCURRENCY since every
+    in flight connect still holds a file descriptor.'''
+    def __init__(self, scan_type, scan_items, num_threads, verbosity, per_host=None,
+                 timing=None, throttle=None, on_result=None, banners=None):
+        self.scan_type = scan_type
+        self.scan_items = scan_items
+        self.num_threads = cap_concurrency(
+            num_threads or min(int((len(scan_items)+1)/2), DEFAULT_CONCURRENCY), verbosity,
+            banners.sockets if banners else 0)
+        self.verbosity = verbosity
+        self.per_host = per_host
+        self.timing = timing or {}
+        self.throttle = throttle
+        self.on_result = on_result
+        self.banners = banners
+        self.banner_tasks = []
+        self.metrics = metrics.current()
+
+        self.scan_results = set()
+        self.remaining = 0
+        self.resource_errors = 0
+        self.stopped = False
+        self.skip_hosts = set()
+        self.host_slots = {}
+        self.deadlines = []
+        self.sequence = itertools.count()
+        self.sweep_at = None
+        self.sweep_handle = None
+
+        if self.scan_type == "Ping Sweep":
+            self.param = '-n' if platform.system().lower()=='windows' else '-c'
+
+    async def scan_target(self, target, host, timeout):
+        '''Core functionality for handling a singular port scan, or a singular
+        ping to a host. Returns the errno the connect ended with, 0 when the port
+        is open or the host is up. The throttle is waited on without blocking the
+        event loop, and an open socket is handed to a banner task of its own so
+        the worker moves straight on. If on_result returns an awaitable, such as
+        putting the result on a bounded queue, the coroutine waits on it before
+        moving on, so whoever is taking the results can hold the scan back.'''
+        if self.scan_type == 'Port Scan':
+            estimator = self.timing.get(host)
+            async with self.host_slot(host):
+                if self.throttle:
+                    await self.throttle.acquire_async(host)
+                started = time.monotonic()
+                kept = None
+                try:
+                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                        sock.setblocking(False)
+                        result = await self.connect(sock, (host, target),
+                                                    estimator.timeout() if estimator else timeout)
+                        if result == 0 and self.banners:
+                            kept = socket.socket(fileno=sock.detach())
+                            kept.setblocking(False)
+                        elif result == 0:
+                            reset_on_close(sock)
+                except OSError as error:
+                    result = error.errno or errno.EIO
+                latency = time.monotonic() - started
+                if estimator and result in (0, errno.ECONNREFUSED):
+                    estimator.update(latency)
+                if self.throttle:
+                    self.throttle.release(host, result)
+                if result in RESOURCE_ERRORS:
+                    self.resource_errors += 1
+                self.metrics.probe(probe_state(result), latency)
+                if self.on_result:
+                    waiting = self.on_result(host, target, result, latency)
+                    if inspect.isawaitable(waiting):
+                        await waiting
+                if kept:
+                    self.banner_tasks.append(await self.banners.submit_async(kept, host, target))
+                return result
+        elif self.scan_type == 'Ping Sweep':
+            process = await asyncio.create_subprocess_exec(
+                'ping', self.param, '1', target,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            data = (await process.communicate())[0].decode()
+            up = ('unreachable' not in data and 'Request timed out' not in data
+            or 'bytes from' in data)
+            if self.on_result:
+                waiting = self.on_result(target, None, 0 if up else errno.ETIMEDOUT, None)
+                if inspect.isawaitable(waiting):
+                    await waiting
+            return 0 if up else errno.ETIMEDOUT
+        return "Scan type malformed"
+
+    def host_slot(self, host):
+        '''Returns the semaphore limiting concurrent connects to a host, or a
+        null context when there is no per host limit'''
+        if not self.per_host:
+            return nullcontext()
+        if host not in self.host_slots:
+            self.host_slots[host] = asyncio.Semaphore(self.per_host)
+        return self.host_slots[host]
+
+    async def connect(self, sock, address, timeout):
+        '''Starts a non-blocking connect and waits for the socket to become
+        writable or for the timeout, returning the errno of the attempt. This
+        is done directly on the loop rather than with sock_connect and wait_for
+        because on loopback most connects finish immediately, and the extra
+        task wait_for creates per connect ends up costing more than the connect.
+        Rather than a timer per connect, the deadline goes on a heap shared by
+        every connect, which sweep works through. On loopback and other fast
+        paths the handshake has usually been answered by the time connect_ex
+        returns, so asking again straight away saves going through the selector.'''
+        result = sock.connect_ex(address)
+        if result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            result = sock.connect_ex(address)
+            if result == errno.EISCONN:
+                return 0
+        if result not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            return result
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        fileno = sock.fileno()
+
+        def on_writable():
+            if not waiter.done():
+                waiter.set_result(sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR))
+
+        loop.add_writer(fileno, on_writable)
+        deadline = loop.time() + timeout
+        heapq.heappush(self.deadlines, (deadline, next(self.sequence), waiter))
+        self.schedule_sweep(loop, deadline)
+        try:
+            return await waiter
+        finally:
+            loop.remove_writer(fileno)
+
+    def schedule_sweep(self, loop, deadline):
+        '''Makes sure a sweep is due by the first SWEEP_INTERVAL tick after deadline,
+        so deadlines close together share one timer'''
+        tick = math.ceil(deadline / SWEEP_INTERVAL) * SWEEP_INTERVAL
+        if self.sweep_handle and self.sweep_at <= tick:
+            return
+        if self.sweep_handle:
+            self.sweep_handle.cancel()
+        self.sweep_at = tick
+        self.sweep_handle = loop.call_at(tick, self.sweep, loop)
+
+    def sweep(self, loop):
+        '''Times out every connect whose deadline has passed, skipping those that
+        already finished, then schedules the next sweep if any are left'''
+        self.sweep_handle = None
+        now = loop.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            waiter = heapq.heappop(self.deadlines)[2]
+            if not waiter.done():
+                waiter.set_result(errno.ETIMEDOUT)
+        if self.deadlines:
+            self.schedule_sweep(loop, self.deadlines[0][0])
+
+    async def scan_worker(self, targets, host, timeout):
+        '''A worker coroutine, the asyncio equivalent of a scan thread. Since
+        the event loop is single threaded the shared iterator needs no lock.
+        Targets on a host in skip hosts are passed over like they are there.'''
+        for item in targets:
+            if self.stopped:
+                return
+            self.remaining -= 1
+            self.metrics.gauge('scan_queue_depth', self.remaining)
+            target_host, target = (item if host is None and self.scan_type == 'Port Scan'
+                                   else (host, item))
+            if target_host in self.skip_hosts:
+                continue
+            result = await self.scan_target(target, target_host, timeout)
+            if result == 0:
+                self.scan_results.add(item)
+                if self.verbosity >= 1:
+                    with self.metrics.timer('scan_print_seconds_total'):
+                        print(describe_result(self.scan_type, target, target_host, result))
+            elif self.verbosity >= 2:
+                with self.metrics.timer('scan_print_seconds_total'):
+                    print(describe_result(self.scan_type, target, target_host, result))
+
+    def stop(self):
+        '''Stops the scan, each worker finishing the target it's on and taking no
+        more. The workers only read the flag, so it's safe to set from another thread.'''
+        self.stopped = True
+
+    async def scan_async(self, host=None, timeout=1):
+        '''Starts the worker coroutines and waits for all of them to drain the
+        targets, for callers which already have an event loop running'''
+        targets = iter(self.scan_items)
+        self.remaining = len(self.scan_items)
+        self.metrics.gauge('scan_threads', self.num_threads)
+        if self.throttle:
+            self.throttle.start(self.num_threads)
+        if self.banners:
+            self.banners.start_async()
+        if self.verbosity > 2:
+            print(f'Creating {self.num_threads} worker coroutines...')
+        await asyncio.gather(*(self.scan_worker(targets, host, timeout)
+                               for _ in range(self.num_threads)))
+        if self.sweep_handle:
+            self.sweep_handle.cancel()
+            self.sweep_handle = None
+        self.deadlines = []
+        await asyncio.gather(*self.banner_tasks)
+        self.banner_tasks = []
+        if self.throttle and self.verbosity >= 1:
+            print(self.throttle)
+        report_resource_errors(self.resource_errors)
+        return self.scan_results
+
+    def scan(self, host=None, timeout=1):
+        '''Runs the scan on a fresh event loop then returns results'''
+        return asyncio.run(self.scan_async(host, timeout))
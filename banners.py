@@ -0,0 +1,145 @@
+'''This class is built for identifying services without connecting to them a
+second time. When banners are asked for, the scan hands each socket it finds
+open over to the BannerGrabber instead of closing it, and the grabber reads
+whatever the service says first, within a deadline, while the scan carries on.
+Services that wait for the client to speak first, like HTTP, can be sent a probe
+once half of the deadline has passed in silence. The threaded engine reads the
+banners from a small pool of threads of their own, while the asyncio engine
+reads them in tasks on its event loop. Every socket handed over still holds a file
+descriptor and a local port, so only so many can be waiting on or being read for
+a banner at once, and the scan hands over the next one only when one is closed.'''
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from resources import max_concurrency, reset_on_close
+
+# The most bytes read from any one service
+BANNER_BYTES = 1024
+
+# The most threads reading banners at once for the threaded engine
+BANNER_THREADS = 32
+
+# The most open sockets waiting on or being read for banners at once
+MAX_BANNER_SOCKETS = 256
+
+# Requests sent to a service that stays silent, by the name given to --banner_probe
+PROBES = {'http': b'HEAD / HTTP/1.0\r\n\r\n', 'none': None}
+
+class BannerGrabber:
+    '''Timeout is the most time spent reading each banner, and probe the bytes sent
+    to services that haven't said anything by half way through it, or None to only
+    listen. Banners maps each (host, port) pair to the text read from it, pairs that
+    sent nothing are left out. Sockets is how many can be handed over at once, the
+    scan engines take it out of their own concurrency so that the two together
+    stay inside the limits.'''
+    def __init__(self, timeout, probe=None):
+        self.timeout = timeout
+        self.probe = probe
+        self.banners = {}
+        self.lock = threading.Lock()
+        self.sockets = banner_sockets()
+        self.slots = None
+        self.executor = None
+
+    def start(self, num_threads):
+        '''Starts the pool of banner reading threads, for the threaded engine'''
+        self.slots = threading.BoundedSemaphore(self.sockets)
+        self.executor = ThreadPoolExecutor(max(1, min(num_threads, BANNER_THREADS)))
+
+    def start_async(self):
+        '''Sets up the limit on sockets handed over, for the asyncio engine'''
+        import asyncio
+        self.slots = asyncio.Semaphore(self.sockets)
+
+    def submit(self, sock, host, port):
+        '''Hands over a connected socket to be read from and closed by the pool,
+        waiting until there's room for it'''
+        self.slots.acquire()
+        self.executor.submit(self.grab, sock, host, port)
+
+    async def submit_async(self, sock, host, port):
+        '''Hands over a connected socket to be read from and closed in a task of its
+        own, waiting until there's room for it, and returns the task'''
+        import asyncio
+        await self.slots.acquire()
+        return asyncio.ensure_future(self.grab_async(sock, host, port))
+
+    def finish(self):
+        '''Waits for the banners still being read, then shuts the pool down'''
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def grab(self, sock, host, port):
+        '''Reads one banner on a blocking socket and closes it'''
+        try:
+            with sock:
+                try:
+                    sock.settimeout(self.timeout / 2 if self.probe else self.timeout)
+                    try:
+                        data = sock.recv(BANNER_BYTES)
+                    except TimeoutError:
+                        if not self.probe:
+                            raise
+                        sock.sendall(self.probe)
+                        sock.settimeout(self.timeout / 2)
+                        data = sock.recv(BANNER_BYTES)
+                except OSError:
+                    data = b''
+                reset_on_close(sock)
+        finally:
+            self.slots.release()
+        self.store(host, port, data)
+
+    async def grab_async(self, sock, host, port):
+        '''Reads one banner on a non-blocking socket and closes it, for the asyncio
+        engine'''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        try:
+            with sock:
+                try:
+                    try:
+                        data = await asyncio.wait_for(
+                            loop.sock_recv(sock, BANNER_BYTES),
+                            self.timeout / 2 if self.probe else self.timeout)
+                    except TimeoutError:
+                        if not self.probe:
+                            raise
+                        await loop.sock_sendall(sock, self.probe)
+                        data = await asyncio.wait_for(loop.sock_recv(sock, BANNER_BYTES),
+                                                      self.timeout / 2)
+                except OSError:
+                    data = b''
+                reset_on_close(sock)
+        finally:
+            self.slots.release()
+        self.store(host, port, data)
+
+    def store(self, host, port, data):
+        '''Keeps the banner, if the service sent one'''
+        banner = clean_banner(data)
+        metrics.current().count('scan_banners_total', state='read' if banner else 'empty')
+        if banner:
+            with self.lock:
+                self.banners[(host, port)] = banner
+
+def clean_banner(data):
+    '''Turns the bytes read into printable text, dropping blank lines and anything
+    that isn't printable'''
+    text = data.decode('utf-8', 'replace')
+    lines = (''.join(char for char in line if char.isprintable()).strip()
+             for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+def banner_sockets():
+    '''The most sockets to hold open for banners at once, a quarter of the connects
+    the limits allow, up to MAX_BANNER_SOCKETS'''
+    return max(1, min(MAX_BANNER_SOCKETS, max_concurrency() // 4))
+
+def build_grabber(args):
+    '''Returns a BannerGrabber if banners were asked for, otherwise None'''
+    if not args.banners:
+        return None
+    return BannerGrabber(args.banner_timeout, PROBES[args.banner_probe])
@@ -0,0 +1,295 @@
+'''
+This program measures how fast the scan engines are against a local listener
+farm, so changes to the scanner can be compared on numbers rather than anecdote.
+The farm binds a set of loopback addresses, and on each one opens N listening
+ports which accept, M ports which refuse, and F "filtered" ports whose listeners
+have a full accept queue and are never accepted from, so the kernel drops any
+further SYNs and connects to them wait out the timeout like a firewalled port.
+
+Each scenario (Host.scan_host, Network.scan_hosts and Network.ping_sweep) runs
+in a fresh process, so peak threads, file descriptors and memory belong to that
+run alone. The port scans run once per engine. The ping sweep doesn't go through
+the engines unless it runs the system ping binary, so it runs once, labelled by
+its -pm method, and once per engine only with -pm system. The report is JSON
+with the wall time, ports per second, p50/p99 connect latency, peak threads,
+peak FDs and peak RSS of every run.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from port_scanner import build_parser
+
+# How often the sampler thread checks threads, FDs and memory during a run
+SAMPLE_INTERVAL = 0.01
+
+class ListenerFarm:
+    '''Binds the open, closed and filtered ports on each of the loopback addresses,
+    keeping one thread to accept and close connections to the open ports so their
+    accept queues never fill'''
+    def __init__(self, addresses, num_open, num_closed, num_filtered):
+        self.addresses = addresses
+        self.listeners = []
+        self.filtered = []
+        self.fillers = []
+        self.open_ports = set()
+        self.ports = set()
+
+        for address in addresses:
+            for _ in range(num_open):
+                sock = socket.create_server((address, 0), backlog=1024)
+                sock.setblocking(False)
+                self.listeners.append(sock)
+                self.open_ports.add((address, sock.getsockname()[1]))
+            for _ in range(num_closed):
+                with socket.socket() as sock:
+                    sock.bind((address, 0))
+                    self.ports.add(sock.getsockname()[1])
+            for _ in range(num_filtered):
+                sock = socket.create_server((address, 0), backlog=0)
+                self.filtered.append(sock)
+                self.fill_queue(address, sock.getsockname()[1])
+        self.ports.update(port for _, port in self.open_ports)
+        self.ports.update(sock.getsockname()[1] for sock in self.filtered)
+
+        self.running = True
+        self.thread = threading.Thread(target=self.accept, daemon=True)
+        self.thread.start()
+
+    def fill_queue(self, address, port):
+        '''Connects to a filtered listener until its accept queue is full, after
+        which the kernel drops new SYNs instead of answering them'''
+        while True:
+            sock = socket.socket()
+            sock.settimeout(0.2)
+            try:
+                sock.connect((address, port))
+            except OSError:
+                sock.close()
+                return
+            self.fillers.append(sock)
+
+    def accept(self):
+        '''Accepts and immediately closes connections to the open ports'''
+        while self.running:
+            for sock in self.listeners:
+                while True:
+                    try:
+                        conn, _ = sock.accept()
+                    except OSError:
+                        break
+                    conn.close()
+            time.sleep(0.001)
+
+    def close(self):
+        '''Stops accepting and closes every socket in the farm'''
+        self.running = False
+        self.thread.join()
+        for sock in self.listeners + self.filtered + self.fillers:
+            sock.close()
+
+class Sampler:
+    '''Polls the thread count, open file descriptors and resident memory of the
+    process in a background thread, keeping the peak of each. Resident memory is read
+    from /proc where it's available, otherwise the process' peak from getrusage.'''
+    def __init__(self):
+        self.peak_threads = 0
+        self.peak_fds = 0
+        self.peak_rss_kb = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        '''Takes samples until stopped, not counting the sampler's own thread'''
+        page_kb = os.sysconf('SC_PAGE_SIZE') // 1024 if hasattr(os, 'sysconf') else 4
+        while self.running:
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+            try:
+                self.peak_fds = max(self.peak_fds, len(os.listdir('/proc/self/fd')))
+                with open('/proc/self/statm', encoding='utf-8') as statm:
+                    rss_kb = int(statm.read().split()[1]) * page_kb
+            except OSError:
+                rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+            self.peak_rss_kb = max(self.peak_rss_kb, rss_kb)
+            time.sleep(SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+
+def percentile(values, fraction):
+    '''Returns the value at the given fraction of the sorted values'''
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run_scenario(scenario, engine, scan_args, expected_open):
+    '''Runs one scenario in the current process and returns its measurements. The
+    scanner's terminal output is thrown away so printing isn't part of the timing.
+    An engine of None leaves the scanner's default, for ping sweeps which don't
+    use it.'''
+    # These are imported here so they're only loaded into the fresh process
+    from host import Host
+    from network import Network
+
+    args = build_parser().parse_args(scan_args + (['-e', engine] if engine else []))
+    latencies = []
+    found = set()
+
+    def record(host, port, result, latency):
+        if latency is not None:
+            latencies.append(latency)
+        if result == 0:
+            found.add((host, port))
+
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, redirect_stdout(devnull):
+        with Sampler() as sampler:
+            start_time = time.perf_counter()
+            if scenario == 'host_scan':
+                host = Host(args.hosts, args, record)
+                host.scan_host()
+                probes = len(host.ports)
+            elif scenario == 'network_scan':
+                network = Network(args, record)
+                network.scan_hosts()
+                probes = len(network.up_hosts) * len(host_ports(args))
+            else:
+                network = Network(args, record)
+                network.ping_sweep()
+                probes = len(network.host_ips)
+            wall = time.perf_counter() - start_time
+
+    if scenario == 'ping_sweep':
+        expected = {(host, None) for host in Network(args).host_ips}
+    else:
+        expected = {tuple(pair) for pair in expected_open}
+        if scenario == 'host_scan':
+            expected = {pair for pair in expected if pair[0] == args.hosts}
+    return {'scenario': scenario, 'engine': engine,
+            'ping': args.ping if scenario == 'ping_sweep' else None,
+            'wall_seconds': round(wall, 4), 'probes': probes,
+            'probes_per_second': round(probes / wall, 1) if wall else None,
+            'latency_p50_ms': ms(percentile(latencies, 0.5)),
+            'latency_p99_ms': ms(percentile(latencies, 0.99)),
+            'peak_threads': sampler.peak_threads, 'peak_fds': sampler.peak_fds,
+            'peak_rss_kb': sampler.peak_rss_kb,
+            'found': len(found), 'expected': len(expected),
+            'missed': len(expected - found)}
+
+def host_ports(args):
+    '''The ports a network scan covers'''
+    from targets import clean_up_ports
+    return clean_up_ports(args.ports)
+
+def ms(seconds):
+    '''Rounds seconds to microsecond precision milliseconds'''
+    return None if seconds is None else round(seconds * 1000, 3)
+
+def run_isolated(scenario, engine, scan_args, expected_open):
+    '''Runs a scenario in a freshly spawned process and returns its measurements'''
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(run_scenario, (scenario, engine, scan_args, expected_open))
+
+def git_version():
+    '''Describes the checked out commit, so reports from different versions can be
+    told apart'''
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    '''Sets up the farm, runs every scenario with every engine, and writes the report'''
+    parser = argparse.ArgumentParser(description='Benchmarks the scan engines against '
+                                     + 'a local listener farm.')
+    parser.add_argument('-a', '--addresses', type=int, default=4,
+                        help='The number of loopback addresses in the farm, from 127.0.0.1')
+    parser.add_argument('-N', '--open', type=int, default=50,
+                        help='Open ports per address')
+    parser.add_argument('-M', '--closed', type=int, default=500,
+                        help='Closed ports per address')
+    parser.add_argument('-F', '--filtered', type=int, default=5,
+                        help='Filtered ports per address')
+    parser.add_argument('-t', '--timeout', type=float, default=0.5,
+                        help='Connect timeout for the scans')
+    parser.add_argument('-n', '--num_threads', type=int,
+                        help='Threads or concurrency for the scans')
+    parser.add_argument('-e', '--engines', type=str, default='thread,async',
+                        help='Comma separated engines to benchmark')
+    parser.add_argument('-s', '--scenarios', type=str,
+                        default='host_scan,network_scan,ping_sweep',
+                        help='Comma separated scenarios to run')
+    parser.add_argument('-ph', '--ping_hosts', type=str, default='127.0.0.0/24',
+                        help='The addresses for the ping sweep scenario')
+    parser.add_argument('-pm', '--ping', type=str, default='auto',
+                        choices=['auto', 'icmp', 'tcp', 'system'],
+                        help='The ping method for the ping sweep scenario')
+    parser.add_argument('-x', '--extra', type=str, default='',
+                        help='Extra port_scanner.py options for every scan, e.g. "-w 4"')
+    parser.add_argument('-o', '--output', type=str,
+                        help='Write the JSON report here instead of to stdout')
+    options = parser.parse_args()
+
+    addresses = [f'127.0.0.{index}' for index in range(1, options.addresses + 1)]
+    farm = ListenerFarm(addresses, options.open, options.closed, options.filtered)
+    try:
+        ports = ','.join(map(str, sorted(farm.ports)))
+        common = ['-p', ports, '-s', '-t', str(options.timeout)] + options.extra.split()
+        if options.num_threads:
+            common += ['-n', str(options.num_threads)]
+        scan_args = {'host_scan': [addresses[0]] + common,
+                     'network_scan': [f'{addresses[0]}-{options.addresses}'] + common,
+                     'ping_sweep': [options.ping_hosts, '-t', str(options.timeout),
+                                    '-pm', options.ping] + options.extra.split()}
+        engines = options.engines.split(',')
+        results = []
+        for scenario in options.scenarios.split(','):
+            runs = engines
+            if scenario == 'ping_sweep' and options.ping != 'system':
+                runs = [None]
+            for engine in runs:
+                result = run_isolated(scenario, engine, scan_args[scenario],
+                                      sorted(farm.open_ports))
+                label = engine or options.ping
+                print(f'{scenario:>12} {label:>6}: {result["probes_per_second"]} probes/s '
+                      f'in {result["wall_seconds"]}s, peak {result["peak_threads"]} threads, '
+                      f'{result["peak_rss_kb"]} KB', file=sys.stderr)
+                results.append(result)
+    finally:
+        farm.close()
+
+    report = {'version': git_version(), 'python': platform.python_version(),
+              'platform': platform.platform(), 'cpus': os.cpu_count(),
+              'farm': {'addresses': options.addresses, 'open': options.open,
+                       'closed': options.closed, 'filtered': options.filtered},
+              'timeout': options.timeout, 'num_threads': options.num_threads,
+              'extra': options.extra, 'results': results}
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+'''This class is built for picking a long scan back up after it's interrupted.
+While the port scan runs, the steps of the TargetSpace's scan order which have
+finished, and the open ports found, are appended to the checkpoint file every few
+seconds as one line of JSON. The steps are kept as merged intervals, and since the
+threads take steps roughly in order a million finished targets usually come down
+to a handful of intervals. Every so often the file is compacted to a header and a
+single line holding everything so far, written to a new file and swapped into
+place so a crash part way through can't leave it unreadable.
+
+The header holds what's needed to rebuild the exact TargetSpace, its hosts after
+the ping sweep, ports, order and seed, so a resumed scan walks the same order and
+only scans the steps that aren't in the checkpoint.'''
+import json
+import os
+import threading
+import time
+
+from distributed import job_spec, space_from_spec
+from targets import IntervalSet
+
+# Seconds between appending progress to the checkpoint
+FLUSH_INTERVAL = 5
+
+# Progress lines appended before the checkpoint is compacted
+COMPACT_EVERY = 100
+
+class Checkpoint:
+    '''Takes the location of the checkpoint file. Load reads an existing one back
+    for a resume, after which resumed_space is the TargetSpace it describes. Record
+    is called from the scan threads for every finished target, so it only appends
+    to a list under the lock, unless it's time to write the progress out.'''
+    def __init__(self, file_location):
+        self.file_location = file_location
+        self.lock = threading.Lock()
+        self.file = None
+        self.header = None
+        self.space = None
+        self.resumed_space = None
+        self.done = IntervalSet()
+        self.open_ports = []
+        self.new_steps = []
+        self.new_open = []
+        self.last_flush = time.monotonic()
+        self.flushes = 0
+
+    def load(self):
+        '''Reads the checkpoint, returning False if there isn't one. Reading stops at
+        the first line that doesn't parse, which can only be a last line cut off
+        when the scan was killed.'''
+        try:
+            with open(self.file_location, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if record['type'] == 'header':
+                        self.header = record
+                        self.done = IntervalSet()
+                        self.open_ports = []
+                    elif record['type'] == 'progress':
+                        self.done.update(IntervalSet(tuple(steps) for steps in record['steps']))
+                        self.open_ports.extend(tuple(found) for found in record['open'])
+        except FileNotFoundError:
+            return False
+        if self.header is None:
+            return False
+        self.resumed_space = space_from_spec(self.header['spec'])
+        return True
+
+    def start(self, args, space, aliases):
+        '''Begins checkpointing a port scan of space and returns the targets that are
+        left to scan. Unless it's the space loaded from the checkpoint, it's a new scan
+        and any earlier progress is dropped.'''
+        with self.lock:
+            if space is not self.resumed_space:
+                self.done = IntervalSet()
+                self.open_ports = []
+            self.space = space
+            self.header = {'type': 'header', 'hosts': args.hosts, 'ports': args.ports,
+                           'aliases': aliases, 'spec': job_spec(args, space)}
+            self.compact()
+        return space.remaining(self.done)
+
+    def record(self, host, port, result, latency):
+        '''Notes a finished target, and writes out progress if it's been long enough'''
+        step = self.space.step(host, port)
+        with self.lock:
+            self.new_steps.append((step, step))
+            if result == 0:
+                self.new_open.append((host, port, latency))
+            if time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+                self.flush()
+
+    def flush(self):
+        '''Appends the progress since the last flush as one line and syncs it to disk,
+        called with the lock held'''
+        self.last_flush = time.monotonic()
+        if not self.new_steps or not self.file:
+            return
+        steps = IntervalSet(self.new_steps)
+        self.file.write(json.dumps({'type': 'progress', 'steps': steps.merged(),
+                                    'open': self.new_open}) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.done.update(steps)
+        self.open_ports.extend(self.new_open)
+        self.new_steps = []
+        self.new_open = []
+        self.flushes += 1
+        if self.flushes >= COMPACT_EVERY:
+            self.compact()
+
+    def compact(self):
+        '''Rewrites the checkpoint as the header and one line of all progress so far,
+        then reopens it for appending, called with the lock held'''
+        if self.file:
+            self.file.close()
+        temporary = f'{self.file_location}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(self.header) + '\n')
+            file.write(json.dumps({'type': 'progress', 'steps': self.done.merged(),
+                                   'open': self.open_ports}) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.file_location)
+        self.file = open(self.file_location, 'a', encoding='utf-8')
+        self.flushes = 0
+
+    def finish(self):
+        '''Writes out the last of the progress and closes the file, called when the
+        port scan ends, or is interrupted'''
+        with self.lock:
+            self.flush()
+            self.compact()
+            self.file.close()
+            self.file = None
+            self.resumed_space = None
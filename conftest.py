@@ -0,0 +1,36 @@
+'''Fixtures shared by the tests, run with python -m pytest'''
+import socket
+
+import pytest
+
+class Listeners:
+    '''Real sockets on 127.0.0.1 for the scans under test to connect to. Open ports
+    are listening, closed ports are bound without listening so connects to them are
+    refused, and both are held until the test is done so nothing else takes them.'''
+    def __init__(self, open_count, closed_count):
+        self.sockets = []
+        self.open = [self.bind(listen=True) for _ in range(open_count)]
+        self.closed = [self.bind(listen=False) for _ in range(closed_count)]
+
+    def bind(self, listen):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        if listen:
+            sock.listen(64)
+        self.sockets.append(sock)
+        return sock.getsockname()[1]
+
+    @property
+    def ports(self):
+        return ','.join(map(str, sorted(self.open + self.closed)))
+
+    def close(self):
+        for sock in self.sockets:
+            sock.close()
+
+@pytest.fixture
+def listeners():
+    '''Three open and five closed ports on loopback'''
+    farm = Listeners(3, 5)
+    yield farm
+    farm.close()
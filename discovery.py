@@ -0,0 +1,207 @@
+'''This class is built for finding live hosts without running the ping binary
+once per host. Where the system allows unprivileged ICMP (Linux datagram ICMP
+sockets, see net.ipv4.ping_group_range) one socket sends an echo request to
+every host and collects the replies as they come in. Otherwise it falls back on
+a TCP "ping", connecting to a handful of commonly open ports, where either a
+completed connection or a refusal shows that something is there to answer.'''
+import errno
+import os
+import select
+import selectors
+import socket
+import struct
+import time
+
+import metrics
+from resources import RESOURCE_ERRORS, cap_concurrency, reset_on_close
+from scan_threader import report_resource_errors
+
+# Ports tried by the TCP ping, a host is up if any of them answers
+DEFAULT_TCP_PORTS = (80, 443, 22, 445, 3389)
+
+# The most TCP ping connects in flight at once when the user doesn't provide -n
+DEFAULT_CONCURRENCY = 512
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+class PingSweeper:
+    '''The sweeper takes the hosts to check, the timeout each host has to answer
+    and the method to use. "auto" tries ICMP first and drops back to TCP if the
+    datagram ICMP socket isn't permitted. Along with the set of live hosts, the
+    round trip time of the first answer from each host is kept in rtts, and
+    passed to on_result as each host is found.'''
+    def __init__(self, hosts, timeout, verbosity, method='auto',
+                 num_threads=None, tcp_ports=DEFAULT_TCP_PORTS, on_result=None):
+        self.hosts = hosts
+        self.timeout = timeout
+        self.verbosity = verbosity
+        self.method = method
+        self.concurrency = cap_concurrency(num_threads or DEFAULT_CONCURRENCY, verbosity)
+        self.tcp_ports = tcp_ports
+        self.on_result = on_result
+
+        self.scan_results = set()
+        self.rtts = {}
+        self.resource_errors = 0
+
+    def sweep(self):
+        '''Runs the sweep with the requested method and returns the live hosts'''
+        if self.method in ('auto', 'icmp'):
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            except OSError:
+                if self.method == 'icmp':
+                    raise
+                if self.verbosity >= 1:
+                    print('ICMP sockets not permitted, falling back to TCP ping...')
+            else:
+                with sock:
+                    self.icmp_sweep(sock)
+                return self.scan_results
+        self.tcp_sweep()
+        return self.scan_results
+
+    def host_up(self, host, rtt):
+        '''Records a host as up the first time it answers'''
+        if host not in self.scan_results:
+            self.scan_results.add(host)
+            self.rtts[host] = rtt
+            if self.on_result:
+                self.on_result(host, None, 0, rtt)
+            if self.verbosity >= 1:
+                print(f'[+] Host {host} is up')
+
+    def icmp_sweep(self, sock):
+        '''Sends an echo request to every host from the one socket, reading any
+        replies between sends so the receive buffer doesn't overflow on large
+        sweeps, then keeps reading until the last request has timed out. Replies
+        are matched to hosts by their source address, and the kernel takes care
+        of the ICMP identifier for datagram sockets.'''
+        sock.setblocking(False)
+        pending = {}
+        names = {}
+        for sequence, host in enumerate(self.hosts):
+            try:
+                with metrics.current().timer('scan_dns_seconds_total'):
+                    address = socket.gethostbyname(host)
+            except OSError:
+                continue
+            names[address] = host
+            packet = echo_request(sequence & 0xffff)
+            while True:
+                try:
+                    sock.sendto(packet, (address, 0))
+                    break
+                except (BlockingIOError, InterruptedError):
+                    self.icmp_receive(sock, pending, names, 0.01)
+                except OSError:
+                    break
+            pending[address] = time.monotonic()
+            self.icmp_receive(sock, pending, names, 0)
+
+        deadline = time.monotonic() + self.timeout
+        while pending and time.monotonic() < deadline:
+            self.icmp_receive(sock, pending, names, deadline - time.monotonic())
+
+    def icmp_receive(self, sock, pending, names, wait):
+        '''Reads every reply waiting on the socket, waiting up to wait seconds
+        for the first one'''
+        if not select.select([sock], [], [], max(wait, 0))[0]:
+            return
+        while True:
+            try:
+                data, (address, _) = sock.recvfrom(1024)
+            except OSError:
+                return
+            if data and data[0] == ICMP_ECHO_REPLY and address in pending:
+                rtt = time.monotonic() - pending.pop(address)
+                if rtt <= self.timeout:
+                    self.host_up(names[address], rtt)
+
+    def tcp_sweep(self):
+        '''Connects to each of the TCP ping ports on every host with non-blocking
+        sockets, all watched by a single selector. A connection or a refusal marks
+        the host up and drops any of its other connects still in flight. A connect
+        which fails for lack of local sockets counts as no answer, and is owned up
+        to at the end.'''
+        selector = selectors.DefaultSelector()
+        probes = ((host, port) for host in self.hosts for port in self.tcp_ports)
+        in_flight = {}
+
+        def finish(sock):
+            selector.unregister(sock)
+            del in_flight[sock]
+            reset_on_close(sock)
+            sock.close()
+
+        for host, port in probes:
+            while len(in_flight) >= self.concurrency:
+                self.tcp_poll(selector, in_flight, finish)
+            if host in self.scan_results:
+                continue
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            except OSError as error:
+                if error.errno in RESOURCE_ERRORS:
+                    self.resource_errors += 1
+                continue
+            sock.setblocking(False)
+            started = time.monotonic()
+            try:
+                result = sock.connect_ex((host, port))
+            except OSError:
+                sock.close()
+                continue
+            if result in (0, errno.ECONNREFUSED):
+                self.host_up(host, time.monotonic() - started)
+                reset_on_close(sock)
+                sock.close()
+            elif result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                selector.register(sock, selectors.EVENT_WRITE)
+                in_flight[sock] = (host, started)
+            else:
+                if result in RESOURCE_ERRORS:
+                    self.resource_errors += 1
+                sock.close()
+
+        while in_flight:
+            self.tcp_poll(selector, in_flight, finish)
+        selector.close()
+        report_resource_errors(self.resource_errors)
+
+    def tcp_poll(self, selector, in_flight, finish):
+        '''Waits for connects to complete, then closes any which have finished or
+        timed out'''
+        oldest = min(started for _, started in in_flight.values())
+        wait = max(oldest + self.timeout - time.monotonic(), 0)
+        ready = selector.select(wait)
+        now = time.monotonic()
+        for key, _ in ready:
+            host, started = in_flight[key.fileobj]
+            result = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if result in (0, errno.ECONNREFUSED):
+                self.host_up(host, now - started)
+            finish(key.fileobj)
+
+        now = time.monotonic()
+        for sock, (host, started) in list(in_flight.items()):
+            if host in self.scan_results or now - started >= self.timeout:
+                finish(sock)
+
+def echo_request(sequence):
+    '''Builds an ICMP echo request, the checksum is included even though Linux
+    fills it in for datagram sockets'''
+    payload = os.urandom(8)
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, 0, sequence)
+    checksum = icmp_checksum(header + payload)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, 0, sequence) + payload
+
+def icmp_checksum(data):
+    '''The internet checksum, the ones' complement of the ones' complement sum'''
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
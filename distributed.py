@@ -0,0 +1,342 @@
+'''These classes are built for splitting one scan across several machines. The
+coordinator holds the TargetSpace and hands out leases, runs of steps from its
+scan order, to any worker that connects and asks for work. A worker scans each
+lease with the usual scan machinery, streams back every open port as it's found,
+then asks for the next lease. While it scans, a worker sends progress every few
+hundred probes and every third of the lease timeout, so a lease with nothing open
+on it doesn't look stalled. If a worker disconnects, or goes a whole lease timeout
+without sending anything, its lease goes back in the queue for another worker to
+pick up, but if the lease hasn't been handed out again by the time the worker
+catches up, it's given back to the worker instead.
+
+The coordinator listens on loopback unless an address is given, and when it's
+given a token only workers that send the same token are handed any work.
+
+Both sides speak newline delimited JSON over a TCP connection:
+    worker -> coordinator   {"type": "next", "token": t}
+                            {"type": "result", "lease": id, "host": h, "port": p, "latency": s}
+                            {"type": "progress", "lease": id, "probes": n}
+                            {"type": "done", "lease": id}
+    coordinator -> worker   {"type": "job", "id": id, "spec": {...}}
+                            {"type": "lease", "id": id, "job": job id, "start": s, "stop": e,
+                             "heartbeat": s}
+                            {"type": "wait", "seconds": s}'''
+import hmac
+import json
+import socket
+import threading
+import time
+from collections import deque
+
+from scan_threader import get_scanner
+from targets import AddressSet, IntervalSet, TargetSpace
+from throttle import build_throttle
+from timing import RttEstimator, RttTable
+
+# How long an idle worker waits before asking for work again
+WAIT_SECONDS = 1
+
+# Probes a worker scans between progress messages
+PROGRESS_EVERY = 256
+
+# Progress messages a worker sends within each lease timeout when nothing else is
+# being sent
+HEARTBEATS_PER_TIMEOUT = 3
+
+class Coordinator:
+    '''The coordinator takes the parsed args, which hold the address to listen on
+    and the lease settings, and like the other scanners a TargetSpace to scan and an
+    optional on_result callback. It starts listening on the first scan and keeps the
+    listener and its workers across scans, so continuous scans reuse the same workers.
+    Every worker connection gets a thread, and the state they share is kept under
+    one lock.'''
+    def __init__(self, args, scan_items=None, on_result=None):
+        self.args = args
+        self.scan_items = scan_items
+        self.on_result = on_result
+
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.listener = None
+        self.job_id = 0
+        self.lease_id = 0
+        self.pending = deque()
+        self.leases = {}
+        self.expired = {}
+        self.workers = 0
+        self.scan_results = set()
+
+    def listen(self):
+        '''Binds the coordinator's address and starts accepting workers'''
+        address, port = parse_address(self.args.coordinator)
+        self.listener = socket.create_server((address, port))
+        threading.Thread(target=self.accept, daemon=True).start()
+        print(f'Coordinator listening on {address}:{port}...')
+
+    def accept(self):
+        '''Starts a thread for every worker that connects'''
+        while True:
+            conn, peer = self.listener.accept()
+            threading.Thread(target=self.serve, args=(conn, peer), daemon=True).start()
+
+    def serve(self, conn, peer):
+        '''Answers one worker's requests until it disconnects, then puts any lease it
+        still held back in the queue'''
+        with self.lock:
+            self.workers += 1
+        if self.args.verbosity >= 1:
+            print(f'Worker {peer[0]}:{peer[1]} connected')
+        sent_job = None
+        try:
+            with conn, conn.makefile('r', encoding='utf-8') as reader:
+                for line in reader:
+                    message = json.loads(line)
+                    if message['type'] == 'next':
+                        if not self.authorized(message):
+                            print(f'[!] Worker {peer[0]}:{peer[1]} sent the wrong token, '
+                                  + 'closing the connection')
+                            return
+                        for reply in self.next_lease(conn, sent_job):
+                            if reply['type'] == 'job':
+                                sent_job = reply['id']
+                            send(conn, reply)
+                    elif message['type'] == 'result':
+                        self.result(conn, message)
+                    elif message['type'] == 'progress':
+                        self.progress(conn, message['lease'])
+                    elif message['type'] == 'done':
+                        self.done(conn, message['lease'])
+        except (OSError, ValueError):
+            pass
+        except (KeyError, TypeError):
+            print(f'[!] Worker {peer[0]}:{peer[1]} sent a malformed message, '
+                  + 'closing the connection')
+        finally:
+            with self.lock:
+                self.workers -= 1
+                self.requeue(lambda lease: lease['conn'] is conn)
+            if self.args.verbosity >= 1:
+                print(f'Worker {peer[0]}:{peer[1]} disconnected')
+
+    def authorized(self, message):
+        '''Checks the worker's token against the coordinator's, if it was given one'''
+        if not self.args.token:
+            return True
+        return hmac.compare_digest(str(message.get('token', '')), self.args.token)
+
+    def next_lease(self, conn, sent_job):
+        '''Returns the replies to a worker asking for work, the job spec first if the
+        worker hasn't seen this job yet, then a lease, or a wait if there's none left'''
+        with self.lock:
+            if not self.pending:
+                return [{'type': 'wait', 'seconds': WAIT_SECONDS}]
+            start, stop = self.pending.popleft()
+            self.lease_id += 1
+            self.leases[self.lease_id] = {'start': start, 'stop': stop, 'conn': conn,
+                                          'expires': time.monotonic() + self.args.lease_timeout}
+            replies = []
+            if sent_job != self.job_id:
+                replies.append({'type': 'job', 'id': self.job_id,
+                                'spec': job_spec(self.args, self.scan_items)})
+            replies.append({'type': 'lease', 'id': self.lease_id, 'job': self.job_id,
+                            'start': start, 'stop': stop,
+                            'heartbeat': self.args.lease_timeout / HEARTBEATS_PER_TIMEOUT})
+            return replies
+
+    def holder(self, conn, lease_id):
+        '''Returns the lease if conn holds it, pushing back when it expires, or None.
+        A lease which expired but hasn't been handed out again is taken back out of
+        the queue and given back to the worker which was still scanning it. Called
+        with the lock held.'''
+        lease = self.leases.get(lease_id)
+        if not lease:
+            lease = self.expired.get(lease_id)
+            if not lease or (lease['start'], lease['stop']) not in self.pending:
+                return None
+            self.pending.remove((lease['start'], lease['stop']))
+            self.leases[lease_id] = self.expired.pop(lease_id)
+            if self.args.verbosity >= 1:
+                print(f'Worker caught up, giving lease {lease_id} back')
+        if lease['conn'] is not conn:
+            return None
+        lease['expires'] = time.monotonic() + self.args.lease_timeout
+        return lease
+
+    def result(self, conn, message):
+        '''Records an open port, as long as it's from the worker that holds the lease,
+        so a lease which was reassigned can't be counted twice'''
+        with self.lock:
+            if not self.holder(conn, message['lease']):
+                return
+            pair = (message['host'], message['port'])
+            new = pair not in self.scan_results
+            self.scan_results.add(pair)
+        if new and self.on_result:
+            self.on_result(message['host'], message['port'], 0, message['latency'])
+
+    def progress(self, conn, lease_id):
+        '''Keeps the lease alive while its worker is still scanning it'''
+        with self.lock:
+            self.holder(conn, lease_id)
+
+    def done(self, conn, lease_id):
+        '''Marks a lease finished'''
+        with self.lock:
+            if self.holder(conn, lease_id):
+                del self.leases[lease_id]
+                self.changed.notify_all()
+
+    def requeue(self, expired):
+        '''Puts leases matching expired back at the front of the queue, called with the
+        lock held. They're remembered in case their worker catches up.'''
+        for lease_id, lease in list(self.leases.items()):
+            if expired(lease):
+                del self.leases[lease_id]
+                self.expired[lease_id] = lease
+                self.pending.appendleft((lease['start'], lease['stop']))
+                if self.args.verbosity >= 1:
+                    print(f'Reassigning lease {lease_id} (steps {lease["start"]}-{lease["stop"]})')
+
+    def scan(self, host=None, timeout=1):
+        '''Queues the TargetSpace as leases for a new job and waits for the workers to
+        finish all of them, reassigning any that time out. Host and timeout are only
+        there to match the other scanners, the timeout is sent to the workers in the
+        job spec.'''
+        if not self.listener:
+            self.listen()
+        size = len(self.scan_items)
+        with self.lock:
+            self.job_id += 1
+            self.scan_results = set()
+            self.expired = {}
+            self.pending = deque((start, min(start + self.args.lease_size, size))
+                                 for start in range(0, size, self.args.lease_size))
+            total = len(self.pending)
+            reported = None
+            while self.pending or self.leases:
+                self.changed.wait(WAIT_SECONDS)
+                now = time.monotonic()
+                self.requeue(lambda lease: lease['expires'] < now)
+                progress = (total - len(self.pending) - len(self.leases), self.workers)
+                if self.args.verbosity >= 1 and progress != reported:
+                    print(f'[~] {progress[0]}/{total} leases done, '
+                          + f'{progress[1]} worker(s) connected')
+                    reported = progress
+            return self.scan_results
+
+def job_spec(args, space):
+    '''The parts of the scan a worker needs to rebuild the TargetSpace and scan it the
+    way the coordinator was asked to'''
+    return {'addresses': space.hosts.addresses.merged(),
+            'names': list(space.hosts.names),
+            'ports': space.ports.merged(),
+            'randomize': space.randomize,
+            'seed': space.seed,
+            'timeout': args.timeout,
+            'adaptive_timeout': args.adaptive_timeout,
+            'min_timeout': args.min_timeout,
+            'max_timeout': args.max_timeout}
+
+def space_from_spec(spec):
+    '''Rebuilds the coordinator's TargetSpace from a job spec'''
+    hosts = AddressSet(spec['names'])
+    hosts.addresses = IntervalSet(tuple(interval) for interval in spec['addresses'])
+    ports = IntervalSet(tuple(interval) for interval in spec['ports'])
+    return TargetSpace(hosts, ports, spec['randomize'], spec['seed'])
+
+def run_worker(args):
+    '''The worker role. Connects to the coordinator, retrying until it's reachable,
+    then scans leases until the coordinator goes away. The scan engine, thread count,
+    per host limit and rates come from the worker's own command line so each node can
+    be tuned for itself, while the targets and timeouts come from the coordinator.'''
+    address = parse_address(args.worker, 'localhost')
+    while True:
+        try:
+            conn = socket.create_connection(address)
+            break
+        except OSError:
+            time.sleep(WAIT_SECONDS)
+    print(f'Connected to coordinator {address[0]}:{address[1]}')
+
+    send_lock = threading.Lock()
+    space = None
+    spec = None
+    with conn, conn.makefile('r', encoding='utf-8') as reader:
+        try:
+            send(conn, {'type': 'next', 'token': args.token})
+            for line in reader:
+                message = json.loads(line)
+                if message['type'] == 'job':
+                    spec = message['spec']
+                    space = space_from_spec(spec)
+                    continue
+                if message['type'] == 'wait':
+                    time.sleep(message['seconds'])
+                elif message['type'] == 'lease':
+                    scan_lease(args, spec, space.steps(message['start'], message['stop']),
+                               message, conn, send_lock)
+                    with send_lock:
+                        send(conn, {'type': 'done', 'lease': message['id']})
+                send(conn, {'type': 'next', 'token': args.token})
+        except OSError:
+            pass
+    print('Coordinator closed the connection')
+
+def scan_lease(args, spec, targets, lease, conn, send_lock):
+    '''Scans one lease, sending each open port back as it's found, and progress every
+    PROGRESS_EVERY probes and from a heartbeat thread whenever nothing else has been
+    sent for the lease's heartbeat interval'''
+    lease_id = lease['id']
+    probes = 0
+    last_sent = time.monotonic()
+    finished = threading.Event()
+
+    def report(host, port, result, latency):
+        nonlocal probes, last_sent
+        with send_lock:
+            probes += 1
+            if result == 0:
+                send(conn, {'type': 'result', 'lease': lease_id, 'host': host,
+                            'port': port, 'latency': latency})
+            elif probes % PROGRESS_EVERY:
+                return
+            else:
+                send(conn, {'type': 'progress', 'lease': lease_id, 'probes': probes})
+            last_sent = time.monotonic()
+
+    def heartbeat():
+        nonlocal last_sent
+        while not finished.wait(lease['heartbeat'] / 2):
+            with send_lock:
+                if time.monotonic() - last_sent >= lease['heartbeat']:
+                    try:
+                        send(conn, {'type': 'progress', 'lease': lease_id, 'probes': probes})
+                    except OSError:
+                        return
+                    last_sent = time.monotonic()
+
+    timing = None
+    if spec['adaptive_timeout']:
+        timing = RttTable(lambda host: RttEstimator(spec['timeout'], spec['min_timeout'],
+                                                    spec['max_timeout'] or spec['timeout']))
+    scanner = get_scanner(args.engine)
+    scan = scanner('Port Scan', targets, args.num_threads, args.verbosity,
+                   per_host=args.per_host, timing=timing,
+                   throttle=build_throttle(args), on_result=report)
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+    try:
+        scan.scan(None, spec['timeout'])
+    finally:
+        finished.set()
+        beat.join()
+
+def send(conn, message):
+    '''Writes one message as a line of JSON'''
+    conn.sendall((json.dumps(message) + '\n').encode())
+
+def parse_address(address, default_host='127.0.0.1'):
+    '''Splits HOST:PORT, where HOST can be left out to mean this machine, so the
+    coordinator only listens on loopback unless it's given an address such as 0.0.0.0'''
+    host, _, port = address.rpartition(':')
+    return (host or default_host, int(port))
@@ -1,56 +1,66 @@
 '''This class is built for managing the file created by the port scanner.'''
-import hashlib
 import os
-import difflib
+from history import HistoryStore
+from result_sink import build_sink
+from scan_state import ScanState, describe_change
 
 class FileManager:
     '''Primariliy the class uses the file path and name either set by default
-    or provided by the user. A hash attribute is initialized to simplify the
-    comparison of the scan results each time a scan is run when using continuous
-    scanning.'''
+    or provided by the user. The state of the last scan is kept so that each scan,
+    when using continuous scanning, can be compared to it by the hosts and ports
+    found rather than by the text of the report. What goes into the file is up to
+    the sink for the output format, the text sink writes the whole report while
+    the JSONL and CSV sinks write each finding as the scan comes across it.
+    With a history database every scan is also recorded there, and the latest
+    recorded scan of the same hosts and ports is the state the first scan is
+    compared to.'''
     def __init__(self, args):
         self.args = args
-        self.hash = ''
+        self.state = None
         self.file_location = os.path.join(self.args.path, self.args.outfile)
+        self.sink = build_sink(self.args.format, self.file_location)
+        self.history = None
+        if self.args.history:
+            self.history = HistoryStore(self.args.history)
+            self.state = self.history.last_state(self.args.hosts, self.args.ports)
 
-    def compare(self, new_scan):
-        '''This takes a hash of the incoming scan and simply compares it to
-        the hash attribute. If they're the same, the scan results are the same,
-        and it returns True. If there's any changes to the scan the hash will change
-        and report False.'''
-        new_hash = hashlib.md5(new_scan.encode())
-        if new_hash.hexdigest() == self.hash:
+    def compare(self, new_state):
+        '''Returns the changes between the last scan's state and the new one, which
+        is empty if the scan results are the same'''
+        changes = new_state.diff(self.state or ScanState())
+        if not changes:
             print("\nNo changes to scan\n")
-            return True
-        return False
+        return changes
 
-    def write_file(self, new_scan):
-        '''Before writing the file a hash is taken of the scan and saved into the hash
-        attribute, because it's marginally simpler and more efficient to hash a
-        variable than it is to hash a file. It then writes the first, or latest scan
-        to the file. Note this function is only called if the scan results change
-        when using continuous scanning.'''
-        file_hash = hashlib.md5(new_scan.encode())
-        self.hash = file_hash.hexdigest()
+    def write_file(self, new_scan, new_state, changes=None):
+        '''Saves the state of the scan for the next comparison, then writes the first,
+        or latest scan to the file. The text report is rewritten in full, while the
+        streaming formats, which already hold every finding from the first scan,
+        only have the changes appended. Note this function is only called if the
+        scan results change when using continuous scanning.'''
+        self.state = new_state
+        self.sink.write_report(new_scan)
+        if changes:
+            self.sink.write_changes(changes)
+        self.sink.streaming = False
 
-        with open(self.file_location, 'w+', encoding='utf-8') as file:
-            file.write(new_scan)
+    def record_history(self, new_state):
+        '''Adds the scan to the history database, if there is one'''
+        if self.history:
+            self.history.record_run(new_state, self.args.hosts, self.args.ports)
 
-    def report_changes(self, new_scan):
-        '''This uses the difflib to print out any changes to the scan which may have
-        appeared in the latest scan. Again, this method is only called if the scan
-        hash changes.'''
-        with open(self.file_location, 'r', encoding='utf-8') as file:
-            file_text = file.read().splitlines()
-
-        new_scan = new_scan.split('\n')
-        new_scan = [item for item in new_scan if item]
-        file_text = [item for item in file_text if item]
+    def close(self):
+        '''Closes the output file, and history database, once scanning is over'''
+        self.sink.close()
+        if self.history:
+            self.history.close()
 
+    def report_changes(self, changes):
+        '''Prints out the changes which appeared in the latest scan. Again, this
+        method is only called if there are changes.'''
         print('\nScan changes detected! \nLines beginning with - indicate '
             + 'they are no longer present\nLines beginning with + indicate new additions\n')
 
-        for line in list(difflib.Differ().compare(file_text, new_scan)):
-            if line[0] == '-' or line[0] == '+':
-                print(line.rstrip('\n'))
+        for event in changes:
+            print(describe_change(event))
         print('\n')
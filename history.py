@@ -0,0 +1,171 @@
+'''This class is built for keeping every scan in one SQLite database instead of a
+pile of timestamped report files. Each run gets a row with when it ran and what
+it scanned, and every finding from the run, the hosts that answered the ping
+sweep and the ports found open, gets a row with the host stored as its integer
+address, so a CIDR block is just a range of integers. Indexes on host, port and
+time let questions across thousands of runs be answered without reading them all,
+and the latest run over the same targets can stand in as the baseline that a
+continuous scan compares itself to.
+
+Run directly it's a small query tool, for example when port 3389 first opened on
+anything in 10.0.0.0/16:
+    history.py scans.db -p 3389 -H 10.0.0.0/16 --first'''
+import argparse
+import ipaddress
+import sqlite3
+import time
+from datetime import datetime
+
+from scan_state import ScanState
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    hosts TEXT,
+    ports TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    host INTEGER NOT NULL,
+    port INTEGER,
+    state TEXT NOT NULL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_host ON results (host, port, time);
+CREATE INDEX IF NOT EXISTS results_port ON results (port, host, time);
+CREATE INDEX IF NOT EXISTS results_time ON results (time);
+CREATE INDEX IF NOT EXISTS results_run ON results (run);
+CREATE INDEX IF NOT EXISTS runs_targets ON runs (hosts, ports, time);
+'''
+
+class HistoryStore:
+    '''Opens, and creates if needed, the history database at file_location. Each
+    run's findings are inserted in one transaction with a single executemany, so
+    recording a run costs one commit no matter how much it found.'''
+    def __init__(self, file_location):
+        self.file_location = file_location
+        self.connection = sqlite3.connect(file_location)
+        self.connection.executescript(SCHEMA)
+
+    def record_run(self, state, hosts=None, ports=None, timestamp=None):
+        '''Stores a ScanState as a new run over the given host and port arguments,
+        returning the run's id'''
+        timestamp = time.time() if timestamp is None else timestamp
+        rows = [(host, None, 'up') for host in state.up_hosts]
+        rows.extend((host, port, 'open') for host, port in state.open_ports)
+        with self.connection:
+            run = self.connection.execute('INSERT INTO runs (time, hosts, ports) VALUES (?, ?, ?)',
+                                          (timestamp, hosts, ports)).lastrowid
+            self.connection.executemany(
+                'INSERT INTO results (run, host, port, state, time) VALUES (?, ?, ?, ?, ?)',
+                ((run, int(ipaddress.IPv4Address(host)), port, result, timestamp)
+                 for host, port, result in rows))
+        return run
+
+    def last_state(self, hosts=None, ports=None):
+        '''Returns the ScanState of the latest run over the same host and port
+        arguments, or None if there hasn't been one'''
+        row = self.connection.execute(
+            'SELECT id FROM runs WHERE hosts IS ? AND ports IS ? ORDER BY time DESC LIMIT 1',
+            (hosts, ports)).fetchone()
+        if not row:
+            return None
+        up_hosts = []
+        open_ports = []
+        for host, port in self.connection.execute(
+                'SELECT host, port FROM results WHERE run = ?', (row[0],)):
+            if port is None:
+                up_hosts.append(str(ipaddress.IPv4Address(host)))
+            else:
+                open_ports.append((str(ipaddress.IPv4Address(host)), port))
+        return ScanState(up_hosts, open_ports)
+
+    def query(self, network=None, port=None, since=None, until=None, summary=None):
+        '''Returns the findings matching every filter given, network being a CIDR
+        string and since and until unix times. With a summary of 'first' or 'last'
+        it's one row per host and port with the earliest or latest time it was seen,
+        otherwise every matching finding from every run.'''
+        conditions = []
+        parameters = []
+        if network:
+            network = ipaddress.IPv4Network(network, strict=False)
+            conditions.append('host BETWEEN ? AND ?')
+            parameters += [int(network.network_address), int(network.broadcast_address)]
+        if port is not None:
+            conditions.append('port = ?')
+            parameters.append(port)
+        if since is not None:
+            conditions.append('time >= ?')
+            parameters.append(since)
+        if until is not None:
+            conditions.append('time <= ?')
+            parameters.append(until)
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        if summary:
+            aggregate = 'MIN' if summary == 'first' else 'MAX'
+            sql = (f'SELECT host, port, state, {aggregate}(time) FROM results {where} '
+                   + 'GROUP BY host, port ORDER BY 4')
+        else:
+            sql = f'SELECT host, port, state, time FROM results {where} ORDER BY time, host, port'
+        return [(str(ipaddress.IPv4Address(host)), port, state, found)
+                for host, port, state, found in self.connection.execute(sql, parameters)]
+
+    def runs(self):
+        '''Returns every run with how many findings it recorded'''
+        return self.connection.execute(
+            'SELECT runs.id, runs.time, runs.hosts, runs.ports, COUNT(results.run) FROM runs '
+            + 'LEFT JOIN results ON results.run = runs.id GROUP BY runs.id ORDER BY runs.time'
+        ).fetchall()
+
+    def close(self):
+        '''Closes the database'''
+        self.connection.close()
+
+def format_time(timestamp):
+    '''Formats a unix time for the query output'''
+    return datetime.fromtimestamp(timestamp).isoformat(sep=' ', timespec='seconds')
+
+def parse_time(text):
+    '''Reads an ISO 8601 date or time as a unix time'''
+    return datetime.fromisoformat(text).timestamp()
+
+def main():
+    '''Answers a query against a history database from the command line'''
+    parser = argparse.ArgumentParser(description='Queries the scan history recorded '
+                                     + 'with port_scanner.py --history.')
+    parser.add_argument('database', type=str, help='The history database')
+    parser.add_argument('-H', '--hosts', type=str,
+                        help='Only findings on this address or CIDR network')
+    parser.add_argument('-p', '--port', type=int,
+                        help='Only findings on this port')
+    parser.add_argument('-S', '--since', type=parse_time,
+                        help='Only findings from this ISO date or time on')
+    parser.add_argument('-U', '--until', type=parse_time,
+                        help='Only findings up to this ISO date or time')
+    summary = parser.add_mutually_exclusive_group()
+    summary.add_argument('--first', action='store_const', dest='summary', const='first',
+                         help='When each host and port was first seen')
+    summary.add_argument('--last', action='store_const', dest='summary', const='last',
+                         help='When each host and port was last seen')
+    summary.add_argument('--runs', action='store_true',
+                         help='List the recorded runs instead of findings')
+    options = parser.parse_args()
+
+    store = HistoryStore(options.database)
+    try:
+        if options.runs:
+            for run, timestamp, hosts, ports, findings in store.runs():
+                print(f'Run {run} at {format_time(timestamp)}: hosts {hosts}, '
+                      + f'ports {ports}, {findings} finding(s)')
+            return
+        for host, port, state, timestamp in store.query(options.hosts, options.port,
+                                                        options.since, options.until,
+                                                        options.summary):
+            target = f'Host {host}' if port is None else f'Port {port} on {host}'
+            print(f'{format_time(timestamp)} {target} {state}')
+    finally:
+        store.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,37 @@
 '''This class is meant for representing a single Host within a network.
 Including functionality for conducting port scans on that host (using threading),
-and parsing the user port input using a similar recursive method as the IPs in a Network'''
+and keeping what was found on it for the report.'''
 import time
-from scan_threader import ScanThreader
+import metrics
+from banners import build_grabber
+from scan_threader import get_scanner
+from targets import clean_up_ports
+from throttle import build_throttle
+from timing import RttEstimator
 
 class Host:
     '''This class is represented by the host's IP address, then the user input for
-    ports is cleaned up, and open_ports is initialized as a set to keep track of
-    positive results on the port scan'''
-    def __init__(self, ip_address, args):
+    ports is cleaned up, unless ports already parsed are passed in, and open_ports
+    is initialized as a set to keep track of positive results on the port scan,
+    each of which is also passed to on_result if given. With adaptive timeouts on,
+    each host keeps an estimate of its round trip time which sets its connect
+    timeout. Names are the hostnames it was given as, if any, so the report can show
+    them. With banners on, banners maps each open port to what the service sent back.'''
+    def __init__(self, ip_address, args, on_result=None, ports=None):
         self.ip_address = ip_address
         self.args = args
-        self.ports = clean_up_ports(self.args.ports)
+        self.on_result = on_result
+        if ports is None:
+            with metrics.current().phase('parse'):
+                ports = clean_up_ports(self.args.ports)
+        self.ports = ports
         self.open_ports = set()
+        self.names = []
+        self.banners = {}
+        self.rtt = None
+        if self.args.adaptive_timeout:
+            self.rtt = RttEstimator(self.args.timeout, self.args.min_timeout,
+                                    self.args.max_timeout or self.args.timeout)
 
     def scan_host(self):
         '''This manages the port scanning by using the multi threader class
@@ -22,13 +41,23 @@ class Host:
             print(f'Initiating scan on {self.ip_address}...\n' + ('-' * 30))
             start_time = time.time()
 
-        scan = ScanThreader('Port Scan', self.ports,
-                            self.args.num_threads, self.args.verbosity)
-        self.open_ports = scan.scan(self.ip_address, self.args.timeout)
+        scanner = get_scanner(self.args.engine)
+        grabber = build_grabber(self.args)
+        scan = scanner('Port Scan', self.ports,
+                       self.args.num_threads, self.args.verbosity,
+                       timing={self.ip_address: self.rtt} if self.rtt else None,
+                       throttle=build_throttle(self.args), on_result=self.on_result,
+                       banners=grabber)
+        with metrics.current().phase('port_scan'):
+            self.open_ports = scan.scan(self.ip_address, self.args.timeout)
+        if grabber:
+            self.banners = {port: banner for (_, port), banner in grabber.banners.items()}
 
         if self.args.verbosity >= 1:
             elapsed = time.time() - start_time
             print(f'Scan complete on {self.ip_address} in {elapsed:.2f} seconds')
+            if self.rtt:
+                print(f'Effective timeout: {self.rtt}')
             if self.open_ports:
                 pretty_ports = ', '.join(sorted(set(map(str, self.open_ports))))
                 print(f'Open port(s): {pretty_ports}\n')
@@ -37,33 +66,15 @@ class Host:
 
     def __str__(self):
         '''Formats the relevent attributes'''
-        return_str = f'\nHost {self.ip_address} shows the following ports open: \n'
-        return_str += '-' * 30 + "\n"
+        names = f' ({", ".join(self.names)})' if self.names else ''
+        lines = [f'\nHost {self.ip_address}{names} shows the following ports open: \n',
+                 '-' * 30 + "\n"]
         if self.open_ports:
             for port in sorted(self.open_ports):
-                return_str += f'[+] Port {port} is open\n'
+                banner = self.banners.get(port)
+                lines.append(f'[+] Port {port} is open'
+                             + (f': {banner.splitlines()[0]}\n' if banner else '\n'))
         else:
-            return_str += f'Either no open ports on {self.ip_address} or host hasn\'t been scanned'
+            lines.append(f'Either no open ports on {self.ip_address} or host hasn\'t been scanned')
 
-        return return_str
-
-def clean_up_ports(input_ports):
-    '''Uses recursion similar to the IP clean up function to detect indicators
-    which may exist in user input and splitting the input up into a set. Then
-    converts the items in the set into int's so that the socket connection can
-    recognize the port number.'''
-    if isinstance(input_ports, str):
-        input_ports = set([input_ports])
-
-    output_ports = set()
-
-    for item in input_ports:
-        if ',' in item:
-            for piece in item.split(','):
-                output_ports.update(clean_up_ports(piece))
-        elif '-' in item:
-            start, stop = item.split('-')
-            output_ports.update(range(int(start), int(stop) + 1))
-        else:
-            output_ports.add(item)
-    return set(map(int, output_ports))
+        return ''.join(lines)
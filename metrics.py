@@ -0,0 +1,197 @@
+'''These classes are built for seeing where the time in a scan goes. Counters,
+gauges, connect latency histograms and per phase timers are collected as the scan
+runs and exported in the Prometheus text format, either to a file after every
+scan or from a small HTTP endpoint for long running continuous scans. Metrics are
+off unless asked for, in which case every call goes to a NullMetrics whose methods
+do nothing, so the instrumented code paths cost one empty method call.'''
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds, in seconds, of the connect latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'scan_probes_total': ('counter', 'Targets scanned, by resulting state'),
+    'scan_phase_seconds_total': ('counter', 'Time spent in each phase of the scan'),
+    'scan_print_seconds_total': ('counter', 'Time scan threads spent printing results'),
+    'scan_thread_start_seconds_total': ('counter', 'Time spent creating and starting threads'),
+    'scan_connect_latency_seconds': ('histogram', 'Time for a connect to be answered or time out'),
+    'scan_hosts_total': ('counter', 'Hosts ping swept, by whether they answered'),
+    'scan_dns_seconds_total': ('counter', 'Time spent resolving host names'),
+    'scan_banners_total': ('counter',
+                           'Banners read from open ports, by whether the service sent one'),
+    'scan_queue_depth': ('gauge', 'Targets not yet handed to a scan thread'),
+    'scan_threads': ('gauge', 'Scan threads or coroutines running the latest scan'),
+    'scans_total': ('counter', 'Scans completed, including each continuous cycle'),
+}
+
+class Metrics:
+    '''Keeps every metric in dictionaries keyed by name and a sorted tuple of label
+    pairs, updated under one lock since the scan threads all report into it'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def count(self, name, value=1, **labels):
+        '''Adds value to a counter'''
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        '''Sets a gauge to value'''
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        '''Records value in a histogram'''
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * len(LATENCY_BUCKETS), 0, 0.0]
+            buckets, _, _ = histogram = self.histograms[key]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    buckets[index] += 1
+                    break
+            histogram[1] += 1
+            histogram[2] += value
+
+    def probe(self, state, latency):
+        '''Records one finished connect'''
+        self.count('scan_probes_total', state=state)
+        if latency is not None:
+            self.observe('scan_connect_latency_seconds', latency)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        '''Adds the time spent inside the with block to a counter'''
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(name, time.perf_counter() - start_time, **labels)
+
+    def phase(self, name):
+        '''Times one phase of the scan, such as parse, ping_sweep, port_scan or output'''
+        return self.timer('scan_phase_seconds_total', phase=name)
+
+    def render(self):
+        '''Returns every metric in the Prometheus text exposition format'''
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {key: (list(value[0]), value[1], value[2])
+                          for key, value in self.histograms.items()}
+
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, text = HELP.get(name, ('untyped', name))
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(counters.items()) + sorted(gauges.items()):
+            describe(name)
+            lines.append(f'{name}{format_labels(labels)} {value:g}')
+        for (name, labels), (buckets, count, total) in sorted(histograms.items()):
+            describe(name)
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", f"{bound:g}"),))} '
+                             f'{cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total:g}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+class NullMetrics:
+    '''Stands in for Metrics when they're disabled, every method does nothing'''
+    def count(self, name, value=1, **labels):
+        '''Does nothing'''
+
+    def gauge(self, name, value, **labels):
+        '''Does nothing'''
+
+    def observe(self, name, value, **labels):
+        '''Does nothing'''
+
+    def probe(self, state, latency):
+        '''Does nothing'''
+
+    def timer(self, name, **labels):
+        '''Returns a context that does nothing'''
+        return nullcontext()
+
+    def phase(self, name):
+        '''Returns a context that does nothing'''
+        return nullcontext()
+
+METRICS = NullMetrics()
+
+def current():
+    '''Returns the metrics the scan should report into'''
+    return METRICS
+
+def enable():
+    '''Switches on metric collection for the rest of the process'''
+    global METRICS
+    if isinstance(METRICS, NullMetrics):
+        METRICS = Metrics()
+    return METRICS
+
+def disable():
+    '''Switches metric collection back off, for worker processes which report their
+    results to a parent that keeps the metrics'''
+    global METRICS
+    METRICS = NullMetrics()
+
+def format_labels(labels):
+    '''Formats label pairs as {name="value",...}'''
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in labels)
+    return '{' + pairs + '}'
+
+def write_metrics(file_location):
+    '''Writes the metrics to a file, replacing it in one step so a collector reading
+    the file never sees half of it'''
+    temporary = f'{file_location}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        file.write(METRICS.render())
+    os.replace(temporary, file_location)
+
+def serve_metrics(port, address=''):
+    '''Serves the metrics on http://address:port/metrics from a background thread.
+    The HTTP server is only imported here, so scans that never serve metrics don't
+    load it.'''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        '''Answers GET /metrics with the current metrics'''
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = METRICS.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            '''Keeps request logs out of the scan output'''
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,128 +1,291 @@
 '''This class is built to handle the concept of a "network." If the requested
 scan is just a ping sweep then main calls the ping sweep method, and if a port
-scan is requested then this class created a Host object for each address in the
-provided network, then calls upon the methods in host to conduct a scan on each
-host.'''
+scan is requested then this class scans every (host, port) pair of the live
+hosts, keeping a Host object for each address that something is found on.'''
 
+import threading
 import time
-import ipaddress
+import metrics
+from banners import build_grabber
+from discovery import PingSweeper
+from distributed import Coordinator
 from host import Host
-from scan_threader import ScanThreader
+from resolver import DnsCache
+from scan_state import ScanState
+from targets import AddressSet, TargetSpace, clean_up_ips, clean_up_ports
+from throttle import build_throttle
+from timing import RttTable
+from scan_threader import get_scanner
+from sharded_scanner import ShardedScanner
 
 class Network:
-    '''Host ips is parsed using the clean up function, and hosts is initialized as
-    an empty list, to be later populated as a list of Host objects. Similarly, up_hosts
-    is initialized to represent the hosts that responded to pings so that Host objects
-    aren't created for nonexistent hosts.'''
-    def __init__(self, args):
+    '''Host ips and ports are parsed once using the clean up functions. Up hosts is
+    the AddressSet of hosts that responded to pings, or every target when the ping
+    sweep is skipped, and hosts maps an address to its Host object, which is only
+    created once there's something to keep for it, an open port or a round trip
+    estimate, so a scan of a large network doesn't build one for every address.
+    Targets holds the addresses actually scanned, once any hostnames have been
+    resolved. On result, if given, is handed to every scan so each finding can be
+    streamed out as soon as it's found, and a Checkpoint, if given, saves the port
+    scan's progress as it goes.'''
+    def __init__(self, args, on_result=None, checkpoint=None):
         self.args = args
-        self.host_ips = clean_up_ips(args.hosts)
-        self.hosts = []
-        self.up_hosts = set()
+        self.on_result = on_result
+        self.checkpoint = checkpoint
+        with metrics.current().phase('parse'):
+            self.host_ips = clean_up_ips(args.hosts)
+            self.ports = clean_up_ports(args.ports) if args.ports else None
+        self.hosts = {}
+        self.hosts_lock = threading.Lock()
+        self.up_hosts = AddressSet()
+        self.ping_rtts = {}
+        self.coordinator = None
+        self.dns = DnsCache(args.dns_ttl, verbosity=args.verbosity)
+        self.targets = self.host_ips
+        self.aliases = {}
+
+    def resolve_hosts(self):
+        '''Swaps every hostname in the scan for the addresses it resolves to,
+        remembering which names each address was given as. Names that share an
+        address become one host and a name with several addresses becomes several.
+        The DnsCache is kept for the life of the Network, so continuous scans only
+        look a name up again once its TTL runs out.'''
+        self.targets = AddressSet()
+        self.targets.addresses.update(self.host_ips.addresses)
+        self.aliases = {}
+        if self.host_ips.names:
+            with metrics.current().phase('dns'):
+                resolved = self.dns.resolve(list(self.host_ips.names))
+            for name, addresses in resolved.items():
+                for address in addresses:
+                    self.targets.add(address)
+                    self.aliases.setdefault(address, []).append(name)
 
     def scan_hosts(self):
+        '''Finds the hosts to scan, then calls the function to conduct port scans,
+        and reports various pieces of useful information about the status of the
+        scans'''
+        self.discover_hosts()
+        if self.up_hosts:
+            print(f'Initiating port scan on {len(self.up_hosts)} host(s)...')
+            print('-' * 30 + '\n')
+            start_time = time.time()
+
+            with metrics.current().phase('port_scan'):
+                self.port_scan()
+
+            elapsed = time.time() - start_time
+            print(f'Scan on {len(self.up_hosts)} host(s) complete in {elapsed:.2f} seconds\n')
+            if self.args.adaptive_timeout:
+                print('Effective timeout per host:')
+                for host in self.hosts.values():
+                    print(f'{host.ip_address}: {host.rtt}')
+                print()
+
+    def discover_hosts(self):
         '''Resets hosts and up_hosts so if the scanning is continuous, repeats
         aren't created, then conducts a ping sweep (if user didn't request to skip
-        it) and creates a Host object for all alive hosts, then calls the function
-        to conduct port scans, and reports various pieces of useful information
-        about the status of the scans'''
-        self.hosts = []
-        self.up_hosts = set()
-        if not self.args.skip:
+        it). With adaptive timeouts a Host is created for every host the sweep
+        measured a round trip to, so its estimate starts from it. A checkpoint
+        loaded for a resume replaces the ping sweep and targets with its own.'''
+        self.hosts = {}
+        self.up_hosts = AddressSet()
+        self.ping_rtts = {}
+        if self.checkpoint and self.checkpoint.resumed_space:
+            self.targets = self.checkpoint.resumed_space.hosts
+            self.up_hosts = self.targets
+            self.aliases = self.checkpoint.header['aliases']
+            print(f'Resuming scan from {self.checkpoint.file_location}...')
+        elif not self.args.skip:
+            self.resolve_hosts()
             print('Initiating ping sweep...')
             if self.args.verbosity >= 1:
                 print('Using ping sweep to reduce hosts for port scan.'
                     + 'Use -s or --skip to force port scans on all provided hosts.\n')
-            self.ping_sweep()
+            self.ping_sweep(resolve=False)
         else:
-            self.up_hosts = self.host_ips
+            self.resolve_hosts()
+            self.up_hosts = self.targets
             print('Skipping ping sweep...')
 
-        for addr in self.up_hosts:
-            self.hosts.append(Host(addr, self.args))
+        if self.args.adaptive_timeout:
+            for address in self.ping_rtts:
+                self.host(address)
 
-        if self.up_hosts:
-            print(f'Initiating port scan on {len(self.up_hosts)} host(s)...')
-            print('-' * 30 + '\n')
-            start_time = time.time()
+    def host(self, address):
+        '''Returns the Host for an address, creating it the first time it's asked for'''
+        host = self.hosts.get(address)
+        if host is None:
+            with self.hosts_lock:
+                host = self.hosts.get(address)
+                if host is None:
+                    host = self.hosts[address] = self.new_host(address)
+        return host
 
-            for host in self.hosts:
-                host.scan_host()
+    def new_host(self, address):
+        '''Builds a Host for an address with its names and ping round trip'''
+        host = Host(address, self.args, self.on_result, self.ports)
+        host.names = self.aliases.get(address, [])
+        if host.rtt and address in self.ping_rtts:
+            host.rtt.update(self.ping_rtts[address])
+        return host
 
-            elapsed = time.time() - start_time
-            print(f'Scan on {len(self.hosts)} host(s) complete in {elapsed:.2f} seconds\n')
+    def timing(self):
+        '''Returns the RttTable of each host's estimate for adaptive timeouts, or None'''
+        if not self.args.adaptive_timeout:
+            return None
+        return RttTable(lambda address: self.host(address).rtt)
+
+    def port_scan(self):
+        '''Rather than scanning one host after another, every (host, port) pair goes
+        into one shared pool so a slow or filtered host only holds up its own ports.
+        The pairs come lazily from a TargetSpace, ordered port by port across the
+        hosts (or randomly), and are scanned by the local engine, split between
+        worker processes, or leased out to worker nodes by the coordinator, which
+        is kept between scans. The open ports found, and any banners, are handed
+        back to each Host. When checkpointing, only the targets the checkpoint
+        hasn't seen finish are scanned, and the open ports it already holds are
+        handed back as if they'd just been found.'''
+        if self.checkpoint and self.checkpoint.resumed_space:
+            space = self.checkpoint.resumed_space
+        else:
+            space = TargetSpace(self.up_hosts, self.ports, randomize=self.args.randomize)
+        pairs = space
+        on_result = self.on_result
+        if self.checkpoint:
+            pairs = self.checkpoint.start(self.args, space, self.aliases)
+            for address, port, latency in self.checkpoint.open_ports:
+                self.host(address).open_ports.add(port)
+                if self.on_result:
+                    self.on_result(address, port, 0, latency)
+
+            def on_result(host, port, result, latency):
+                if self.on_result:
+                    self.on_result(host, port, result, latency)
+                self.checkpoint.record(host, port, result, latency)
+
+        timing = self.timing()
+        grabber = None
+        if self.args.coordinator:
+            if not self.coordinator:
+                self.coordinator = Coordinator(self.args, on_result=self.on_result)
+            self.coordinator.scan_items = pairs
+            scan = self.coordinator
+        elif self.args.workers > 1:
+            scan = ShardedScanner(self.args, pairs, timing=timing, on_result=self.on_result)
+        else:
+            grabber = build_grabber(self.args)
+            scan = self.local_scanner(pairs, timing, on_result, grabber)
+        try:
+            for address, port in scan.scan(None, self.args.timeout):
+                self.host(address).open_ports.add(port)
+        finally:
+            if self.checkpoint:
+                self.checkpoint.finish()
+        if grabber:
+            for (address, port), banner in grabber.banners.items():
+                self.host(address).banners[port] = banner
 
-    def ping_sweep(self):
-        '''This makes use of the ScanThreader class to push out pings to the hosts
-        provided by the user, then reports on status and send the results back'''
+        if self.args.verbosity >= 1:
+            for address in self.up_hosts:
+                host = self.hosts.get(address)
+                if host and host.open_ports:
+                    pretty_ports = ', '.join(map(str, sorted(host.open_ports)))
+                    print(f'Open port(s) on {address}: {pretty_ports}')
+                else:
+                    print(f'No open ports detected on {address}')
+            print()
+
+    def scan_targets(self, targets):
+        '''Scans any run of (host, port) pairs among the hosts already found, such
+        as one slice of a continuous schedule, in this process. Open ports and
+        banners are added to each Host, and the open pairs are returned.'''
+        grabber = build_grabber(self.args)
+        scan = self.local_scanner(targets, self.timing(), self.on_result, grabber)
+        with metrics.current().phase('port_scan'):
+            found = scan.scan(None, self.args.timeout)
+        for address, port in found:
+            self.host(address).open_ports.add(port)
+        if grabber:
+            for (address, port), banner in grabber.banners.items():
+                self.host(address).banners[port] = banner
+        return found
+
+    def local_scanner(self, pairs, timing, on_result, grabber):
+        '''Builds the scan engine the user chose to scan pairs in this process'''
+        scanner = get_scanner(self.args.engine)
+        return scanner('Port Scan', pairs, self.args.num_threads,
+                       self.args.verbosity, per_host=self.args.per_host, timing=timing,
+                       throttle=build_throttle(self.args), on_result=on_result,
+                       banners=grabber)
+
+    def ping_sweep(self, resolve=True):
+        '''This makes use of the PingSweeper class to push out pings to the hosts
+        provided by the user from within the process, or the ScanThreader class to
+        run the system ping binary if that's requested, then reports on status and
+        send the results back. Hostnames are resolved first unless the caller
+        already has.'''
         start_time = time.time()
+        if resolve:
+            self.resolve_hosts()
         if self.args.verbosity >= 1 or not self.args.ports:
-            print(f'Beginning ping sweep on {len(self.host_ips)} hosts...\n')
+            print(f'Beginning ping sweep on {len(self.targets)} hosts...\n')
 
-        scan = ScanThreader('Ping Sweep', self.host_ips, self.args.num_threads, self.args.verbosity)
-        self.up_hosts = scan.scan()
+        with metrics.current().phase('ping_sweep'):
+            if self.args.ping == 'system':
+                scanner = get_scanner(self.args.engine)
+                scan = scanner('Ping Sweep', self.targets, self.args.num_threads,
+                               self.args.verbosity, on_result=self.on_result)
+                self.up_hosts = AddressSet(scan.scan())
+            else:
+                sweep = PingSweeper(self.targets, self.args.timeout, self.args.verbosity,
+                                    self.args.ping, self.args.num_threads,
+                                    on_result=self.on_result)
+                self.up_hosts = AddressSet(sweep.sweep())
+                self.ping_rtts = sweep.rtts
+        metrics.current().count('scan_hosts_total', len(self.up_hosts), state='up')
+        metrics.current().count('scan_hosts_total', len(self.targets) - len(self.up_hosts),
+                                state='down')
 
         elapsed = time.time() - start_time
-        return_str = f'\nPing sweep complete on {len(self.host_ips)} host\n'
+        return_str = f'\nPing sweep complete on {len(self.targets)} host\n'
         if self.up_hosts:
-            for host in self.up_hosts:
-                return_str += f'[+] Host {host} is up\n'
+            for host in sorted(self.up_hosts):
+                names = f' ({", ".join(self.aliases[host])})' if host in self.aliases else ''
+                return_str += f'[+] Host {host}{names} is up\n'
         else:
             return_str += 'All hosts scanned are either down or not responding to pings\n'
 
         if self.args.verbosity >= 1 and self.args.ports:
-            print(f'Scanned {len(self.host_ips)} host(s) in {elapsed:.2f} seconds\n {"-" * 30}\n')
+            print(f'Scanned {len(self.targets)} host(s) in {elapsed:.2f} seconds\n {"-" * 30}\n')
             print('-' * 30 + '\n')
             print(return_str)
 
         return return_str
 
+    def scan_state(self):
+        '''Reduces the latest scan to a ScanState of the hosts which answered the
+        ping sweep, if there was one, and the open ports on each host'''
+        up_hosts = self.up_hosts if (not self.args.ports or not self.args.skip) else ()
+        return ScanState(up_hosts, ((host.ip_address, port) for host in self.hosts.values()
+                                    for port in host.open_ports))
+
     def __str__(self):
-        '''Turn information about the network into pretty formatting'''
-        return_str = ''
+        '''Turn information about the network into pretty formatting, joined
+        once at the end rather than concatenated host by host. The streaming
+        formats have already written every finding as it was found, so for them
+        only the hosts something was found on are listed, and no Host is built
+        for the rest of the up hosts.'''
+        lines = []
         if self.up_hosts:
-            return_str += f'{len(self.host_ips)} host(s) scanned:\n'
+            lines.append(f'{len(self.targets)} host(s) scanned:\n')
         else:
-            return_str += 'No hosts detected, cancelling port scan...\n'
-        return_str += '-' * 30 + '\n'
-        for each_host in self.hosts:
-            return_str += str(each_host)
-        return return_str
-
-def clean_up_ips(input_ips):
-    '''This function is used recursively to parse user input for ips into a usable format.
-    A set is used so that duplicates can't be added to the final list and therefore unecessarily
-    scanned twice. On each loop the item in the set is searched for a comma, dash, or backslash,
-    and if any are found then it's split on the comma, or the range is expanded, or
-    a CIDR network is provided using the ipaddress libary. IF any of these indicators are found,
-    then a subset is created and recursively sent through the function until finally no items in
-    the list flag on any of these indicators and the recursion folds into itself back up to the
-    original function call'''
-    if isinstance(input_ips, str):
-        input_ips = set([input_ips])
-
-    output_ips = set()
-    for host in input_ips:
-        if ',' in host:
-            for item in host.split(','):
-                output_ips.update(clean_up_ips(item))
-        elif '-' in host:
-            octets = host.split('.')
-            subnet_request = False
-            for octet in octets:
-                if '-' in octet:
-                    index = octets.index(octet)
-                    start, end = octet.split('-')
-                    if '/' in end:
-                        end, subnet = end.split('/')
-                        subnet_request = True
-                    octet_range = range(int(start), int(end)+1)
-            for octet in octet_range:
-                octets[index] = (str(octet) + '/' + subnet) if subnet_request else octet
-                output_ips.update(clean_up_ips(f'{octets[0]}.{octets[1]}.{octets[2]}.{octets[3]}'))
-        elif '/' in host:
-            for addr in ipaddress.IPv4Network(host, strict=False):
-                output_ips.add(str(addr))
+            lines.append('No hosts detected, cancelling port scan...\n')
+        lines.append('-' * 30 + '\n')
+        if self.args.format == 'text':
+            lines.extend(str(self.hosts.get(address) or self.new_host(address))
+                         for address in self.up_hosts)
         else:
-            output_ips.add(host)
-    return output_ips
+            lines.extend(str(host) for host in map(self.hosts.get, self.up_hosts)
+                         if host and host.open_ports)
+        return ''.join(lines)
@@ -19,13 +19,17 @@ import argparse
 import os
 import time
 from datetime import datetime
+import metrics
 from network import Network
 from file_manager import FileManager
+from checkpoint import Checkpoint
+from scheduler import Scheduler, parse_schedules
+from distributed import run_worker
+import resources
 
-def main():
-    '''Main function basically just sets up args, then instantiates the other
-    classes and uses just a touch of logic to manage the continuous looping'''
-
+def build_parser():
+    '''Sets up the argument parser, kept apart from main so other tools, like the
+    benchmark, can build the same args a command line scan would use'''
     example_text = '''
     Examples:
 
@@ -50,8 +54,9 @@ def main():
                                      RawDescriptionHelpFormatter)
 
     # positional arguments
-    parser.add_argument('hosts', metavar='<host(s)>', type=str,
-                        help='Enter the host(s) to run the scan against')
+    parser.add_argument('hosts', metavar='<host(s)>', type=str, nargs='?',
+                        help='Enter the host(s) to run the scan against, '
+                        + 'not needed with --worker')
 
     # options
     parser.add_argument('-p', '--ports', type=str, nargs='?',
@@ -59,22 +64,150 @@ def main():
     parser.add_argument('-pa', '--path', type=str, nargs='?',
                         help='Set output directory', default=(os.getcwd()))
     parser.add_argument('-o', '--outfile', type=str, nargs='?',
-                        help='Adjust output file name',
-                        default=f'{datetime.now().strftime("%d_%h_%y_%H-%M-%S")}_scan.txt')
+                        help='Adjust output file name, defaults to a timestamped '
+                        + 'file with an extension matching the format')
+    parser.add_argument('-f', '--format', type=str, choices=['text', 'jsonl', 'csv'],
+                        default='text',
+                        help='Write the full text report at the end of the scan, '
+                        + 'or stream each finding to the file as a JSONL or CSV record')
     parser.add_argument('-t', '--timeout', type=float, nargs='?',
                         help='Set timeout for each port scans', default=1)
+    parser.add_argument('-at', '--adaptive_timeout', action='store_true',
+                        help='Adapt each host\'s timeout to its measured round trip '
+                        + 'time, starting from --timeout')
+    parser.add_argument('-mn', '--min_timeout', type=float, nargs='?', default=0.05,
+                        help='The shortest adaptive timeout, defaults to 0.05')
+    parser.add_argument('-mx', '--max_timeout', type=float, nargs='?',
+                        help='The longest adaptive timeout, defaults to --timeout')
     parser.add_argument('-v', '--verbosity', type=int, nargs='?', default=0,
                         help='Increase the verbosity of scan output, 0-3')
     parser.add_argument('-n', '--num_threads', type=int, nargs='?',
                         help='The number of targets to scan at a time')
+    parser.add_argument('-e', '--engine', type=str, choices=['thread', 'async'],
+                        default='thread',
+                        help='Scan with OS threads or with asyncio, with async -n '
+                        + 'sets the number of concurrent connects')
+    parser.add_argument('-w', '--workers', type=int, nargs='?', default=1,
+                        help='Split port scans across N processes, each running its '
+                        + 'own scan engine, defaults to 1')
+    parser.add_argument('-co', '--coordinator', type=str, nargs='?', metavar='[HOST]:PORT',
+                        help='Lease the port scan out to worker nodes connecting '
+                        + 'on this address, HOST defaults to 127.0.0.1')
+    parser.add_argument('-wo', '--worker', type=str, nargs='?', metavar='HOST:PORT',
+                        help='Run as a worker node for the coordinator at this address')
+    parser.add_argument('-tk', '--token', type=str, nargs='?',
+                        help='A shared secret the coordinator requires from its '
+                        + 'workers, and a worker sends to its coordinator')
+    parser.add_argument('-ls', '--lease_size', type=int, nargs='?', default=4096,
+                        help='The number of (host, port) pairs in each lease, defaults to 4096')
+    parser.add_argument('-lt', '--lease_timeout', type=float, nargs='?', default=300,
+                        help='Seconds without progress before a lease is given to '
+                        + 'another worker, defaults to 300')
+    parser.add_argument('-ph', '--per_host', type=int, nargs='?',
+                        help='The most targets on any one host to scan at a time '
+                        + 'when scanning many hosts, defaults to no limit')
+    parser.add_argument('-R', '--rate', type=float, nargs='?',
+                        help='The most connects per second across the whole scan')
+    parser.add_argument('-hr', '--host_rate', type=float, nargs='?',
+                        help='The most connects per second to any one host')
+    parser.add_argument('-cc', '--congestion', action='store_true',
+                        help='Shrink the number of connects in flight when timeouts '
+                        + 'or resource errors spike, and grow it back as they recover')
+    parser.add_argument('-b', '--banners', action='store_true',
+                        help='Read a banner from every open port over the connection '
+                        + 'the scan opened, while the scan carries on')
+    parser.add_argument('-bt', '--banner_timeout', type=float, nargs='?', default=2,
+                        help='The most seconds to wait for each banner, defaults to 2')
+    parser.add_argument('-bp', '--banner_probe', type=str, default='http',
+                        choices=['http', 'none'],
+                        help='What to send services still silent half way through '
+                        + 'the banner timeout, defaults to an HTTP HEAD request')
+    parser.add_argument('-r', '--randomize', action='store_true',
+                        help='Scan the (host, port) pairs in a random order')
+    parser.add_argument('-pm', '--ping', type=str, default='auto',
+                        choices=['auto', 'icmp', 'tcp', 'system'],
+                        help='How to ping hosts, auto uses ICMP sockets where '
+                        + 'permitted and otherwise a TCP ping, system runs the ping binary')
+    parser.add_argument('-dt', '--dns_ttl', type=float, nargs='?', default=300,
+                        help='Seconds to cache a hostname\'s addresses when the TTL '
+                        + 'isn\'t known (dnspython not installed), defaults to 300')
     parser.add_argument('-s', '--skip', action='store_true',
                         help='Skip the initial ping check for port scans')
     parser.add_argument('-c', '--continuous', type=int, nargs='?',
                         help='Scan every N seconds and report changes, '
                         + 'if scan takes longer than the provided seconds '
                         + 'then it scans without pause')
+    parser.add_argument('-sp', '--spread', action='store_true',
+                        help='Spread each --continuous cycle\'s probes evenly over the '
+                        + 'interval, reporting changes as each slice finishes')
+    parser.add_argument('-sc', '--schedule', type=str, action='append', metavar='PORTS:SECONDS',
+                        help='Also scan these ports every SECONDS, can be repeated, '
+                        + 'e.g. -sc 22,3389:30 -sc 1-65535:3600, implies --spread')
+    parser.add_argument('-hi', '--history', type=str, nargs='?', metavar='DATABASE',
+                        help='Record every scan in this SQLite database, and compare '
+                        + 'the first scan to the last one recorded for the same targets')
+    parser.add_argument('-cp', '--checkpoint', type=str, nargs='?',
+                        help='Save port scan progress to this file every few seconds '
+                        + 'so an interrupted scan can be resumed')
+    parser.add_argument('-rs', '--resume', type=str, nargs='?', metavar='CHECKPOINT',
+                        help='Resume the scan saved in this checkpoint, skipping the '
+                        + 'targets it already finished, and keep checkpointing to it')
+    parser.add_argument('-mf', '--metrics_file', type=str, nargs='?',
+                        help='Write scan metrics to this file in the Prometheus text '
+                        + 'format after every scan')
+    parser.add_argument('-mp', '--metrics_port', type=int, nargs='?',
+                        help='Serve scan metrics in the Prometheus text format on '
+                        + 'http://localhost:PORT/metrics while the scanner runs')
 
+    return parser
+
+def main():
+    '''Main function basically just sets up args, then instantiates the other
+    classes and uses just a touch of logic to manage the continuous looping'''
+    parser = build_parser()
     args = parser.parse_args()
+    if args.verbosity >= 1:
+        print(resources.describe_limits())
+    if args.worker:
+        run_worker(args)
+        return
+    if args.banners and (args.workers > 1 or args.coordinator):
+        parser.error('--banners can\'t be used with --workers or --coordinator')
+    if args.schedule:
+        args.spread = True
+    if args.spread:
+        if not args.continuous:
+            parser.error('--spread and --schedule need --continuous')
+        if args.workers > 1 or args.coordinator or args.checkpoint or args.resume:
+            parser.error('--spread and --schedule can\'t be used with --workers, '
+                         + '--coordinator, --checkpoint or --resume')
+        try:
+            schedules = parse_schedules(args)
+        except ValueError:
+            parser.error('--schedule takes PORTS:SECONDS, e.g. 22,3389:30')
+        if not schedules:
+            parser.error('--spread needs ports from -p or --schedule')
+        args.ports = args.ports or ','.join(ports for ports, _ in schedules)
+    checkpoint = None
+    if args.checkpoint or args.resume:
+        if args.workers > 1 or args.coordinator:
+            parser.error('--checkpoint and --resume can\'t be used with --workers '
+                         + 'or --coordinator')
+        checkpoint = Checkpoint(args.resume or args.checkpoint)
+        if args.resume:
+            if not checkpoint.load():
+                parser.error(f'no checkpoint to resume in {args.resume}')
+            args.hosts = args.hosts or checkpoint.header['hosts']
+            args.ports = args.ports or checkpoint.header['ports']
+    if not args.hosts:
+        parser.error('the <host(s)> argument is required unless running as a --worker')
+    if not args.outfile:
+        extension = 'txt' if args.format == 'text' else args.format
+        args.outfile = f'{datetime.now().strftime("%d_%h_%y_%H-%M-%S")}_scan.{extension}'
+    if args.metrics_file or args.metrics_port:
+        metrics.enable()
+    if args.metrics_port:
+        metrics.serve_metrics(args.metrics_port, 'localhost')
 
     # Simply completes the appropriate scan and returns results
     # This is a method so it's repeatable if the -c flag is used
@@ -84,42 +217,73 @@ def main():
     def scan():
         if args.ports:
             network.scan_hosts()
-            print(network)
-            return str(network)
+            with metrics.current().phase('output'):
+                report = str(network)
+                print(report)
+                return report
         print('No ports provided, running Ping Sweep....')
         sweep_scan = network.ping_sweep()
-        print(sweep_scan)
+        with metrics.current().phase('output'):
+            print(sweep_scan)
         return sweep_scan
 
-    # build network object
-    network = Network(args)
+    # Counts the finished scan and writes out the metrics if they're going to a file
+    def scan_done():
+        metrics.current().count('scans_total')
+        if args.metrics_file:
+            metrics.write_metrics(args.metrics_file)
 
-    # If continuous is not used this is the core functionality, it creates a
-    # file object, conducts a scan using the network object, and writes the
-    # scan to disk, along with printing relevent details to the terminal
-    start_time = time.time()
+    # build file and network objects, the network streams each finding to the
+    # file's sink as it's found
     file = FileManager(args)
-    first_scan = scan()
-    file.write_file(first_scan)
-
-    # If a continuous scan is requested then the time it took to conduct the
-    # scan is factored in, then a new scan is taken, compared to the last one
-    # and if there are changes, the changes are displayed to the screen
-    # and the file is updated to reflect the latest scan, if there are no changes
-    # the file is untouched because it would be overwritten with identical data
-    if args.continuous:
-        while True:
-            elapsed = time.time() - start_time
-            if args.continuous > elapsed:
-                time_to_wait = args.continuous - elapsed
-                if time_to_wait >= 0:
-                    print(f'Waiting {time_to_wait:.0f} seconds until the next scan..')
-                    time.sleep(time_to_wait)
-            start_time = time.time()
-            new_scan = scan()
-            if not file.compare(new_scan):
-                file.report_changes(new_scan)
-                file.write_file(new_scan)
+    network = Network(args, file.sink.record, checkpoint)
+
+    # If continuous is not used this is the core functionality, it conducts a
+    # scan using the network object, and writes the scan to disk, along with
+    # printing relevent details to the terminal
+    start_time = time.time()
+    try:
+        # With --spread the scheduler takes over, scanning slices of each cycle
+        # as they come due rather than the whole scan every N seconds
+        if args.spread:
+            Scheduler(args, network, file, schedules, scan_done).run()
+            return
+
+        first_scan = scan()
+        first_state = network.scan_state()
+        with metrics.current().phase('output'):
+            changes = file.compare(first_state) if file.state else None
+            if changes:
+                file.report_changes(changes)
+            file.write_file(first_scan, first_state, changes)
+            file.record_history(first_state)
+        scan_done()
+
+        # If a continuous scan is requested then the time it took to conduct the
+        # scan is factored in, then a new scan is taken, and its hosts and ports are
+        # compared to the last one's, if there are changes, the changes are displayed
+        # to the screen and the file is updated to reflect the latest scan, if there
+        # are no changes the file is untouched
+        if args.continuous:
+            while True:
+                elapsed = time.time() - start_time
+                if args.continuous > elapsed:
+                    time_to_wait = args.continuous - elapsed
+                    if time_to_wait >= 0:
+                        print(f'Waiting {time_to_wait:.0f} seconds until the next scan..')
+                        time.sleep(time_to_wait)
+                start_time = time.time()
+                new_scan = scan()
+                new_state = network.scan_state()
+                changes = file.compare(new_state)
+                with metrics.current().phase('output'):
+                    if changes:
+                        file.report_changes(changes)
+                        file.write_file(new_scan, new_state, changes)
+                    file.record_history(new_state)
+                scan_done()
+    finally:
+        file.close()
 
 
 if __name__ == '__main__':
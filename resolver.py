@@ -0,0 +1,77 @@
+'''This class is built for resolving hostnames once per scan rather than once per
+connect. Every name in the scan is looked up up front, all at once from a small
+thread pool, and the answers are cached for as long as their TTL allows so a
+continuous scan only goes back to the resolver when a record has expired. When
+dnspython is installed the TTL comes from the DNS answer itself, otherwise the
+system resolver is used and answers are kept for a fixed number of seconds.'''
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:
+    dns = None
+
+# Seconds to keep an answer from the system resolver, which doesn't give a TTL
+DEFAULT_TTL = 300
+
+# The most names looked up at once
+DEFAULT_CONCURRENCY = 32
+
+class DnsCache:
+    '''The cache maps each name to the IPv4 addresses it resolved to and when that
+    answer expires. A name can resolve to several addresses, all of which are kept
+    and scanned. Names which fail to resolve aren't cached, so they're tried again
+    on the next scan.'''
+    def __init__(self, ttl=DEFAULT_TTL, num_threads=None, verbosity=0):
+        self.ttl = ttl
+        self.concurrency = num_threads or DEFAULT_CONCURRENCY
+        self.verbosity = verbosity
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def resolve(self, names):
+        '''Returns a dictionary of each name to the list of its addresses, looking up
+        only the names which aren't cached or have expired. Names that don't resolve
+        are left out.'''
+        now = time.monotonic()
+        with self.lock:
+            stale = [name for name in dict.fromkeys(names)
+                     if name not in self.entries or self.entries[name][1] <= now]
+        if stale:
+            with metrics.current().timer('scan_dns_seconds_total'):
+                with ThreadPoolExecutor(min(len(stale), self.concurrency)) as pool:
+                    answers = list(pool.map(self.lookup, stale))
+            now = time.monotonic()
+            with self.lock:
+                for name, (addresses, ttl) in zip(stale, answers):
+                    if addresses:
+                        self.entries[name] = (addresses, now + ttl)
+                    else:
+                        self.entries.pop(name, None)
+                        print(f'[-] Could not resolve {name}')
+                    if addresses and self.verbosity >= 1:
+                        print(f'[~] {name} resolved to {", ".join(addresses)}')
+        with self.lock:
+            return {name: self.entries[name][0] for name in names if name in self.entries}
+
+    def lookup(self, name):
+        '''Resolves one name, returning its addresses and how many seconds they can
+        be cached. dnspython only speaks DNS, so names it can't find, like ones from
+        the hosts file, are tried again with the system resolver.'''
+        if dns:
+            try:
+                answer = dns.resolver.resolve(name, 'A')
+                return ([record.address for record in answer], max(answer.rrset.ttl, 0))
+            except dns.exception.DNSException:
+                pass
+        try:
+            info = socket.getaddrinfo(name, None, socket.AF_INET, socket.SOCK_STREAM)
+        except OSError:
+            return [], 0
+        return list(dict.fromkeys(entry[4][0] for entry in info)), self.ttl
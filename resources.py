@@ -0,0 +1,93 @@
+'''These functions are built for keeping a scan inside what the machine can give
+it. Every connect in flight holds a file descriptor and a local ephemeral port,
+so the scanner reads the file descriptor limit (raising the soft limit to the
+hard limit where it's allowed) and the ephemeral port range once, and caps the
+threads or coroutines of every scan to fit. Probe sockets which connected are
+closed with SO_LINGER set to 0, which resets the connection instead of leaving
+the socket in TIME_WAIT holding its port for a minute or more, and connects that
+fail because the scanner ran out of descriptors or ports are told apart from
+ports that are actually closed.'''
+import errno
+import socket
+import struct
+from functools import lru_cache
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Errors which mean the scanner ran out of something locally, so the port was
+# never really probed
+RESOURCE_ERRORS = {errno.EMFILE, errno.ENFILE, errno.EADDRNOTAVAIL, errno.ENOBUFS,
+                   errno.ENOMEM}
+
+# File descriptors left over for everything that isn't a probe, such as the output
+# file, checkpoint, history database and the interpreter itself
+RESERVED_FDS = 64
+
+# The range most systems other than Linux use, from RFC 6335
+DEFAULT_EPHEMERAL_PORTS = (49152, 65535)
+
+LINGER_ZERO = struct.pack('ii', 1, 0)
+
+@lru_cache(maxsize=None)
+def fd_limit():
+    '''Returns the process' file descriptor limit, first raising the soft limit as
+    far as the hard limit allows, or None if it can't be read on this system'''
+    if not resource:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 1048576)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return None if soft == resource.RLIM_INFINITY else soft
+
+@lru_cache(maxsize=None)
+def ephemeral_ports():
+    '''Returns the first and last local ports the system picks from for connects'''
+    try:
+        with open('/proc/sys/net/ipv4/ip_local_port_range', encoding='utf-8') as file:
+            low, high = map(int, file.read().split())
+            return low, high
+    except (OSError, ValueError):
+        return DEFAULT_EPHEMERAL_PORTS
+
+def max_concurrency():
+    '''The most connects that can be in flight at once in this process'''
+    low, high = ephemeral_ports()
+    limit = high - low + 1
+    if fd_limit() is not None:
+        limit = min(limit, fd_limit() - RESERVED_FDS)
+    return max(1, limit)
+
+def cap_concurrency(requested, verbosity=0, reserved=0):
+    '''Returns the requested number of threads or coroutines, lowered to what the
+    file descriptor limit and ephemeral port range can support once the reserved
+    sockets, such as those held open for banners, are set aside'''
+    limit = max(1, max_concurrency() - reserved)
+    if requested > limit:
+        if verbosity >= 1:
+            low, high = ephemeral_ports()
+            print(f'[!] Lowering concurrency from {requested} to {limit} to fit the '
+                  + f'file descriptor limit ({fd_limit()}) and ephemeral ports ({low}-{high})')
+        return limit
+    return requested
+
+def reset_on_close(sock):
+    '''Sets SO_LINGER to 0 so closing the socket resets the connection rather than
+    leaving it in TIME_WAIT'''
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_ZERO)
+    except OSError:
+        pass
+
+def describe_limits():
+    '''Describes the limits scans are held to, for verbose output'''
+    low, high = ephemeral_ports()
+    return (f'File descriptor limit {fd_limit() or "unknown"}, ephemeral ports {low}-{high}, '
+            + f'at most {max_concurrency()} connects in flight')
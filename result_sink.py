@@ -0,0 +1,102 @@
+'''These classes are built for getting scan results onto disk as they're found
+rather than all at once when the scan finishes. Each finding (an open port or a
+host that's up) becomes one record with the host, port, state, connect latency
+and a timestamp, written and flushed as a line of JSON or CSV so the file can be
+tailed while the scan is still running and memory doesn't grow with the scan.
+The text format keeps the original behavior of writing the full report.
+In continuous mode the streaming formats only append what changed.'''
+import csv
+import json
+import threading
+from datetime import datetime, timezone
+
+from scan_threader import probe_state
+
+FIELDS = ['host', 'port', 'state', 'latency', 'timestamp', 'change']
+
+class ResultSink:
+    '''The streaming sink opens the output file line buffered, so every record is
+    on disk as soon as it's written, and serializes writes from the scan threads
+    with a lock. How a record is formatted comes from the formatter, one of
+    FORMATTERS, which is given the open file and returns the function that writes
+    a record to it. Findings are streamed while the first scan runs, after that
+    continuous scans only add records for what changed, with the change field
+    saying whether the host or port was added or removed.'''
+    def __init__(self, file_location, formatter):
+        self.file_location = file_location
+        self.streaming = True
+        self.lock = threading.Lock()
+        self.file = open(file_location, 'a', encoding='utf-8', buffering=1, newline='')
+        self.write_record = formatter(self.file)
+
+    def record(self, host, port, result, latency):
+        '''Called by the scanners as each target finishes, only findings are kept.
+        A port of None means the result is from a ping sweep.'''
+        if result != 0 or not self.streaming:
+            return
+        state = 'up' if port is None else probe_state(result)
+        row = {'host': host, 'port': port, 'state': state,
+               'latency': None if latency is None else round(latency, 6),
+               'timestamp': datetime.now(timezone.utc).isoformat(timespec='milliseconds')}
+        with self.lock:
+            self.write_record(row)
+
+    def write_report(self, report):
+        '''The rendered text report at the end of each scan, which streaming
+        sinks have no use for since every finding has already been written'''
+
+    def write_changes(self, changes):
+        '''Writes a record for each ChangeEvent from a continuous scan, with the
+        state the host or port is in now'''
+        states = {('added', True): 'up', ('removed', True): 'down',
+                  ('added', False): 'open', ('removed', False): 'closed'}
+        with self.lock:
+            for event in changes:
+                self.write_record({'host': event.host, 'port': event.port,
+                                   'state': states[(event.change, event.port is None)],
+                                   'timestamp': event.timestamp, 'change': event.change})
+
+    def close(self):
+        '''Closes the output file'''
+        self.file.close()
+
+def jsonl_formatter(file):
+    '''Writes each record as a JSON object on its own line'''
+    return lambda row: file.write(json.dumps(row) + '\n')
+
+def csv_formatter(file):
+    '''Writes each record as a CSV row, with a header row when the file is new'''
+    writer = csv.DictWriter(file, fieldnames=FIELDS)
+    if file.tell() == 0:
+        writer.writeheader()
+    return writer.writerow
+
+class TextSink:
+    '''The original human readable report, written in full once the scan is done.
+    It takes the same calls as a ResultSink, but has nothing to stream.'''
+    def __init__(self, file_location):
+        self.file_location = file_location
+        self.streaming = False
+
+    def record(self, host, port, result, latency):
+        '''Findings only reach the text file as part of the finished report'''
+
+    def write_changes(self, changes):
+        '''Changes reach the text file as the rewritten report'''
+
+    def write_report(self, report):
+        '''Overwrites the file with the latest report'''
+        with open(self.file_location, 'w+', encoding='utf-8') as file:
+            file.write(report)
+
+    def close(self):
+        '''Nothing is held open between reports'''
+
+FORMATTERS = {'jsonl': jsonl_formatter, 'csv': csv_formatter}
+
+def build_sink(output_format, file_location):
+    '''Returns the sink for the requested output format, the TextSink for text
+    and a streaming ResultSink for the rest'''
+    if output_format == 'text':
+        return TextSink(file_location)
+    return ResultSink(file_location, FORMATTERS[output_format])
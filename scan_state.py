@@ -0,0 +1,46 @@
+'''This class is built for remembering what the last scan found so continuous
+scanning can report what changed without rendering, hashing and diffing text.
+A scan is reduced to the set of hosts that answered the ping sweep and the set
+of (host, port) pairs found open, and the changes between two scans are just
+the set differences between them, which don't depend on how the report was
+formatted or which order a set happened to come out in.'''
+from collections import namedtuple
+from datetime import datetime, timezone
+
+# A single difference between two scans. Change is 'added' or 'removed', and port
+# is None when it's a host that started or stopped answering the ping sweep.
+ChangeEvent = namedtuple('ChangeEvent', ['change', 'host', 'port', 'timestamp'])
+
+class ScanState:
+    '''Up hosts is the set of hosts which answered the ping sweep, left empty when
+    the ping sweep was skipped since every host is then scanned regardless, and
+    open ports is the set of (host, port) pairs found open.'''
+    def __init__(self, up_hosts=(), open_ports=()):
+        self.up_hosts = set(up_hosts)
+        self.open_ports = set(open_ports)
+
+    def diff(self, previous):
+        '''Returns the ChangeEvents that turn the previous state into this one'''
+        timestamp = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+        changes = []
+        for host in sorted(self.up_hosts - previous.up_hosts):
+            changes.append(ChangeEvent('added', host, None, timestamp))
+        for host in sorted(previous.up_hosts - self.up_hosts):
+            changes.append(ChangeEvent('removed', host, None, timestamp))
+        for host, port in sorted(self.open_ports - previous.open_ports):
+            changes.append(ChangeEvent('added', host, port, timestamp))
+        for host, port in sorted(previous.open_ports - self.open_ports):
+            changes.append(ChangeEvent('removed', host, port, timestamp))
+        return changes
+
+    def __len__(self):
+        return len(self.up_hosts) + len(self.open_ports)
+
+def describe_change(event):
+    '''Formats a ChangeEvent for the terminal'''
+    sign = '+' if event.change == 'added' else '-'
+    if event.port is None:
+        state = 'is now up' if event.change == 'added' else 'is no longer up'
+        return f'[{sign}] Host {event.host} {state}'
+    state = 'is now open' if event.change == 'added' else 'is no longer open'
+    return f'[{sign}] Port {event.port} on {event.host} {state}'
@@ -3,12 +3,20 @@ conducted by Host and Network objects. Most of this class is agnostic to
 the type of multithreading, and by adding another scan type scenario to the
 scan target method you could upgrade this to multithreading many types of
 activities.'''
-from asyncio.subprocess import DEVNULL
 import threading
 import platform
 import subprocess
-from queue import Queue
+from contextlib import nullcontext
+import errno
 import socket
+import time
+
+import metrics
+from resources import RESOURCE_ERRORS, cap_concurrency, reset_on_close
+
+# How each probe state reads in the verbose output
+STATE_PHRASES = {'open': 'is open', 'closed': 'is closed', 'filtered': 'is filtered',
+                 'resource': 'was not scanned (resource)', 'error': 'ended in an error'}
 
 class ScanThreader:
     '''The class recognizes one of two scan types, Ping Sweep or Port Scan.
@@ -19,84 +27,239 @@ class ScanThreader:
     throttled by the operating system itself. If the threads is set manually to
     a low number (such as less than 100 for a scan on 5000 ports), then the scan
     will be quite slow. Anything over 1000-2000 on most systems just maxes out
-    what the system itself is capable of.'''
-    def __init__(self, scan_type, scan_items, num_threads, verbosity):
+    what the system itself is capable of, benchmark.py will measure where that
+    point is on a given machine.
+
+    A port scan can also take (host, port) pairs as the scan items and no host,
+    and then returns pairs too. The rest is optional: per_host caps the threads
+    connecting to any one host, timing maps hosts to their RttEstimator, throttle
+    paces the connects, on_result(host, port, errno, latency) is called from the
+    scanning thread as each target finishes, and banners is the BannerGrabber
+    that open sockets are handed to. Stop and skip_hosts can be used from other
+    threads while the scan runs.'''
+    def __init__(self, scan_type, scan_items, num_threads, verbosity, per_host=None,
+                 timing=None, throttle=None, on_result=None, banners=None):
         self.scan_type = scan_type
         self.scan_items = scan_items
-        self.num_threads = num_threads or int((len(scan_items)+1)/2)
+        self.num_threads = cap_concurrency(num_threads or int((len(scan_items)+1)/2),
+                                           verbosity, banners.sockets if banners else 0)
         self.verbosity = verbosity
+        self.per_host = per_host
+        self.timing = timing or {}
+        self.throttle = throttle
+        self.on_result = on_result
+        self.banners = banners
+        self.metrics = metrics.current()
 
-        self.queue = Queue()
+        self.queue = iter(())
+        self.remaining = 0
+        self.resource_errors = 0
+        self.stopped = False
+        self.skip_hosts = set()
+        self.queue_lock = threading.Lock()
         self.scan_results = set()
+        self.host_slots = {}
+        self.slot_lock = threading.Lock()
 
         #so that it has to run once, instead of per thread
         if self.scan_type == "Ping Sweep":
             self.param = '-n' if platform.system().lower()=='windows' else '-c'
 
     def queue_scan(self):
-        '''Queue's the targets for the threading'''
-        for item in self.scan_items:
-            self.queue.put(item)
+        '''Queue's the targets for the threading. Rather than copying every target
+        into a queue up front, the threads share one iterator over the scan items
+        so targets are only produced as a thread is ready for one.'''
+        self.queue = iter(self.scan_items)
+        self.remaining = len(self.scan_items)
 
     def scan_target(self, target, host, timeout):
         '''Core functionality for handling a singular port scan, or a singular
-        ping to a host.'''
+        ping to a host. Returns the errno the connect ended with, 0 when the port
+        is open or the host is up. A host with an RttEstimator connects with its
+        adaptive timeout, and every connect that's answered, accepted or refused,
+        updates it. Connects that fail for lack of file descriptors or local ports
+        are counted so they're reported apart from closed ports, and with banners
+        an open socket is handed to the grabber rather than closed.'''
         if self.scan_type == 'Port Scan':
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.settimeout(timeout)
-                try:
-                    sock.connect((host, target))
-                    self.scan_results.add(target)
-                    return True
-                except socket.error:
-                    self.scan_results.discard(target)
-                    return False
+            estimator = self.timing.get(host)
+            with self.host_slot(host):
+                if self.throttle:
+                    self.throttle.acquire(host)
+                started = time.monotonic()
+                if self.banners:
+                    result, sock = open_connection((host, target),
+                                                   estimator.timeout() if estimator else timeout)
+                else:
+                    result, sock = connect((host, target),
+                                           estimator.timeout() if estimator else timeout), None
+                latency = time.monotonic() - started
+                if estimator and result in (0, errno.ECONNREFUSED):
+                    estimator.update(latency)
+                if self.throttle:
+                    self.throttle.release(host, result)
+                if result in RESOURCE_ERRORS:
+                    with self.queue_lock:
+                        self.resource_errors += 1
+                self.metrics.probe(probe_state(result), latency)
+                if self.on_result:
+                    self.on_result(host, target, result, latency)
+                if sock:
+                    self.banners.submit(sock, host, target)
+                return result
         elif self.scan_type == 'Ping Sweep':
             command = ['ping', self.param, '1', target]
-            with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=DEVNULL) as process:
+            with subprocess.Popen(command, stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL) as process:
                 data = process.communicate()[0].decode()
-                if ('unreachable' not in data and 'Request timed out' not in data
-                or 'bytes from' in data):
-                    self.scan_results.add(target)
-                    return True
-                self.scan_results.discard(target)
-                return False
+                up = ('unreachable' not in data and 'Request timed out' not in data
+                or 'bytes from' in data)
+                if self.on_result:
+                    self.on_result(target, None, 0 if up else errno.ETIMEDOUT, None)
+                return 0 if up else errno.ETIMEDOUT
         return "Scan type malformed"
 
+    def host_slot(self, host):
+        '''Returns the semaphore limiting concurrent connects to a host, creating
+        it the first time the host is seen. With no per host limit a null context
+        is returned so single host scans don't pay for the locking.'''
+        if not self.per_host:
+            return nullcontext()
+        with self.slot_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
     def scan_thread(self, host, timeout):
-        '''Creates an actual thread which calls the scan'''
-        while not self.queue.empty():
-            target = self.queue.get()
-            if self.scan_type == 'Port Scan':
-                up_string = f'[+] Port {target} on {host} is open'
-                down_string = f'[-] Port {target} on {host} is closed or filtered'
-            elif self.scan_type == 'Ping Sweep':
-                up_string = f'[+] Host {target} is up'
-                down_string = f'[-] Host {target} is not responding to pings'
-
-            if self.scan_target(target, host, timeout) and self.verbosity >= 1:
-                print(up_string)
-            else:
-                if self.verbosity >= 2:
-                    print(down_string)
+        '''Creates an actual thread which calls the scan. Targets on a host in skip
+        hosts are passed over without being connected to.'''
+        while True:
+            with self.queue_lock:
+                item = next(self.queue, None)
+                self.remaining -= 1
+            self.metrics.gauge('scan_queue_depth', max(self.remaining, 0))
+            if item is None or self.stopped:
+                return
+            target_host, target = (item if host is None and self.scan_type == 'Port Scan'
+                                   else (host, item))
+            if target_host in self.skip_hosts:
+                continue
+            result = self.scan_target(target, target_host, timeout)
+            if result == 0:
+                self.scan_results.add(item)
+                if self.verbosity >= 1:
+                    with self.metrics.timer('scan_print_seconds_total'):
+                        print(describe_result(self.scan_type, target, target_host, result))
+            elif self.verbosity >= 2:
+                with self.metrics.timer('scan_print_seconds_total'):
+                    print(describe_result(self.scan_type, target, target_host, result))
+
+    def stop(self):
+        '''Stops the scan, safe to call from any thread while it's running'''
+        self.stopped = True
 
     def scan(self, host=None, timeout=1):
         '''Creates the threads and then starts them, then waits for threads to
-        finish then returns results'''
+        finish then returns results. If the wait is interrupted with Ctrl-C the
+        scan is stopped and the threads are joined before it's raised again, so
+        nothing is still scanning, unrecorded, once the caller cleans up.'''
         self.queue_scan()
         thread_list = []
+        if self.throttle:
+            self.throttle.start(self.num_threads)
+        self.metrics.gauge('scan_threads', self.num_threads)
+        if self.banners:
+            self.banners.start(self.num_threads)
 
-        for thrd in range(self.num_threads):
-            if self.verbosity > 2:
-                print(f'Creating thread {thrd}...')
-            thread = threading.Thread(target=self.scan_thread,
-                                    kwargs={'host':host, 'timeout':timeout})
-            thread_list.append(thread)
+        with self.metrics.timer('scan_thread_start_seconds_total'):
+            for thrd in range(self.num_threads):
+                if self.verbosity > 2:
+                    print(f'Creating thread {thrd}...')
+                thread = threading.Thread(target=self.scan_thread,
+                                        kwargs={'host':host, 'timeout':timeout})
+                thread_list.append(thread)
 
-        for thread in thread_list:
-            thread.start()
+            for thread in thread_list:
+                thread.start()
 
-        for thread in thread_list:
-            thread.join()
+        try:
+            for thread in thread_list:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in thread_list:
+                thread.join()
+            raise
+        finally:
+            if self.banners:
+                self.banners.finish()
 
+        if self.throttle and self.verbosity >= 1:
+            print(self.throttle)
+        report_resource_errors(self.resource_errors)
         return self.scan_results
+
+def connect(address, timeout):
+    '''Makes a single blocking connect, returning 0 if it was accepted or else the
+    errno it failed with, ETIMEDOUT if there was no answer in time. Errors creating
+    the socket, like running out of file descriptors, are returned the same way.
+    An accepted connection is reset as it's closed so it doesn't sit in TIME_WAIT.'''
+    result, sock = open_connection(address, timeout)
+    if sock:
+        reset_on_close(sock)
+        sock.close()
+    return result
+
+def open_connection(address, timeout):
+    '''Connects like connect, but returns the connected socket along with the
+    result for the caller to use and close, or None if the connect failed'''
+    sock = None
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        return 0, sock
+    except socket.timeout:
+        result = errno.ETIMEDOUT
+    except OSError as error:
+        result = error.errno or errno.EIO
+    if sock:
+        sock.close()
+    return result, None
+
+def probe_state(result):
+    '''Names the state of a port from the errno its connect ended with'''
+    if result == 0:
+        return 'open'
+    if result == errno.ECONNREFUSED:
+        return 'closed'
+    if result in (errno.ETIMEDOUT, errno.EHOSTUNREACH, errno.ENETUNREACH):
+        return 'filtered'
+    if result in RESOURCE_ERRORS:
+        return 'resource'
+    return 'error'
+
+def describe_result(scan_type, target, host, result):
+    '''The line printed for a finished target, naming the state its errno maps to
+    so ports that ran out of resources aren't reported as closed'''
+    if scan_type == 'Ping Sweep':
+        return f'[+] Host {target} is up' if result == 0 else \
+            f'[-] Host {target} is not responding to pings'
+    state = probe_state(result)
+    sign = '+' if state == 'open' else '-'
+    return f'[{sign}] Port {target} on {host} {STATE_PHRASES[state]}'
+
+def report_resource_errors(count):
+    '''Warns that some targets weren't really scanned because the scanner ran out
+    of file descriptors or local ports, so they shouldn't be read as closed'''
+    if count:
+        print(f'[!] {count} connect(s) failed for lack of local file descriptors or '
+              + 'ports, those targets were not scanned, try fewer threads')
+
+def get_scanner(engine):
+    '''Returns the scanner class for the requested engine. The asyncio engine is
+    only imported when it's asked for, both engines take the same arguments and
+    return the same results so callers don't need to know which one they got.'''
+    if engine == 'async':
+        from async_scanner import AsyncScanner
+        return AsyncScanner
+    return ScanThreader
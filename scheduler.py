@@ -0,0 +1,227 @@
+'''These classes are built for continuous scans that run steadily instead of in
+bursts. Rather than firing every probe at the start of each interval and then
+sitting idle, each Schedule hands out its (host, port) pairs a slice at a time,
+in proportion to how much of its interval has passed, so the probes are spread
+evenly across the interval and a cycle that runs long carries straight on at the
+same pace. Different ports can be on different intervals, such as a few critical
+ports every 30 seconds and the full range every hour, and changes are looked for
+after every slice rather than once the whole cycle is done.'''
+import math
+import random
+import time
+
+from scan_state import ScanState
+from targets import clean_up_ports, stride_order
+
+# How often the scheduler wakes up to scan whatever has come due
+TICK_SECONDS = 1
+
+class Schedule:
+    '''A set of ports to scan on every host once per interval. Every host walks the
+    ports in the same order, so how far a host is through the cycle is just the
+    count of its ports done, which carries over as other hosts come and go. Hosts
+    are kept in cohorts which are as far through the cycle as each other, with
+    unchanging hosts that's a single cohort, and hosts found part way through a
+    cycle join as a new cohort whose ports are spread over what's left of it.
+    Randomized, the ports are walked in an order picked once from the seed, so
+    every cycle walks the same one. Cycles counts the cycles finished, and counted
+    whether the current one has been counted yet.'''
+    def __init__(self, ports, interval, randomize=False, seed=None):
+        self.ports = ports
+        self.interval = interval
+        self.randomize = randomize
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.start, self.stride, self.inverse = stride_order(len(ports), self.seed)
+        self.cohorts = []
+        self.hosts = {}
+        self.cycle_start = None
+        self.cycles = 0
+        self.counted = False
+
+    def rebuild(self, hosts, now):
+        '''Brings the hosts up to date with the latest discovery, dropping the hosts
+        which are gone and adding new ones as a cohort starting now, while every
+        other host keeps its place in the cycle'''
+        hosts = dict.fromkeys(hosts)
+        if hosts.keys() == self.hosts.keys():
+            return
+        for host in [host for host in self.hosts if host not in hosts]:
+            del self.hosts.pop(host)['hosts'][host]
+        self.cohorts = [cohort for cohort in self.cohorts if cohort['hosts']]
+        joined = {host: None for host in hosts if host not in self.hosts}
+        if joined:
+            cohort = {'hosts': joined, 'joined': now, 'done': 0}
+            self.cohorts.append(cohort)
+            self.hosts.update(dict.fromkeys(joined, cohort))
+
+    def port_at(self, step):
+        '''Returns the port every host scans at the given step of the cycle'''
+        if not self.randomize:
+            return self.ports[step]
+        return self.ports[(self.start + step * self.stride) % len(self.ports)]
+
+    def port_step(self, port):
+        '''Returns the step of the cycle at which every host scans the port'''
+        position = self.ports.index(port)
+        if not self.randomize:
+            return position
+        return (position - self.start) * self.inverse % len(self.ports)
+
+    def finished(self):
+        '''Whether every host has had all of its ports handed out this cycle'''
+        return all(cohort['done'] >= len(self.ports) for cohort in self.cohorts)
+
+    def due(self, now):
+        '''Returns the ScheduleSlice that should have been scanned by the end of this
+        tick, or None if there's nothing due. A new cycle starts one interval after
+        the last one did, or straight away if the last one ran over, with every host
+        back in one cohort.'''
+        if self.cycle_start is None:
+            self.cycle_start = now
+        if self.finished() and self.cycle_start + self.interval <= now:
+            late = now - self.cycle_start - self.interval > TICK_SECONDS
+            self.cycle_start = now if late else self.cycle_start + self.interval
+            cohort = {'hosts': dict.fromkeys(self.hosts), 'joined': self.cycle_start, 'done': 0}
+            self.cohorts = [cohort] if self.hosts else []
+            self.hosts = dict.fromkeys(self.hosts, cohort)
+            self.counted = False
+        runs = []
+        for cohort in self.cohorts:
+            end = max(self.cycle_start + self.interval, cohort['joined'] + TICK_SECONDS)
+            share = min(1, (now - cohort['joined'] + TICK_SECONDS) / (end - cohort['joined']))
+            target = min(len(self.ports), math.ceil(len(self.ports) * share))
+            if target > cohort['done']:
+                runs.append((cohort['hosts'], cohort['done'], target))
+                cohort['done'] = target
+        return ScheduleSlice(self, runs) if runs else None
+
+    def finish_cycle(self):
+        '''Returns True, once per cycle, when all of the cycle's ports have been
+        handed out for every host'''
+        if self.counted or not self.finished():
+            return False
+        self.counted = True
+        self.cycles += 1
+        return True
+
+class ScheduleSlice:
+    '''The (host, port) pairs handed out by one tick of a Schedule, as runs of a
+    cohort's hosts over a range of steps of the port order. They're visited port by
+    port across the hosts, like a TargetSpace, and only produced as they're asked for.'''
+    def __init__(self, schedule, runs):
+        self.schedule = schedule
+        self.runs = runs
+
+    def __len__(self):
+        return sum(len(hosts) * (stop - start) for hosts, start, stop in self.runs)
+
+    def __iter__(self):
+        for hosts, start, stop in self.runs:
+            for step in range(start, stop):
+                port = self.schedule.port_at(step)
+                for host in hosts:
+                    yield (host, port)
+
+    def __contains__(self, pair):
+        host, port = pair
+        step = self.schedule.port_step(port)
+        return any(host in hosts and start <= step < stop for hosts, start, stop in self.runs)
+
+class Scheduler:
+    '''Runs the continuous scan for the Network, writing through the FileManager.
+    The hosts are found again every --continuous seconds, and each schedule's due
+    slice is scanned every tick. Until every schedule has been through one full
+    cycle the results only build up the first report, after that each slice's
+    results are compared to the last state written and any changes reported. The
+    schedules are (ports, seconds) pairs from parse_schedules. On cycle, if given,
+    is called as each schedule finishes a cycle.'''
+    def __init__(self, args, network, file, schedules, on_cycle=None):
+        self.args = args
+        self.network = network
+        self.file = file
+        self.on_cycle = on_cycle
+        self.schedules = [Schedule(clean_up_ports(ports), interval, args.randomize)
+                          for ports, interval in schedules]
+        self.next_discovery = None
+        self.baseline = True
+
+    def discover(self, now):
+        '''Finds the live hosts again, carrying over what's known about the hosts
+        which are still up, and rebuilds every schedule around them'''
+        previous = self.network.hosts
+        self.network.discover_hosts()
+        for address, host in previous.items():
+            if address in self.network.up_hosts and (host.open_ports or host.banners):
+                self.network.host(address).open_ports = host.open_ports
+                self.network.host(address).banners = host.banners
+        for schedule in self.schedules:
+            schedule.rebuild(self.network.up_hosts, now)
+        self.next_discovery = now + self.args.continuous
+
+    def scan_slice(self, schedule, targets):
+        '''Scans one slice, and drops any port that was open before but wasn't found
+        open this time'''
+        found = self.network.scan_targets(targets)
+        for host in self.network.hosts.values():
+            for port in [port for port in host.open_ports if port in schedule.ports]:
+                if (host.ip_address, port) in found:
+                    continue
+                if (host.ip_address, port) in targets:
+                    host.open_ports.discard(port)
+                    host.banners.pop(port, None)
+
+    def check(self):
+        '''Reports and writes out anything that changed since the last state written'''
+        state = self.network.scan_state()
+        changes = state.diff(self.file.state or ScanState())
+        if changes:
+            self.file.report_changes(changes)
+            self.file.write_file(str(self.network), state, changes)
+
+    def first_report(self):
+        '''Writes the first full report once every schedule has finished a cycle,
+        compared to the history's last scan if there is one'''
+        state = self.network.scan_state()
+        report = str(self.network)
+        print(report)
+        changes = state.diff(self.file.state) if self.file.state else None
+        if changes:
+            self.file.report_changes(changes)
+        self.file.write_file(report, state, changes)
+
+    def run(self):
+        '''Wakes up every tick to find hosts when it's time, scan each schedule's due
+        slice and check for changes, until interrupted'''
+        for schedule in self.schedules:
+            print(f'Scanning {len(schedule.ports)} port(s) on every host each '
+                  + f'{schedule.interval:g} seconds')
+        while True:
+            now = time.monotonic()
+            if self.next_discovery is None or now >= self.next_discovery:
+                self.discover(now)
+                if not self.baseline:
+                    self.check()
+            for schedule in self.schedules:
+                targets = schedule.due(now)
+                if targets:
+                    self.scan_slice(schedule, targets)
+                    if not self.baseline:
+                        self.check()
+                if schedule.finish_cycle():
+                    if self.baseline and all(each.cycles for each in self.schedules):
+                        self.baseline = False
+                        self.first_report()
+                    if not self.baseline:
+                        self.file.record_history(self.network.scan_state())
+                        if self.on_cycle:
+                            self.on_cycle()
+            time.sleep(max(0, now + TICK_SECONDS - time.monotonic()))
+
+def parse_schedules(args):
+    '''Returns each (ports, seconds) pair to scan on, the -p ports every --continuous
+    seconds plus each PORTS:SECONDS given with --schedule'''
+    schedules = [(args.ports, args.continuous)] if args.ports else []
+    for schedule in args.schedule or ():
+        ports, _, seconds = schedule.rpartition(':')
+        schedules.append((ports, float(seconds)))
+    return schedules
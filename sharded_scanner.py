@@ -0,0 +1,104 @@
+'''This class is built for spreading one port scan over several processes, so a
+large sweep isn't limited to what one interpreter (and its GIL, and its file
+descriptor limit) can push through. The TargetSpace is cut into runs of steps
+which worker processes scan with their own ScanThreader or AsyncScanner, and the
+open ports found in each run are sent back to the parent as the run finishes.'''
+import math
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import metrics
+from scan_threader import get_scanner, probe_state
+from throttle import build_throttle
+from timing import RttEstimator
+
+# Each worker gets about this many runs, enough that a worker which finishes early
+# picks up more rather than sitting idle while another works through a slow run
+RUNS_PER_WORKER = 8
+
+# The most (host, port) pairs in one run, so results come back steadily on large scans
+MAX_RUN = 65536
+
+class ShardedScanner:
+    '''Takes the parsed args, the TargetSpace of (host, port) pairs to scan and,
+    like the other scanners, an optional on_result callback and mapping of hosts
+    to RttEstimators. The thread count, per host limit and rates the user gave are
+    for the whole scan, so each worker gets its share of them.'''
+    def __init__(self, args, scan_items, timing=None, on_result=None):
+        self.args = args
+        self.scan_items = scan_items
+        self.workers = args.workers
+        self.timing = timing
+        self.on_result = on_result
+
+        self.scan_results = set()
+
+    def worker_args(self):
+        '''Divides the scan wide limits between the workers'''
+        args = type(self.args)(**vars(self.args))
+        for option in ('num_threads', 'per_host'):
+            if getattr(args, option):
+                setattr(args, option, math.ceil(getattr(args, option) / self.workers))
+        for option in ('rate', 'host_rate'):
+            if getattr(args, option):
+                setattr(args, option, getattr(args, option) / self.workers)
+        return args
+
+    def scan(self, host=None, timeout=1):
+        '''Submits every run to the pool and merges the results as runs complete.
+        Host is only there to match the other scanners, since the pairs carry their
+        own hosts.'''
+        size = len(self.scan_items)
+        run = min(max(1, math.ceil(size / (self.workers * RUNS_PER_WORKER))), MAX_RUN)
+        args = self.worker_args()
+        seeds = {address: estimator.srtt for address, estimator in (self.timing or {}).items()
+                 if estimator.srtt is not None}
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(scan_run, args, self.scan_items.steps(start, start + run),
+                                   timeout, seeds)
+                       for start in range(0, size, run)]
+            for future in as_completed(futures):
+                findings, rtts, states = future.result()
+                for state, count in states.items():
+                    metrics.current().count('scan_probes_total', count, state=state)
+                for address, port, latency in findings:
+                    self.scan_results.add((address, port))
+                    if self.on_result:
+                        self.on_result(address, port, 0, latency)
+                if self.timing:
+                    for address, srtt in rtts.items():
+                        self.timing.get(address).update(srtt)
+        return self.scan_results
+
+def scan_run(args, targets, timeout, seeds):
+    '''Runs in a worker process, scanning one run of targets with the engine the user
+    chose. Returns the open ports found with their latency, and the smoothed round trip
+    time measured for each host when adaptive timeouts are on, along with how many
+    targets ended in each state for the parent's metrics, since the worker's own
+    metrics are switched off.'''
+    metrics.disable()
+    findings = []
+    states = Counter()
+    timing = None
+    if args.adaptive_timeout:
+        timing = {}
+        for address in {address for address, _ in targets}:
+            timing[address] = RttEstimator(args.timeout, args.min_timeout,
+                                           args.max_timeout or args.timeout)
+            if address in seeds:
+                timing[address].update(seeds[address])
+
+    def collect(address, port, result, latency):
+        states[probe_state(result)] += 1
+        if result == 0:
+            findings.append((address, port, latency))
+
+    scanner = get_scanner(args.engine)
+    scan = scanner('Port Scan', targets, args.num_threads, args.verbosity,
+                   per_host=args.per_host, timing=timing,
+                   throttle=build_throttle(args), on_result=collect)
+    scan.scan(None, timeout)
+    rtts = {address: estimator.srtt for address, estimator in (timing or {}).items()
+            if estimator.srtt is not None}
+    return findings, rtts, states
@@ -0,0 +1,309 @@
+'''These classes describe the space of targets for a scan without expanding it.
+Ports and IPv4 addresses are kept as merged integer intervals, so a /8 or the
+full 1-65535 port range is a single interval no matter how it was typed in,
+duplicates disappear as the intervals merge, and the size is known without
+enumerating anything. The TargetSpace then hands out (host, port) pairs one at
+a time as the scan threads ask for them, optionally in a randomized order.'''
+import ipaddress
+import math
+import random
+from bisect import bisect_right
+
+class IntervalSet:
+    '''A set of integers stored as sorted, non-overlapping, inclusive (start, end)
+    intervals. Adding is cheap since new intervals are only merged in the next time
+    the set is read, and indexing uses the running offsets of each interval so the
+    Nth member can be found with a binary search instead of counting up to it.'''
+    def __init__(self, intervals=()):
+        self.intervals = []
+        self.offsets = []
+        self.size = 0
+        self.pending = list(intervals)
+
+    def add(self, start, end=None):
+        '''Adds a single value, or the inclusive range start to end'''
+        self.pending.append((start, start if end is None else end))
+
+    def update(self, other):
+        '''Merges in the intervals of another IntervalSet'''
+        self.pending.extend(other.merged())
+
+    def merged(self):
+        '''Folds any pending intervals into the sorted list, merging any which
+        overlap or touch, then returns the list'''
+        if self.pending:
+            intervals = sorted(self.intervals + self.pending)
+            self.pending = []
+            self.intervals = []
+            for start, end in intervals:
+                if self.intervals and start <= self.intervals[-1][1] + 1:
+                    if end > self.intervals[-1][1]:
+                        self.intervals[-1] = (self.intervals[-1][0], end)
+                else:
+                    self.intervals.append((start, end))
+            self.offsets = []
+            total = 0
+            for start, end in self.intervals:
+                self.offsets.append(total)
+                total += end - start + 1
+            self.size = total
+        return self.intervals
+
+    def __len__(self):
+        self.merged()
+        return self.size
+
+    def __iter__(self):
+        for start, end in self.merged():
+            yield from range(start, end + 1)
+
+    def __contains__(self, value):
+        intervals = self.merged()
+        position = bisect_right(intervals, (value, math.inf)) - 1
+        return position >= 0 and intervals[position][0] <= value <= intervals[position][1]
+
+    def __getitem__(self, index):
+        intervals = self.merged()
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('IntervalSet index out of range')
+        position = bisect_right(self.offsets, index) - 1
+        return intervals[position][0] + index - self.offsets[position]
+
+    def index(self, value):
+        '''Returns the position of value within the set'''
+        intervals = self.merged()
+        position = bisect_right(intervals, (value, math.inf)) - 1
+        if position < 0 or value > intervals[position][1]:
+            raise ValueError(f'{value} is not in IntervalSet')
+        return self.offsets[position] + value - intervals[position][0]
+
+    def __repr__(self):
+        return f'IntervalSet({self.merged()})'
+
+class AddressSet:
+    '''The set of hosts for a scan. IPv4 addresses go into an IntervalSet of their
+    integer values and anything else, such as a hostname, is kept as a name in the
+    order it was seen. It acts like the set of dotted quad strings it replaces, the
+    addresses are only turned back into strings as they are iterated over.'''
+    def __init__(self, hosts=()):
+        self.addresses = IntervalSet()
+        self.names = {}
+        for host in hosts:
+            self.add(host)
+
+    def add(self, host):
+        '''Adds a single address or hostname'''
+        try:
+            self.addresses.add(int(ipaddress.IPv4Address(host)))
+        except ValueError:
+            self.names[host] = None
+
+    def add_network(self, network):
+        '''Adds every address in an IPv4Network as one interval'''
+        self.addresses.add(int(network.network_address), int(network.broadcast_address))
+
+    def update(self, other):
+        '''Merges in the addresses and names of another AddressSet'''
+        self.addresses.update(other.addresses)
+        self.names.update(other.names)
+
+    def __len__(self):
+        return len(self.addresses) + len(self.names)
+
+    def __iter__(self):
+        for address in self.addresses:
+            yield str(ipaddress.IPv4Address(address))
+        yield from self.names
+
+    def __contains__(self, host):
+        try:
+            return int(ipaddress.IPv4Address(host)) in self.addresses
+        except ValueError:
+            return host in self.names
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < len(self.addresses):
+            return str(ipaddress.IPv4Address(self.addresses[index]))
+        if index < len(self):
+            return list(self.names)[index - len(self.addresses)]
+        raise IndexError('AddressSet index out of range')
+
+    def index(self, host):
+        '''Returns the position of host within the set'''
+        try:
+            return self.addresses.index(int(ipaddress.IPv4Address(host)))
+        except ipaddress.AddressValueError:
+            return len(self.addresses) + list(self.names).index(host)
+
+    def __repr__(self):
+        return f'AddressSet({self.addresses.merged()}, {list(self.names)})'
+
+class TargetSpace:
+    '''Every (host, port) pair of a scan, computed from its position rather than
+    stored. The pairs run port by port across all of the hosts, so consecutive
+    work items go to different hosts. When randomized, positions are visited in
+    the order start, start + stride, start + 2 * stride... modulo the size, which
+    with a stride coprime to the size visits every position exactly once while
+    only remembering two numbers. A seed is always picked up front so the same
+    order can be rebuilt elsewhere, such as in another process.'''
+    def __init__(self, hosts, ports, randomize=False, seed=None):
+        self.hosts = hosts
+        self.ports = ports
+        self.randomize = randomize
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+
+        self.start, self.stride, self.inverse = stride_order(len(self), self.seed)
+
+    def __len__(self):
+        return len(self.hosts) * len(self.ports)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('TargetSpace index out of range')
+        port_index, host_index = divmod(index, len(self.hosts))
+        return (self.hosts[host_index], self.ports[port_index])
+
+    def index(self, host, port):
+        '''Returns the position of the (host, port) pair within the space'''
+        return self.ports.index(port) * len(self.hosts) + self.hosts.index(host)
+
+    def position(self, step):
+        '''Returns the position visited at the given step of the scan order'''
+        if not self.randomize:
+            return step
+        return (self.start + step * self.stride) % len(self)
+
+    def step(self, host, port):
+        '''Returns the step of the scan order at which the (host, port) pair is
+        visited, undoing the stride with its inverse modulo the size'''
+        position = self.index(host, port)
+        if not self.randomize:
+            return position
+        return (position - self.start) * self.inverse % len(self)
+
+    def steps(self, start, stop):
+        '''Returns a TargetRange of the pairs visited from step start up to stop'''
+        return TargetRange(self, start, min(stop, len(self)))
+
+    def remaining(self, done):
+        '''Returns a TargetRemainder of the pairs whose steps aren't in done'''
+        return TargetRemainder(self, done)
+
+    def __iter__(self):
+        if not self.randomize:
+            for port in self.ports:
+                for host in self.hosts:
+                    yield (host, port)
+            return
+        for step in range(len(self)):
+            yield self[self.position(step)]
+
+class TargetRange:
+    '''A contiguous run of steps from a TargetSpace's scan order, which is how the
+    space is split up to be scanned by more than one process'''
+    def __init__(self, space, start, stop):
+        self.space = space
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def __iter__(self):
+        for step in range(self.start, self.stop):
+            yield self.space[self.space.position(step)]
+
+class TargetRemainder:
+    '''The steps of a TargetSpace's scan order which haven't been done yet, where
+    done is an IntervalSet of steps, so a resumed scan only hands out the gaps'''
+    def __init__(self, space, done):
+        self.space = space
+        self.done = done
+
+    def __len__(self):
+        return len(self.space) - len(self.done)
+
+    def __iter__(self):
+        step = 0
+        for start, end in self.done.merged():
+            for gap in range(step, start):
+                yield self.space[self.space.position(gap)]
+            step = end + 1
+        for gap in range(step, len(self.space)):
+            yield self.space[self.space.position(gap)]
+
+def stride_order(size, seed):
+    '''Picks the start and stride of a randomized order over size positions from the
+    seed, returning them with the stride's inverse modulo size, which turns a
+    position back into its step'''
+    rng = random.Random(seed)
+    start = rng.randrange(size) if size else 0
+    stride = rng.randrange(1, size) if size > 1 else 1
+    while math.gcd(stride, size) > 1:
+        stride += 1
+    return start, stride, pow(stride, -1, size) if size else 0
+
+def clean_up_ips(input_ips):
+    '''This function is used recursively to parse user input for ips into a usable format.
+    A set is used so that duplicates can't be added to the final list and therefore unecessarily
+    scanned twice. On each loop the item in the set is searched for a comma, dash, or backslash,
+    and if any are found then it's split on the comma, or the range is expanded, or
+    a CIDR network is provided using the ipaddress libary. IF any of these indicators are found,
+    then a subset is created and recursively sent through the function until finally no items in
+    the list flag on any of these indicators and the recursion folds into itself back up to the
+    original function call. The result is an AddressSet, so a CIDR block is stored as
+    one interval rather than every address in it.'''
+    if isinstance(input_ips, str):
+        input_ips = set([input_ips])
+
+    output_ips = AddressSet()
+    for host in input_ips:
+        if ',' in host:
+            for item in host.split(','):
+                output_ips.update(clean_up_ips(item))
+        elif '-' in host:
+            octets = host.split('.')
+            subnet_request = False
+            for octet in octets:
+                if '-' in octet:
+                    index = octets.index(octet)
+                    start, end = octet.split('-')
+                    if '/' in end:
+                        end, subnet = end.split('/')
+                        subnet_request = True
+                    octet_range = range(int(start), int(end)+1)
+            for octet in octet_range:
+                octets[index] = (str(octet) + '/' + subnet) if subnet_request else octet
+                output_ips.update(clean_up_ips(f'{octets[0]}.{octets[1]}.{octets[2]}.{octets[3]}'))
+        elif '/' in host:
+            output_ips.add_network(ipaddress.IPv4Network(host, strict=False))
+        else:
+            output_ips.add(host)
+    return output_ips
+
+def clean_up_ports(input_ports):
+    '''Uses recursion similar to the IP clean up function to detect indicators
+    which may exist in user input and splitting the input up into an IntervalSet.
+    Ranges are added as a single interval rather than expanded, and repeated or
+    overlapping ports merge together, so 1-65535 costs the same as one port.'''
+    if isinstance(input_ports, str):
+        input_ports = set([input_ports])
+
+    output_ports = IntervalSet()
+
+    for item in input_ports:
+        if ',' in item:
+            for piece in item.split(','):
+                output_ports.update(clean_up_ports(piece))
+        elif '-' in item:
+            start, stop = item.split('-')
+            output_ports.add(int(start), int(stop))
+        else:
+            output_ports.add(int(item))
+    return output_ports
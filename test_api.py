@@ -0,0 +1,51 @@
+'''Tests for the embedding API against loopback listeners, run with python -m pytest'''
+import asyncio
+
+import pytest
+
+import api
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_scan_yields_every_state(engine, listeners):
+    with api.scan('127.0.0.1', listeners.ports, engine=engine, timeout=0.5) as results:
+        found = {(result.port, result.state) for result in results}
+    assert found == {(port, 'open') for port in listeners.open} | \
+        {(port, 'closed') for port in listeners.closed}
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_states_leaves_out_the_rest(engine, listeners):
+    with api.scan('127.0.0.1', listeners.ports, engine=engine, states={'open'}) as results:
+        found = [result for result in results]
+    assert sorted(result.port for result in found) == sorted(listeners.open)
+    assert all(result.host == '127.0.0.1' and result.latency >= 0 for result in found)
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_first_open_stops_at_the_first_open_port(engine, listeners):
+    '''With one thread the ports are scanned in order, so everything up to the
+    lowest open port is reported and nothing after it'''
+    ports = [*listeners.closed, *listeners.open]
+    with api.scan(['127.0.0.1'], ports, engine=engine, num_threads=1,
+                  first_open=True) as results:
+        found = [result.port for result in results]
+    assert found == [port for port in sorted(ports) if port <= min(listeners.open)]
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_scan_async(engine, listeners):
+    async def collect():
+        async with api.scan_async('127.0.0.1', listeners.ports, engine=engine,
+                                  states={'open'}) as results:
+            return sorted([result.port async for result in results])
+    assert asyncio.run(collect()) == sorted(listeners.open)
+
+def test_adaptive_timeouts_are_only_kept_for_hosts_reached():
+    options = api.scan_options({'adaptive_timeout': True})
+    scanner = api.build_scanner('10.0.0.0/8', '80', options, None)
+    assert not scanner.timing.items()
+    assert scanner.timing.get('10.0.0.1').timeout() == options.timeout
+    assert [host for host, _ in scanner.timing.items()] == ['10.0.0.1']
+
+def test_unknown_options_are_refused():
+    with pytest.raises(TypeError):
+        api.scan('127.0.0.1', 80, thread=4)
+    with pytest.raises(ValueError):
+        api.scan('127.0.0.1', 80, engine='fork')
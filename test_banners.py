@@ -0,0 +1,78 @@
+'''Tests for banner grabbing over the scan's own connections, run with
+python -m pytest'''
+import socket
+import threading
+
+import pytest
+
+from banners import PROBES, BannerGrabber
+from resources import max_concurrency
+from scan_threader import get_scanner
+from targets import TargetSpace, clean_up_ips, clean_up_ports
+
+class Services:
+    '''Loopback services, one which speaks first and one which answers the HTTP
+    probe, each accepting on a thread of its own'''
+    def __init__(self):
+        self.sockets = []
+        self.speaks = self.serve(lambda conn: conn.sendall(b'SSH-2.0-Test\r\n'))
+        self.answers = self.serve(lambda conn: conn.recv(1024).startswith(b'HEAD')
+                                  and conn.sendall(b'HTTP/1.0 200 OK\r\n\r\n'))
+
+    def serve(self, respond):
+        listener = socket.create_server(('127.0.0.1', 0))
+        self.sockets.append(listener)
+
+        def accept():
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                with conn:
+                    try:
+                        respond(conn)
+                        conn.recv(1)
+                    except OSError:
+                        pass
+
+        threading.Thread(target=accept, daemon=True).start()
+        return listener.getsockname()[1]
+
+    def close(self):
+        for sock in self.sockets:
+            sock.close()
+
+@pytest.fixture
+def services():
+    running = Services()
+    yield running
+    running.close()
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_banners_are_read_over_the_scan_connection(engine, services):
+    grabber = BannerGrabber(0.4, PROBES['http'])
+    space = TargetSpace(clean_up_ips('127.0.0.1'),
+                        clean_up_ports(f'{services.speaks},{services.answers}'))
+    found = get_scanner(engine)('Port Scan', space, 2, 0, banners=grabber).scan(None, 1)
+    assert len(found) == 2
+    assert grabber.banners[('127.0.0.1', services.speaks)] == 'SSH-2.0-Test'
+    assert grabber.banners[('127.0.0.1', services.answers)].startswith('HTTP/1.0 200 OK')
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_one_banner_socket_at_a_time(engine, services):
+    '''With room for a single socket the scan waits for each banner to be read
+    before handing over the next, rather than failing'''
+    grabber = BannerGrabber(0.4, PROBES['http'])
+    grabber.sockets = 1
+    space = TargetSpace(clean_up_ips('127.0.0.1'),
+                        clean_up_ports(f'{services.speaks},{services.answers}'))
+    get_scanner(engine)('Port Scan', space, 2, 0, banners=grabber).scan(None, 1)
+    assert len(grabber.banners) == 2
+
+def test_grabber_reserves_its_sockets_from_the_scan():
+    grabber = BannerGrabber(2)
+    requested = max_concurrency()
+    space = TargetSpace(clean_up_ips('127.0.0.1'), clean_up_ports('1-65535'))
+    scan = get_scanner('thread')('Port Scan', space, requested, 0, banners=grabber)
+    assert scan.num_threads == max(1, requested - grabber.sockets)
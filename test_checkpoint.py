@@ -0,0 +1,121 @@
+'''Tests for checkpointing and resuming a port scan, run with python -m pytest'''
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+import checkpoint as checkpoint_module
+from checkpoint import Checkpoint
+from network import Network
+from port_scanner import build_parser
+from targets import TargetSpace, clean_up_ips, clean_up_ports
+
+def scan_args(hosts, ports, location):
+    return build_parser().parse_args([hosts, '-p', ports, '-s', '-t', '0.5', '-cp', location])
+
+def lines(location):
+    with open(location, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+def test_progress_is_compacted(tmp_path):
+    location = str(tmp_path / 'scan.cp')
+    args = scan_args('10.0.0.0/30', '1-100', location)
+    space = TargetSpace(clean_up_ips(args.hosts), clean_up_ports(args.ports), randomize=True)
+    saved = Checkpoint(location)
+    saved.start(args, space, {})
+    pairs = list(space)
+    for flush in range(checkpoint_module.COMPACT_EVERY - 1):
+        host, port = pairs[flush]
+        saved.record(host, port, 0 if flush == 3 else 111, 0.001)
+        with saved.lock:
+            saved.flush()
+    # The header and empty progress written on start, then a line per flush
+    assert len(lines(location)) == checkpoint_module.COMPACT_EVERY + 1
+    host, port = pairs[checkpoint_module.COMPACT_EVERY - 1]
+    saved.record(host, port, 111, 0.001)
+    with saved.lock:
+        saved.flush()
+
+    header, progress = lines(location)
+    assert header['type'] == 'header' and header['spec']['seed'] == space.seed
+    assert progress['steps'] == [[0, checkpoint_module.COMPACT_EVERY - 1]]
+    assert progress['open'] == [[*pairs[3], 0.001]]
+    saved.finish()
+
+def test_load_stops_at_a_cut_off_line(tmp_path):
+    location = str(tmp_path / 'scan.cp')
+    args = scan_args('10.0.0.1', '1-10', location)
+    space = TargetSpace(clean_up_ips(args.hosts), clean_up_ports(args.ports))
+    saved = Checkpoint(location)
+    saved.start(args, space, {})
+    saved.record('10.0.0.1', 1, 111, 0.001)
+    saved.finish()
+    with open(location, 'a', encoding='utf-8') as file:
+        file.write('{"type": "progress", "steps": [[5, 9]')
+
+    loaded = Checkpoint(location)
+    assert loaded.load()
+    assert loaded.done.merged() == [(0, 0)]
+    assert list(loaded.resumed_space) == list(space)
+
+def test_missing_checkpoint_is_not_loaded(tmp_path):
+    assert not Checkpoint(str(tmp_path / 'none.cp')).load()
+
+def test_resume_only_scans_whats_left(tmp_path, listeners):
+    '''Half of the targets are recorded as finished, including one of the open
+    ports, then the scan is resumed against the real listeners'''
+    location = str(tmp_path / 'scan.cp')
+    args = scan_args('127.0.0.1', listeners.ports, location)
+    args.randomize = True
+    space = TargetSpace(clean_up_ips(args.hosts), clean_up_ports(args.ports), randomize=True)
+    pairs = list(space)
+    half = len(pairs) // 2
+    saved = Checkpoint(location)
+    saved.start(args, space, {})
+    for host, port in pairs[:half]:
+        saved.record(host, port, 0 if port in listeners.open else 111, 0.001)
+    saved.finish()
+
+    results = []
+    resumed = Checkpoint(location)
+    assert resumed.load()
+    network = Network(args, lambda *result: results.append(result), resumed)
+    network.scan_hosts()
+
+    replayed = [(host, port) for host, port, _, latency in results if latency == 0.001]
+    scanned = [(host, port) for host, port, _, latency in results if latency != 0.001]
+    assert replayed == [pair for pair in pairs[:half] if pair[1] in listeners.open]
+    assert sorted(scanned) == sorted(pairs[half:])
+    assert network.hosts['127.0.0.1'].open_ports == set(listeners.open)
+
+    finished = Checkpoint(location)
+    finished.load()
+    assert len(finished.done) == len(pairs)
+
+def test_interrupted_threaded_scan_saves_what_it_scanned(tmp_path):
+    '''Ctrl-C part way through a rate limited scan of loopback stops the threads
+    before the checkpoint is finished, so every port the scan printed is saved'''
+    location = str(tmp_path / 'scan.cp')
+    scanner = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'port_scanner.py')
+    process = subprocess.Popen([sys.executable, scanner, '127.0.0.1', '-p', '1-5000', '-s',
+                                '-n', '4', '-R', '200', '-v', '2', '-e', 'thread',
+                                '-cp', location, '-o', str(tmp_path / 'scan.jsonl'),
+                                '-f', 'jsonl'],
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    time.sleep(1.5)
+    process.send_signal(signal.SIGINT)
+    interrupted = time.monotonic()
+    output = process.communicate(timeout=10)[0]
+    assert time.monotonic() - interrupted < 3
+    assert 'User exited..' in output
+
+    scanned = {('127.0.0.1', int(port)) for port in re.findall(r'Port (\d+) on', output)}
+    saved = Checkpoint(location)
+    assert saved.load()
+    assert 0 < len(scanned) < 5000
+    assert scanned <= {saved.resumed_space[saved.resumed_space.position(step)]
+                       for step in saved.done}
+    assert not scanned & set(saved.resumed_space.remaining(saved.done))
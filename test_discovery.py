@@ -0,0 +1,23 @@
+'''Tests for the TCP ping sweep against loopback listeners, run with python -m pytest'''
+import errno
+
+import discovery
+from discovery import PingSweeper
+
+def test_tcp_sweep_counts_a_refusal_as_up(listeners):
+    sweeper = PingSweeper(['127.0.0.1'], 0.5, 0, method='tcp',
+                          tcp_ports=(listeners.closed[0], listeners.open[0]))
+    assert sweeper.sweep() == {'127.0.0.1'}
+    assert sweeper.rtts['127.0.0.1'] >= 0
+
+def test_tcp_sweep_out_of_sockets_finds_nothing(listeners, monkeypatch, capsys):
+    '''Running out of file descriptors shouldn't stop the sweep, the hosts just
+    don't answer and the shortfall is reported'''
+    def no_sockets(*args):
+        raise OSError(errno.EMFILE, 'Too many open files')
+    monkeypatch.setattr(discovery.socket, 'socket', no_sockets)
+    sweeper = PingSweeper(['127.0.0.1', '127.0.0.2'], 0.5, 0, method='tcp',
+                          tcp_ports=(listeners.open[0],))
+    assert sweeper.sweep() == set()
+    assert sweeper.resource_errors == 2
+    assert '2 connect(s) failed for lack of local file descriptors' in capsys.readouterr().out
@@ -0,0 +1,137 @@
+'''Tests for the coordinator and worker lease protocol over loopback, run with
+python -m pytest'''
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from distributed import Coordinator, run_worker, send
+from port_scanner import build_parser
+from targets import TargetSpace, clean_up_ips, clean_up_ports
+
+class Client:
+    '''A worker speaking the protocol by hand, so the test decides when it goes quiet'''
+    def __init__(self, port, token=None):
+        self.conn = socket.create_connection(('127.0.0.1', port))
+        self.reader = self.conn.makefile('r', encoding='utf-8')
+        self.token = token
+
+    def lease(self):
+        '''Asks for work and returns the lease handed out'''
+        send(self.conn, {'type': 'next', 'token': self.token})
+        while True:
+            message = json.loads(self.reader.readline())
+            if message['type'] == 'lease':
+                return message
+
+    def send(self, message_type, lease, **fields):
+        send(self.conn, {'type': message_type, 'lease': lease['id'], **fields})
+
+    def close(self):
+        self.reader.close()
+        self.conn.close()
+
+class Scan:
+    '''Runs the coordinator's scan on a thread, keeping what it returns'''
+    def __init__(self, coordinator):
+        self.results = None
+        self.thread = threading.Thread(target=self.run, args=(coordinator,), daemon=True)
+        self.thread.start()
+
+    def run(self, coordinator):
+        self.results = coordinator.scan()
+
+    def wait(self, timeout=10):
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+def coordinator(hosts, ports, *options):
+    '''Returns a Coordinator listening on a free loopback port, and the port'''
+    args = build_parser().parse_args([hosts, '-p', ports, '-co', '127.0.0.1:0', *options])
+    space = TargetSpace(clean_up_ips(hosts), clean_up_ports(ports))
+    leader = Coordinator(args, space)
+    leader.listen()
+    return leader, leader.listener.getsockname()[1]
+
+def test_worker_scans_every_lease(listeners):
+    leader, port = coordinator('127.0.0.1', listeners.ports, '-ls', '3')
+    worker_args = build_parser().parse_args(['-wo', f'127.0.0.1:{port}', '-n', '4', '-t', '0.5'])
+    threading.Thread(target=run_worker, args=(worker_args,), daemon=True).start()
+    scan = Scan(leader)
+    assert scan.wait()
+    assert scan.results == {('127.0.0.1', open_port) for open_port in listeners.open}
+
+def test_wrong_token_is_turned_away():
+    leader, port = coordinator('127.0.0.1', '1', '-tk', 'secret')
+    client = Client(port, token='guess')
+    send(client.conn, {'type': 'next', 'token': client.token})
+    assert client.reader.readline() == ''
+    client.close()
+
+def test_progress_keeps_a_quiet_lease():
+    leader, port = coordinator('127.0.0.1', '1-10', '-lt', '0.6')
+    scan = Scan(leader)
+    client = Client(port)
+    lease = client.lease()
+    assert lease['heartbeat'] == pytest.approx(0.2)
+    for _ in range(12):
+        time.sleep(lease['heartbeat'])
+        client.send('progress', lease, probes=0)
+    client.send('done', lease)
+    assert scan.wait()
+    assert not leader.expired
+    client.close()
+
+def test_expired_lease_is_given_back_to_its_worker():
+    leader, port = coordinator('127.0.0.1', '1-10', '-lt', '0.3')
+    scan = Scan(leader)
+    client = Client(port)
+    lease = client.lease()
+    deadline = time.monotonic() + 5
+    while lease['id'] not in leader.expired and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert lease['id'] in leader.expired
+    client.send('result', lease, host='127.0.0.1', port=5, latency=0.001)
+    client.send('done', lease)
+    assert scan.wait()
+    assert scan.results == {('127.0.0.1', 5)}
+    client.close()
+
+def test_reassigned_lease_only_counts_from_its_new_worker():
+    leader, port = coordinator('127.0.0.1', '1-10', '-lt', '0.3')
+    scan = Scan(leader)
+    first = Client(port)
+    lease = first.lease()
+    deadline = time.monotonic() + 5
+    while lease['id'] not in leader.expired and time.monotonic() < deadline:
+        time.sleep(0.1)
+    second = Client(port)
+    reassigned = second.lease()
+    assert (reassigned['start'], reassigned['stop']) == (lease['start'], lease['stop'])
+    first.send('result', lease, host='127.0.0.1', port=5, latency=0.001)
+    first.send('done', lease)
+    assert not scan.wait(0.5)
+    second.send('done', reassigned)
+    assert scan.wait()
+    assert scan.results == set()
+    first.close()
+    second.close()
+
+@pytest.mark.filterwarnings('error::pytest.PytestUnhandledThreadExceptionWarning')
+@pytest.mark.parametrize('message', [{'type': 'progress'}, {'type': 'done'}, {'lease': 1}, [1]])
+def test_malformed_message_only_drops_its_worker(message):
+    leader, port = coordinator('127.0.0.1', '1-10', '-lt', '5')
+    scan = Scan(leader)
+    client = Client(port)
+    lease = client.lease()
+    send(client.conn, message)
+    assert client.reader.readline() == ''
+    client.close()
+    other = Client(port)
+    reassigned = other.lease()
+    assert (reassigned['start'], reassigned['stop']) == (lease['start'], lease['stop'])
+    other.send('done', reassigned)
+    assert scan.wait()
+    other.close()
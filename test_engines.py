@@ -0,0 +1,43 @@
+'''Tests for the thread and asyncio scan engines against loopback listeners, run
+with python -m pytest'''
+import os
+import subprocess
+import sys
+
+import pytest
+
+from scan_threader import get_scanner
+from targets import TargetSpace, clean_up_ips, clean_up_ports
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_engines_find_the_same_ports(engine, listeners):
+    results = {}
+
+    def record(host, port, result, latency):
+        results[port] = result
+
+    space = TargetSpace(clean_up_ips('127.0.0.1'), clean_up_ports(listeners.ports))
+    scanner = get_scanner(engine)('Port Scan', space, 4, 0, on_result=record)
+    found = scanner.scan(None, 0.5)
+    assert found == {('127.0.0.1', port) for port in listeners.open}
+    assert sorted(port for port, result in results.items() if result) == sorted(listeners.closed)
+
+def test_threaded_scans_dont_load_asyncio(listeners):
+    '''Run in a fresh interpreter, since pytest itself has asyncio loaded'''
+    code = ('import sys, network, port_scanner\n'
+            'args = port_scanner.build_parser().parse_args(\n'
+            f'    ["127.0.0.1", "-p", "{listeners.ports}", "-s", "-b"])\n'
+            'network.Network(args).scan_hosts()\n'
+            'print("asyncio" in sys.modules)\n')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    assert output.stdout.splitlines()[-1] == 'False'
+
+def test_async_engine_ignores_what_on_result_returns_unless_awaitable(listeners):
+    space = TargetSpace(clean_up_ips('127.0.0.1'), clean_up_ports(listeners.ports))
+    results = {}
+    scanner = get_scanner('async')('Port Scan', space, 4, 0,
+                                   on_result=lambda host, port, result, latency:
+                                   results.setdefault(port, result))
+    scanner.scan(None, 0.5)
+    assert len(results) == len(space)
@@ -0,0 +1,39 @@
+'''Tests for the SQLite scan history, run with python -m pytest'''
+import pytest
+
+from history import HistoryStore
+from scan_state import ScanState
+
+@pytest.fixture
+def store(tmp_path):
+    history = HistoryStore(str(tmp_path / 'scans.db'))
+    history.record_run(ScanState({'10.0.0.1', '10.0.1.1'}, {('10.0.0.1', 22)}),
+                       '10.0.0.0/16', '1-1024', timestamp=100)
+    history.record_run(ScanState({'10.0.0.1'}, {('10.0.0.1', 22), ('10.0.0.1', 3389)}),
+                       '10.0.0.0/16', '1-1024', timestamp=200)
+    history.record_run(ScanState(set(), {('192.168.1.1', 3389)}), '192.168.1.1', '3389',
+                       timestamp=300)
+    yield history
+    history.close()
+
+def test_last_state_is_the_latest_run_over_the_same_targets(store):
+    state = store.last_state('10.0.0.0/16', '1-1024')
+    assert state.up_hosts == {'10.0.0.1'}
+    assert state.open_ports == {('10.0.0.1', 22), ('10.0.0.1', 3389)}
+    assert store.last_state('10.0.0.0/16', '22') is None
+
+def test_query_filters_by_network_port_and_time(store):
+    assert store.query(port=3389) == [('10.0.0.1', 3389, 'open', 200),
+                                      ('192.168.1.1', 3389, 'open', 300)]
+    assert store.query(network='10.0.0.0/24', port=22) == [('10.0.0.1', 22, 'open', 100),
+                                                           ('10.0.0.1', 22, 'open', 200)]
+    assert store.query(network='10.0.1.0/24') == [('10.0.1.1', None, 'up', 100)]
+    assert [row[3] for row in store.query(since=150, until=250)] == [200, 200, 200]
+
+def test_query_summaries(store):
+    assert store.query(port=22, summary='first') == [('10.0.0.1', 22, 'open', 100)]
+    assert store.query(port=22, summary='last') == [('10.0.0.1', 22, 'open', 200)]
+
+def test_runs_count_their_findings(store):
+    assert [(run[2], run[4]) for run in store.runs()] == [
+        ('10.0.0.0/16', 3), ('10.0.0.0/16', 3), ('192.168.1.1', 1)]
@@ -0,0 +1,31 @@
+'''Tests for resolving hostnames once per scan, run with python -m pytest'''
+from network import Network
+from port_scanner import build_parser
+from resolver import DnsCache
+
+def test_answers_are_cached_until_they_expire():
+    cache = DnsCache(ttl=300)
+    assert cache.resolve(['localhost']) == {'localhost': ['127.0.0.1']}
+    expires = cache.entries['localhost'][1]
+    cache.resolve(['localhost', 'localhost'])
+    assert cache.entries['localhost'][1] == expires
+
+def test_expired_answers_are_looked_up_again():
+    cache = DnsCache(ttl=0)
+    cache.resolve(['localhost'])
+    expires = cache.entries['localhost'][1]
+    cache.resolve(['localhost'])
+    assert cache.entries['localhost'][1] > expires
+
+def test_names_that_dont_resolve_are_left_out_and_not_cached(capsys):
+    cache = DnsCache()
+    assert cache.resolve(['localhost', 'nothing.invalid']) == {'localhost': ['127.0.0.1']}
+    assert 'nothing.invalid' not in cache.entries
+    assert 'Could not resolve nothing.invalid' in capsys.readouterr().out
+
+def test_names_sharing_an_address_are_scanned_as_one_host():
+    args = build_parser().parse_args(['localhost,127.0.0.1', '-p', '1', '-s'])
+    network = Network(args)
+    network.resolve_hosts()
+    assert list(network.targets) == ['127.0.0.1']
+    assert network.aliases == {'127.0.0.1': ['localhost']}
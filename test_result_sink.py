@@ -0,0 +1,76 @@
+'''Tests for the streaming result sinks, run with python -m pytest'''
+import csv
+import errno
+import json
+
+from network import Network
+from port_scanner import build_parser
+from result_sink import FIELDS, ResultSink, TextSink, build_sink
+from scan_state import ScanState
+
+def test_jsonl_writes_a_line_per_finding(tmp_path):
+    location = str(tmp_path / 'scan.jsonl')
+    sink = build_sink('jsonl', location)
+    assert isinstance(sink, ResultSink)
+    sink.record('10.0.0.1', None, 0, 0.0012345678)
+    sink.record('10.0.0.1', 22, 0, 0.002)
+    sink.record('10.0.0.1', 23, errno.ECONNREFUSED, 0.001)
+    sink.close()
+    with open(location, encoding='utf-8') as file:
+        records = [json.loads(line) for line in file]
+    assert [(record['host'], record['port'], record['state']) for record in records] == \
+        [('10.0.0.1', None, 'up'), ('10.0.0.1', 22, 'open')]
+    assert records[0]['latency'] == 0.001235
+    assert records[1]['timestamp'].endswith('+00:00')
+
+def test_csv_writes_the_header_once(tmp_path):
+    location = str(tmp_path / 'scan.csv')
+    for port in (22, 80):
+        sink = build_sink('csv', location)
+        sink.record('10.0.0.1', port, 0, 0.001)
+        sink.close()
+    with open(location, encoding='utf-8', newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == FIELDS
+    assert [row[:3] for row in rows[1:]] == [['10.0.0.1', '22', 'open'], ['10.0.0.1', '80', 'open']]
+
+def test_changes_are_appended_once_streaming_stops(tmp_path):
+    location = str(tmp_path / 'scan.jsonl')
+    sink = build_sink('jsonl', location)
+    sink.streaming = False
+    sink.record('10.0.0.1', 22, 0, 0.001)
+    changes = ScanState({'10.0.0.2'}, {('10.0.0.1', 443)}).diff(
+        ScanState({'10.0.0.3'}, {('10.0.0.1', 22)}))
+    sink.write_changes(changes)
+    sink.close()
+    with open(location, encoding='utf-8') as file:
+        records = [json.loads(line) for line in file]
+    assert [(record['host'], record['port'], record['state'], record['change'])
+            for record in records] == [('10.0.0.2', None, 'up', 'added'),
+                                       ('10.0.0.3', None, 'down', 'removed'),
+                                       ('10.0.0.1', 443, 'open', 'added'),
+                                       ('10.0.0.1', 22, 'closed', 'removed')]
+
+def test_text_sink_only_writes_the_report(tmp_path):
+    location = str(tmp_path / 'scan.txt')
+    sink = build_sink('text', location)
+    assert isinstance(sink, TextSink)
+    sink.record('10.0.0.1', 22, 0, 0.001)
+    sink.write_report('first')
+    sink.write_report('second')
+    sink.close()
+    with open(location, encoding='utf-8') as file:
+        assert file.read() == 'second'
+
+def test_streaming_report_only_lists_hosts_with_findings(tmp_path, listeners):
+    '''Only 127.0.0.1 has listeners, every other address refuses, so a streaming
+    scan of the range shouldn't build a Host for any of them'''
+    args = build_parser().parse_args(['127.0.0.1-64', '-p', listeners.ports, '-s', '-t', '0.5',
+                                      '-f', 'jsonl'])
+    network = Network(args)
+    network.scan_hosts()
+    report = str(network)
+    assert list(network.hosts) == ['127.0.0.1']
+    assert report.count('\nHost ') == 1
+    args.format = 'text'
+    assert str(network).count('\nHost ') == 64
@@ -0,0 +1,26 @@
+'''Tests for diffing continuous scans, run with python -m pytest'''
+from scan_state import ScanState, describe_change
+
+def test_same_findings_in_any_order_have_no_changes():
+    first = ScanState(['10.0.0.2', '10.0.0.1'], [('10.0.0.1', 443), ('10.0.0.1', 22)])
+    second = ScanState({'10.0.0.1', '10.0.0.2'}, {('10.0.0.1', 22), ('10.0.0.1', 443)})
+    assert second.diff(first) == []
+
+def test_diff_reports_hosts_then_ports():
+    previous = ScanState({'10.0.0.1', '10.0.0.3'}, {('10.0.0.1', 22), ('10.0.0.1', 80)})
+    current = ScanState({'10.0.0.1', '10.0.0.2'}, {('10.0.0.1', 80), ('10.0.0.2', 443)})
+    changes = current.diff(previous)
+    assert [(event.change, event.host, event.port) for event in changes] == [
+        ('added', '10.0.0.2', None), ('removed', '10.0.0.3', None),
+        ('added', '10.0.0.2', 443), ('removed', '10.0.0.1', 22)]
+    assert len({event.timestamp for event in changes}) == 1
+
+def test_first_scan_against_nothing_adds_everything():
+    current = ScanState({'10.0.0.1'}, {('10.0.0.1', 22)})
+    assert len(current.diff(ScanState())) == len(current) == 2
+
+def test_describe_change():
+    added, removed = ScanState({'10.0.0.1'}, {('10.0.0.1', 22)}).diff(
+        ScanState(set(), set()))[0], ScanState().diff(ScanState((), {('10.0.0.1', 22)}))[0]
+    assert describe_change(added) == '[+] Host 10.0.0.1 is now up'
+    assert describe_change(removed) == '[-] Port 22 on 10.0.0.1 is no longer open'
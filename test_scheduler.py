@@ -0,0 +1,74 @@
+'''Tests for spreading continuous scans over their interval, run with
+python -m pytest'''
+from collections import Counter
+
+from scheduler import TICK_SECONDS, Schedule
+from targets import clean_up_ips, clean_up_ports
+
+def run_cycle(schedule, start, seconds):
+    '''Ticks the schedule once a second from start, returning every pair handed out
+    and the slices they came in'''
+    pairs = []
+    slices = []
+    for now in range(start, start + seconds, TICK_SECONDS):
+        due = schedule.due(now)
+        if due:
+            slices.append(len(due))
+            pairs.extend(due)
+    return pairs, slices
+
+def test_cycle_is_spread_over_the_interval():
+    hosts = clean_up_ips('10.0.0.0/30')
+    schedule = Schedule(clean_up_ports('1-100'), 10)
+    schedule.rebuild(hosts, 0)
+    pairs, slices = run_cycle(schedule, 0, 10)
+    assert Counter(pairs) == Counter({(host, port): 1 for host in hosts for port in range(1, 101)})
+    assert slices == [40] * 10
+    assert schedule.finish_cycle()
+    assert not schedule.finish_cycle()
+
+def test_next_cycle_starts_after_the_interval():
+    hosts = clean_up_ips('10.0.0.1-2')
+    schedule = Schedule(clean_up_ports('1-20'), 10)
+    schedule.rebuild(hosts, 0)
+    first, _ = run_cycle(schedule, 0, 10)
+    second, _ = run_cycle(schedule, 10, 10)
+    assert sorted(first) == sorted(second)
+    assert len(second) == 40
+
+def test_unchanged_hosts_keep_their_place():
+    hosts = clean_up_ips('10.0.0.0/30')
+    schedule = Schedule(clean_up_ports('1-100'), 10, randomize=True)
+    schedule.rebuild(hosts, 0)
+    pairs, _ = run_cycle(schedule, 0, 5)
+    schedule.rebuild(clean_up_ips('10.0.0.0/30'), 5)
+    rest, _ = run_cycle(schedule, 5, 5)
+    assert len(pairs + rest) == len(set(pairs + rest)) == 400
+
+def test_hosts_joining_mid_cycle_get_every_port_once():
+    schedule = Schedule(clean_up_ports('1-100'), 10, randomize=True, seed=7)
+    schedule.rebuild(clean_up_ips('10.0.0.1-2'), 0)
+    pairs, _ = run_cycle(schedule, 0, 4)
+    schedule.rebuild(clean_up_ips('10.0.0.2-3'), 4)
+    rest, _ = run_cycle(schedule, 4, 6)
+    counts = Counter(host for host, _ in pairs + rest)
+    assert counts['10.0.0.2'] == counts['10.0.0.3'] == 100
+    assert counts['10.0.0.1'] < 100
+    assert len(set(pairs + rest)) == len(pairs + rest)
+    assert schedule.finished()
+
+def test_randomized_order_is_kept_between_cycles():
+    hosts = clean_up_ips('10.0.0.1')
+    schedule = Schedule(clean_up_ports('1-50'), 5, randomize=True)
+    schedule.rebuild(hosts, 0)
+    first, _ = run_cycle(schedule, 0, 5)
+    second, _ = run_cycle(schedule, 5, 5)
+    assert first == second
+    assert [schedule.port_step(port) for _, port in first] == list(range(50))
+
+def test_slice_contains_only_its_pairs():
+    schedule = Schedule(clean_up_ports('1-10'), 10)
+    schedule.rebuild(clean_up_ips('10.0.0.1-2'), 0)
+    due = schedule.due(0)
+    assert ('10.0.0.1', 1) in due and ('10.0.0.2', 1) in due
+    assert ('10.0.0.1', 2) not in due and ('10.0.0.3', 1) not in due
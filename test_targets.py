@@ -0,0 +1,78 @@
+'''Tests for the target space, run with python -m pytest'''
+import pytest
+
+from targets import AddressSet, IntervalSet, TargetSpace, clean_up_ips, clean_up_ports
+
+def test_interval_set_merges_overlapping_and_touching():
+    intervals = IntervalSet([(10, 20), (5, 9), (15, 30), (40, 40)])
+    intervals.add(41, 45)
+    intervals.add(100)
+    assert intervals.merged() == [(5, 30), (40, 45), (100, 100)]
+    assert len(intervals) == 26 + 6 + 1
+
+def test_interval_set_indexes_without_expanding():
+    intervals = IntervalSet([(1, 3), (10, 12)])
+    assert list(intervals) == [1, 2, 3, 10, 11, 12]
+    assert [intervals[index] for index in range(len(intervals))] == list(intervals)
+    assert intervals[-1] == 12
+    assert intervals.index(11) == 4
+    assert 11 in intervals and 5 not in intervals
+    with pytest.raises(IndexError):
+        intervals[6]
+    with pytest.raises(ValueError):
+        intervals.index(5)
+
+def test_clean_up_ports():
+    ports = clean_up_ports('80,22,1-1024,443,8080-8081')
+    assert ports.merged() == [(1, 1024), (8080, 8081)]
+    assert len(clean_up_ports('1-65535')) == 65535
+
+def test_clean_up_ips_keeps_networks_as_intervals():
+    hosts = clean_up_ips('10.0.0.0/8,10.1.2.3,192.168.1.1-3,example.com')
+    assert hosts.addresses.merged() == [(167772160, 184549375), (3232235777, 3232235779)]
+    assert len(hosts) == 2 ** 24 + 3 + 1
+    assert '10.255.255.255' in hosts and '192.168.1.4' not in hosts
+    assert hosts[-1] == 'example.com'
+    assert hosts.index('192.168.1.2') == 2 ** 24 + 1
+
+def test_address_set_iterates_as_strings():
+    hosts = AddressSet(['127.0.0.2', 'localhost', '127.0.0.1', '127.0.0.2'])
+    assert list(hosts) == ['127.0.0.1', '127.0.0.2', 'localhost']
+    assert hosts.index('localhost') == 2
+
+def test_target_space_is_port_major():
+    space = TargetSpace(clean_up_ips('127.0.0.1-2'), clean_up_ports('80-81'))
+    assert list(space) == [('127.0.0.1', 80), ('127.0.0.2', 80),
+                           ('127.0.0.1', 81), ('127.0.0.2', 81)]
+
+@pytest.mark.parametrize('size', [1, 2, 7, 12, 97, 1000])
+def test_randomized_order_visits_every_pair_once(size):
+    space = TargetSpace(clean_up_ips('10.0.0.1'), clean_up_ports(f'1-{size}'), randomize=True)
+    pairs = list(space)
+    assert len(pairs) == len(set(pairs)) == size
+    assert sorted(pairs) == sorted(TargetSpace(space.hosts, space.ports))
+
+def test_step_undoes_the_stride():
+    space = TargetSpace(clean_up_ips('10.0.0.0/29'), clean_up_ports('1-50'), randomize=True)
+    for step, (host, port) in enumerate(space):
+        assert space.step(host, port) == step
+
+def test_same_seed_same_order():
+    hosts, ports = clean_up_ips('10.0.0.0/28'), clean_up_ports('1-100')
+    first = TargetSpace(hosts, ports, randomize=True)
+    second = TargetSpace(hosts, ports, randomize=True, seed=first.seed)
+    assert list(first) == list(second)
+
+def test_steps_split_the_order():
+    space = TargetSpace(clean_up_ips('10.0.0.0/30'), clean_up_ports('1-25'), randomize=True)
+    runs = [space.steps(start, start + 30) for start in range(0, len(space), 30)]
+    assert sum(len(run) for run in runs) == len(space)
+    assert [pair for run in runs for pair in run] == list(space)
+
+def test_remaining_skips_done_steps():
+    space = TargetSpace(clean_up_ips('10.0.0.0/30'), clean_up_ports('1-25'), randomize=True)
+    done = IntervalSet([(0, 9), (40, 59), (99, 99)])
+    left = space.remaining(done)
+    order = list(space)
+    assert len(left) == len(space) - 31
+    assert list(left) == [pair for step, pair in enumerate(order) if step not in done]
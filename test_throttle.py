@@ -0,0 +1,81 @@
+'''Tests for the scan throttle, run with python -m pytest'''
+import asyncio
+import errno
+import threading
+import time
+
+import pytest
+
+from throttle import Throttle
+
+def test_reserve_goes_into_debt_at_the_rate():
+    throttle = Throttle(rate=100)
+    waits = [throttle.reserve('10.0.0.1') for _ in range(25)]
+    # The bucket holds a twentieth of a second, so 5 go straight away and each
+    # one after is due a hundredth of a second after the last
+    assert waits[:5] == [0] * 5
+    assert waits[-1] == pytest.approx(0.2, abs=0.02)
+
+def test_host_rate_is_kept_per_host():
+    throttle = Throttle(host_rate=20)
+    first = [throttle.reserve('10.0.0.1') for _ in range(3)]
+    other = throttle.reserve('10.0.0.2')
+    assert first[0] == 0 and first[2] > first[1] > 0
+    assert other == 0
+
+def test_acquire_paces_threads_to_the_rate():
+    throttle = Throttle(rate=200)
+    throttle.start(4)
+    started = time.monotonic()
+    threads = [threading.Thread(target=lambda: [run(throttle) for _ in range(25)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 100 connects at 200 a second, less the first bucketful
+    assert 0.4 <= time.monotonic() - started < 1
+
+def run(throttle):
+    throttle.acquire('10.0.0.1')
+    throttle.release('10.0.0.1', errno.ECONNREFUSED)
+
+def test_window_halves_on_congestion_and_grows_back():
+    throttle = Throttle(congestion=True)
+    throttle.start(64)
+    for _ in range(64):
+        throttle.acquire('10.0.0.1')
+        throttle.release('10.0.0.1', errno.EMFILE)
+    assert throttle.window == 32
+    for _ in range(32):
+        throttle.acquire('10.0.0.1')
+        throttle.release('10.0.0.1', 0)
+    assert throttle.window == 34
+
+def test_window_holds_back_waiters_until_release():
+    throttle = Throttle(congestion=True)
+    throttle.start(1)
+    throttle.acquire('10.0.0.1')
+    entered = threading.Event()
+    waiter = threading.Thread(target=lambda: (throttle.acquire('10.0.0.1'), entered.set()))
+    waiter.start()
+    assert not entered.wait(0.1)
+    throttle.release('10.0.0.1', 0)
+    assert entered.wait(1)
+    waiter.join()
+
+def test_async_waiters_are_woken_by_release():
+    async def scan():
+        throttle = Throttle(congestion=True)
+        throttle.start(2)
+        peak = 0
+
+        async def connect():
+            nonlocal peak
+            await throttle.acquire_async('10.0.0.1')
+            peak = max(peak, throttle.in_flight)
+            await asyncio.sleep(0.01)
+            throttle.release('10.0.0.1', 0)
+        await asyncio.wait_for(asyncio.gather(*(connect() for _ in range(10))), 5)
+        return peak
+    assert asyncio.run(scan()) == 2
@@ -0,0 +1,202 @@
+'''This class is built to sit between the scan threads and the network so that the
+scan, rather than the operating system, decides how hard to push. It combines a
+global token bucket for connects per second, a token bucket per host, and an
+AIMD (additive increase, multiplicative decrease) window on how many connects
+can be in flight. The window halves when timeouts spike or when the system starts
+refusing resources (ECONNRESET, EAGAIN, EMFILE...), and grows back a little at a
+time while the scan is healthy, much like TCP's own congestion control.
+
+Nothing polls. A connect reserves its tokens up front, letting the buckets go
+into debt, and sleeps once for exactly as long as the debt takes to pay off, so
+connects come due one after another at the rate. Waiting for room in the window
+is woken by the connect that frees the room.'''
+import errno
+import threading
+import time
+from collections import deque
+
+# Errors which mean the scanner itself, or something between it and the hosts,
+# is overwhelmed rather than that the port is closed
+CONGESTION_ERRORS = {errno.ECONNRESET, errno.EAGAIN, errno.EMFILE, errno.ENFILE,
+                     errno.ENOBUFS, errno.EADDRNOTAVAIL}
+
+# How much the timeout rate of a window has to rise above the running average to
+# count as a spike, a host that never answers is a steady rate rather than a spike
+TIMEOUT_SPIKE = 0.2
+
+# The fraction of a window's connects failing with congestion errors that backs off
+CONGESTION_THRESHOLD = 0.01
+
+class Throttle:
+    '''Rate is the most connects per second across the whole scan and host rate the
+    most per second to any one host, either can be left as None for no limit. With
+    congestion control on, the window starts at the number of threads the scanner
+    was given and is evaluated every time a full window of connects has finished.
+    The scan threads call acquire before connecting and the coroutines acquire
+    async, which wait for their turn and take a slot in the window, then hand it
+    back with release.'''
+    def __init__(self, rate=None, host_rate=None, congestion=False, verbosity=0):
+        self.rate = rate
+        self.host_rate = host_rate
+        self.congestion = congestion
+        self.verbosity = verbosity
+
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
+        self.waiters = deque()
+        self.tokens = self.burst(rate)
+        self.last_refill = time.monotonic()
+        self.host_tokens = {}
+
+        self.max_window = None
+        self.window = None
+        self.in_flight = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.timeout_average = None
+        self.window_started = time.monotonic()
+        self.current_rate = 0
+
+    @staticmethod
+    def burst(rate):
+        '''The bucket size for a rate, a twentieth of a second's worth so the connects
+        are spread out rather than sent in one burst each second'''
+        return max(1, rate / 20) if rate else 0
+
+    def start(self, num_threads):
+        '''Sets the window to the number of threads the scanner is running'''
+        with self.lock:
+            self.max_window = num_threads
+            self.window = num_threads
+
+    def refill(self, host, now):
+        '''Tops up the global bucket and the host's bucket for the time that passed'''
+        if self.rate:
+            self.tokens = min(self.burst(self.rate),
+                              self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+        if self.host_rate:
+            tokens, last = self.host_tokens.get(host, (self.burst(self.host_rate), now))
+            self.host_tokens[host] = (min(self.burst(self.host_rate),
+                                          tokens + (now - last) * self.host_rate), now)
+
+    def reserve(self, host):
+        '''Takes a token from the global bucket and the host's bucket for a connect
+        to host, and returns how many seconds until the connect is due, which is
+        however long the buckets take to earn back what they're owed'''
+        with self.lock:
+            self.refill(host, time.monotonic())
+            wait = 0
+            if self.rate:
+                self.tokens -= 1
+                wait = max(wait, -self.tokens / self.rate)
+            if self.host_rate:
+                tokens, last = self.host_tokens[host]
+                self.host_tokens[host] = (tokens - 1, last)
+                wait = max(wait, (1 - tokens) / self.host_rate)
+            return wait
+
+    def enter(self):
+        '''Takes a slot in the window if there's room, called with the lock held'''
+        if self.window and self.in_flight >= self.window:
+            return False
+        self.in_flight += 1
+        return True
+
+    def acquire(self, host):
+        '''Blocks the calling thread until a connect to host may go ahead'''
+        wait = self.reserve(host)
+        if wait > 0:
+            time.sleep(wait)
+        with self.lock:
+            while not self.enter():
+                self.released.wait()
+
+    async def acquire_async(self, host):
+        '''Waits, without blocking the event loop, until a connect to host may go
+        ahead. The coroutines waiting for room in the window each wait on a future
+        of their own, which release resolves in turn.'''
+        import asyncio
+        wait = self.reserve(host)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        while True:
+            with self.lock:
+                if self.enter():
+                    return
+                waiter = asyncio.get_running_loop().create_future()
+                self.waiters.append(waiter)
+            await waiter
+
+    def release(self, host, result):
+        '''Hands back the slot taken for a connect to host, along with the errno the
+        connect ended with, 0 for an open port'''
+        with self.lock:
+            self.in_flight -= 1
+            self.completed += 1
+            if result == errno.ETIMEDOUT:
+                self.timeouts += 1
+            elif result in CONGESTION_ERRORS:
+                self.errors += 1
+            if self.window and self.completed >= self.window:
+                self.adjust()
+            room = self.window - self.in_flight if self.window else 1
+            if room > 0:
+                self.released.notify(room)
+            while room > 0 and self.waiters:
+                waiter = self.waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    room -= 1
+
+    def adjust(self):
+        '''Called with the lock held each time a full window of connects completes,
+        halving the window on a timeout spike or congestion errors and otherwise
+        growing it by a thirty second of its largest size'''
+        now = time.monotonic()
+        timeout_rate = self.timeouts / self.completed
+        spiked = (self.timeout_average is not None
+                  and timeout_rate - self.timeout_average > TIMEOUT_SPIKE)
+        congested = self.errors / self.completed > CONGESTION_THRESHOLD
+        old_window = self.window
+
+        if self.congestion and (spiked or congested):
+            self.window = max(1, self.window // 2)
+        elif self.congestion:
+            self.window = min(self.max_window,
+                              self.window + max(1, self.max_window // 32))
+
+        self.current_rate = self.completed / max(now - self.window_started, 1e-6)
+        if self.verbosity >= 1 and self.window != old_window:
+            print(f'[~] {self.current_rate:.0f} connects/s, window {old_window} -> '
+                  f'{self.window} ({self.timeouts} timeouts, {self.errors} errors '
+                  f'in {self.completed} connects)')
+        elif self.verbosity >= 2:
+            print(f'[~] {self.current_rate:.0f} connects/s, window {self.window}')
+
+        if self.timeout_average is None:
+            self.timeout_average = timeout_rate
+        else:
+            self.timeout_average = 0.75 * self.timeout_average + 0.25 * timeout_rate
+        self.completed = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.window_started = now
+
+    def __str__(self):
+        limits = []
+        if self.rate:
+            limits.append(f'{self.rate:g} connects/s')
+        if self.host_rate:
+            limits.append(f'{self.host_rate:g} connects/s per host')
+        limits.append(f'window {self.window} of {self.max_window}')
+        return (f'Throttle: {", ".join(limits)}, '
+                f'last measured {self.current_rate:.0f} connects/s')
+
+def build_throttle(args):
+    '''Returns a Throttle if any of the rate or congestion options were used,
+    otherwise None so the scan runs unthrottled as before'''
+    if not (args.rate or args.host_rate or args.congestion):
+        return None
+    return Throttle(args.rate, args.host_rate, args.congestion, args.verbosity)
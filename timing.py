@@ -0,0 +1,70 @@
+'''This class is built for adapting the connect timeout of each host to how quickly
+that host actually answers. It follows the retransmission timer TCP itself uses
+(RFC 6298), keeping a smoothed round trip time and its variance from every connect
+which got an answer, and setting the timeout a few variances above the average.'''
+import threading
+
+# Gains and variance multiplier from RFC 6298
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+class RttEstimator:
+    '''Until the first round trip is measured the timeout is the one the user set.
+    After that it's the smoothed round trip time plus four times its variance,
+    clamped between the minimum and maximum timeouts so a burst of very fast
+    answers can't starve a slower port and a slow host can't stall the scan.
+    Updates come from many scan threads, so they're made under a lock.'''
+    def __init__(self, initial_timeout, min_timeout, max_timeout):
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.lock = threading.Lock()
+
+    def update(self, rtt):
+        '''Folds a measured round trip time, in seconds, into the estimate'''
+        with self.lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+                self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+            self.samples += 1
+
+    def timeout(self):
+        '''Returns the connect timeout to use for the next connect to the host'''
+        if self.srtt is None:
+            return self.initial_timeout
+        return min(max(self.srtt + K * self.rttvar, self.min_timeout), self.max_timeout)
+
+    def __str__(self):
+        if self.srtt is None:
+            return f'{self.timeout():.3f}s (no round trips measured)'
+        return (f'{self.timeout():.3f}s (srtt {self.srtt * 1000:.2f}ms, '
+                f'rttvar {self.rttvar * 1000:.2f}ms, {self.samples} samples)')
+
+class RttTable:
+    '''Maps hosts to their RttEstimator for the scan engines, calling make to create
+    a host's estimator the first time it's asked for, so only the hosts a scan has
+    actually reached hold one. Items are the estimators created so far.'''
+    def __init__(self, make):
+        self.make = make
+        self.estimators = {}
+        self.lock = threading.Lock()
+
+    def get(self, host):
+        '''Returns the host's estimator, creating it if need be'''
+        estimator = self.estimators.get(host)
+        if estimator is None:
+            with self.lock:
+                estimator = self.estimators.get(host)
+                if estimator is None:
+                    estimator = self.estimators[host] = self.make(host)
+        return estimator
+
+    def items(self):
+        return list(self.estimators.items())